@@ -0,0 +1,36 @@
+"""
+Issues a new API key for an account, replacing its old one.
+
+Requests act on an account other than the default with the headers
+X-Account-Id: <id> and X-Account-Key: <key>. Accounts created before keys
+existed need one from here.
+    python account_key.py <account_id>
+"""
+import sys
+from pathlib import Path
+from dotenv import load_dotenv
+
+load_dotenv(dotenv_path=Path(__file__).parent / '.env')
+
+from sqlmodel import Session
+
+from database import write_engine
+from db_models import Account
+from services.accounts import new_account_key
+
+
+def main():
+    if len(sys.argv) != 2 or not sys.argv[1].isdigit():
+        raise SystemExit("Usage: python account_key.py <account_id>")
+    with Session(write_engine) as session:
+        account = session.get(Account, int(sys.argv[1]))
+        if not account:
+            raise SystemExit(f"❌ Account {sys.argv[1]} not found")
+        key = new_account_key(account)
+        session.add(account)
+        session.commit()
+    print(f"🔑 New key for account {sys.argv[1]} (shown once): {key}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Offline load test of the LLM analysis path (model fallback + JSON extraction).
+
+Replays recorded OpenRouter traffic (LLM_RECORD_MODE=record writes it) through
+analyze_email_with_openrouter with the original latencies, no network involved.
+Without a recording it writes a synthetic one first: rate-limited primary model,
+slow fenced-JSON answers, malformed JSON, the odd refusal and timeout.
+
+Each run happens twice: without a time budget (every model gets the full 45s),
+then with the per-email budget, to show what the deadline does to tail latency.
+
+Usage: python bench_llm_replay.py [recordings.jsonl.gz or ""] [emails] [concurrency] [budget seconds]
+LLM_REPLAY_SPEED divides the recorded latencies and the budget (default 10 here);
+the numbers printed are scaled back to real seconds.
+"""
+import io
+import os
+import sys
+import json
+import random
+import tempfile
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+PATH = sys.argv[1] if len(sys.argv) > 1 and sys.argv[1] else os.path.join(tempfile.mkdtemp(prefix="llm_replay_"), "synthetic.jsonl.gz")
+EMAILS = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+CONCURRENCY = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+
+os.environ["LLM_RECORD_MODE"] = "replay"
+os.environ["LLM_RECORD_PATH"] = PATH
+SPEED = float(os.environ.setdefault("LLM_REPLAY_SPEED", "10"))
+# The minimum attempt time runs on the same sped-up clock as the replay
+os.environ.setdefault("LLM_MIN_ATTEMPT_SECONDS", str(3 / SPEED))
+
+from services.llm_recorder import llm_recorder, LLMRecorder
+from services.ai_agent import analyze_email_with_openrouter, FREE_MODELS
+from services.structured_output import output_stats
+from services.deadlines import Deadline, ROUTE_BUDGET_SECONDS
+
+BUDGET = float(sys.argv[4]) if len(sys.argv) > 4 else ROUTE_BUDGET_SECONDS["analyze-email"]
+
+
+def chat_body(content: str) -> str:
+    return json.dumps({"choices": [{"message": {"content": content}}]})
+
+
+def write_synthetic(path: str, per_model: int = 40):
+    random.seed(7)
+    writer = LLMRecorder(mode="record", path=path)
+    analysis = {
+        "category": "Support", "summary": "Customer asks about an order.", "sentiment": "Neutral", "urgency": 6,
+        "action_items": [{"description": "Check order", "priority": "High"}], "suggested_reply": "Hi, ...",
+    }
+    for rank, model in enumerate(FREE_MODELS):
+        for i in range(per_model):
+            roll = random.random()
+            if rank == 0 and roll < 0.5:
+                writer.record(model, f"{model}:{i}", random.uniform(150, 400), 429, '{"error":{"message":"Rate limit exceeded"}}')
+            elif roll < 0.05:
+                writer.record(model, f"{model}:{i}", 45000, 0, "", error="Read timed out. (read timeout=45)")
+            elif roll < 0.08:
+                writer.record(model, f"{model}:{i}", random.uniform(800, 3000), 200, chat_body("I'm sorry, I can't help with that."))
+            elif roll < 0.25:
+                # Near-misses the repair parser handles: single quotes, trailing commas, truncation
+                broken = random.choice([
+                    json.dumps(analysis).replace('"', "'"),
+                    json.dumps(analysis)[:-1] + ",}",
+                    json.dumps(analysis)[:120],
+                ])
+                writer.record(model, f"{model}:{i}", random.lognormvariate(7.8, 0.4), 200, chat_body(broken))
+            else:
+                content = "```json\n" + json.dumps(analysis) + "\n```"
+                # Mostly a few seconds, with a slow tail from overloaded providers
+                latency = random.uniform(20000, 44000) if random.random() < 0.1 else random.lognormvariate(7.8, 0.4)
+                writer.record(model, f"{model}:{i}", latency, 200, chat_body(content))
+    print(f"Wrote synthetic recording with {writer.recorded} exchanges to {path}")
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def analyze(i: int, budget: float):
+    started = time.perf_counter()
+    result = analyze_email_with_openrouter(
+        f"Customer {i} <c{i}@example.com>", f"Order #{1000 + i}", "Where is my order?",
+        deadline=Deadline(budget / SPEED, "bench"),
+    )
+    return (time.perf_counter() - started) * SPEED, result
+
+
+def run(label: str, budget: float):
+    llm_recorder.load() # Same replay order for every run
+    calls_before = llm_recorder.replayed
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()), ThreadPoolExecutor(CONCURRENCY) as pool:
+        results = list(pool.map(lambda i: analyze(i, budget), range(EMAILS)))
+    elapsed = time.perf_counter() - started
+
+    seconds = [s for s, _ in results]
+    degraded = [analysis.degraded for _, analysis in results]
+    calls = llm_recorder.replayed - calls_before
+    print(f"{label}:")
+    print(f"  wall time: {elapsed:.2f}s ({EMAILS / elapsed:.1f} emails/s at x{SPEED:g})")
+    print(f"  latency s: p50 {percentile(seconds, 50):.1f}, p95 {percentile(seconds, 95):.1f}, "
+          f"p99 {percentile(seconds, 99):.1f}, max {max(seconds):.1f}")
+    print(f"  model calls: {calls} ({calls / EMAILS:.2f} per email)")
+    print(f"  deadline misses: {degraded.count('deadline')}, all models failed: {degraded.count('error')}")
+
+
+def main():
+    if not os.path.exists(PATH):
+        write_synthetic(PATH)
+    print(f"Replaying {PATH}: {EMAILS} emails, concurrency {CONCURRENCY}, speed x{SPEED:g}")
+    run("No budget (45s per attempt)", 1e6)
+    run(f"Budget {BUDGET:g}s per email", BUDGET)
+
+    print("Replies per model, both runs (clean / repaired / unusable):")
+    for model, counts in output_stats.get_stats().items():
+        print(f"  {model:<48} {counts['clean']:4} / {counts['repaired']:4} / {counts['failed']:4}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Caller-side cost of logging per request: print + synchronous file logging (the old
+path) vs the queue-backed pipeline in services/log_pipeline.py.
+
+Each simulated request logs LINES_PER_REQUEST lines (a third of them raw model output
+at debug, as in ai_agent) with IO_MS of waiting spread between them, like a request
+that spends its time in Gmail/LLM calls. Only the time spent inside logging calls is
+counted. THREADS requests run concurrently.
+
+Both paths write stdout (redirected to a file) plus a log file. Stdout is run twice:
+as a plain file, and with SINK_DELAY_US per write, like a container log pipe that
+is backed up. The old path waits for every write; the pipeline's listener does.
+
+Usage: python bench_logging.py [requests_per_thread] [threads] [sink_delay_us]
+"""
+import os
+import sys
+import time
+import logging
+import tempfile
+import threading
+import statistics
+
+os.environ.setdefault("LOG_LEVEL", "DEBUG") # Same lines as the old DEBUG file log, before sampling
+
+from services import log_pipeline
+from services.log_pipeline import configure_logging, shutdown_logging, get_logger, correlation
+
+REQUESTS = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+THREADS = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+SINK_DELAY_US = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+LINES_PER_REQUEST = 30
+IO_MS = 30
+RAW_RESPONSE = '{"category": "Support", "urgency": 6, "summary": "' + "Customer asks about a delayed order. " * 12 + '"}'
+
+
+class SlowSink:
+    """File-backed stream where every write takes at least delay_us."""
+
+    def __init__(self, path: str, delay_us: int):
+        self.file = open(path, "w", encoding="utf-8")
+        self.delay = delay_us / 1e6
+
+    def write(self, text: str):
+        if self.delay:
+            time.sleep(self.delay)
+        return self.file.write(text)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def old_line(file_logger: logging.Logger, i: int, n: int):
+    if n % 3 == 0:
+        file_logger.debug(f"Raw response from model {n}: {RAW_RESPONSE}")
+    elif n % 3 == 1:
+        print(f"🤖 Analyzing email: Order #{i} delayed (step {n})")
+    else:
+        file_logger.info(f"Success with model-{n}")
+
+
+def new_line(logger: logging.Logger, i: int, n: int):
+    if n % 3 == 0:
+        logger.debug("Raw response from model %s: %s", n, RAW_RESPONSE)
+    elif n % 3 == 1:
+        logger.info("🤖 Analyzing email: Order #%s delayed (step %s)", i, n)
+    else:
+        logger.info("Success with model-%s", n, extra={"model": f"model-{n}"})
+
+
+def run(log_line, logger, tag: str) -> list:
+    """Seconds spent in logging calls, per request."""
+    timings = []
+    lock = threading.Lock()
+    gap = IO_MS / 1000 / LINES_PER_REQUEST
+
+    def worker(t: int):
+        local = []
+        for i in range(REQUESTS):
+            spent = 0.0
+            with correlation(request_id=f"{tag}-{t}-{i}"):
+                for n in range(LINES_PER_REQUEST):
+                    started = time.perf_counter()
+                    log_line(logger, i, n)
+                    spent += time.perf_counter() - started
+                    time.sleep(gap)
+            local.append(spent)
+        with lock:
+            timings.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(t,)) for t in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(timings)
+
+
+def run_old(workdir: str, stdout_sink) -> list:
+    # print() to stdout plus a basicConfig-style FileHandler at DEBUG, both synchronous
+    file_logger = logging.getLogger("bench.old")
+    file_logger.setLevel(logging.DEBUG)
+    file_logger.propagate = False
+    handler = logging.FileHandler(os.path.join(workdir, "old.log"), encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+    file_logger.addHandler(handler)
+    real_stdout, sys.stdout = sys.stdout, stdout_sink
+    try:
+        return run(old_line, file_logger, "old")
+    finally:
+        sys.stdout = real_stdout
+        file_logger.removeHandler(handler)
+        handler.close()
+
+
+def run_new(workdir: str, stdout_sink):
+    # JSON records to stdout and a rotating file from the listener thread (DEBUG sampled per LOG_SAMPLE_RATES)
+    configure_logging(stream=stdout_sink, log_file=os.path.join(workdir, "new.log"))
+    before = log_pipeline.get_stats()
+    timings = run(new_line, get_logger("bench"), "new")
+    after = log_pipeline.get_stats()
+    stats = {key: after[key] - before[key] for key in ("queued", "sampled_out", "dropped")}
+    drain_started = time.perf_counter()
+    shutdown_logging()
+    return timings, stats, time.perf_counter() - drain_started
+
+
+def report(name: str, timings: list):
+    p50 = statistics.median(timings) * 1e6
+    p99 = timings[int(len(timings) * 0.99) - 1] * 1e6
+    print(f"    {name:<18} p50 {p50:8.0f} us  p99 {p99:8.0f} us  per line {p50 / LINES_PER_REQUEST:6.1f} us")
+
+
+def main():
+    workdir = tempfile.mkdtemp(prefix="bench_logging_")
+    print(f"{THREADS} threads x {REQUESTS} requests x {LINES_PER_REQUEST} lines, {IO_MS} ms of I/O per request")
+    print("Time spent in logging calls per request:")
+    for delay in (0, SINK_DELAY_US):
+        print(f"  stdout {'file' if not delay else f'sink with {delay} us per write'}:")
+        old_sink = SlowSink(os.path.join(workdir, f"old-stdout-{delay}.log"), delay)
+        old = run_old(workdir, old_sink)
+        old_sink.close()
+        new_sink = SlowSink(os.path.join(workdir, f"new-stdout-{delay}.log"), delay)
+        new, stats, drain = run_new(workdir, new_sink)
+        new_sink.close()
+
+        report("print+FileHandler", old)
+        report("queue pipeline", new)
+        print(f"    pipeline: {stats['queued']} queued, {stats['sampled_out']} sampled out, "
+              f"{stats['dropped']} dropped, drained {drain * 1000:.0f} ms after the last request; "
+              f"{statistics.median(old) / statistics.median(new):.1f}x less time per request")
+
+
+if __name__ == "__main__":
+    main()
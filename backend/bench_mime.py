@@ -0,0 +1,105 @@
+"""
+Micro-benchmark for MIME body extraction.
+
+Runs the legacy top-level text/plain decoder and services.mime_parser over the
+.eml fixtures in fixtures/mime (converted to Gmail API payloads, the way Gmail
+returns them with format='full'), plus a synthetic message with a huge body.
+
+Usage: python bench_mime.py [iterations]
+"""
+import base64
+import email
+import sys
+import time
+from email import policy
+from pathlib import Path
+
+from services.mime_parser import extract_body
+
+FIXTURE_DIR = Path(__file__).parent / "fixtures" / "mime"
+
+
+def to_gmail_payload(part):
+    """Converts a stdlib email part into a Gmail API 'full' payload dict."""
+    headers = [{"name": k, "value": str(v)} for k, v in part.items()]
+    payload = {
+        "mimeType": part.get_content_type(),
+        "filename": part.get_filename() or "",
+        "headers": headers,
+        "body": {"size": 0},
+    }
+    if part.is_multipart():
+        payload["parts"] = [to_gmail_payload(p) for p in part.iter_parts()]
+        return payload
+
+    data = part.get_payload(decode=True) or b""  # Gmail undoes the transfer encoding
+    payload["body"]["size"] = len(data)
+    if payload["filename"]:
+        payload["body"]["attachmentId"] = "att-" + payload["filename"]  # Gmail never inlines attachments
+    else:
+        payload["body"]["data"] = base64.urlsafe_b64encode(data).decode()
+    return payload
+
+
+def load_corpus():
+    corpus = {}
+    for path in sorted(FIXTURE_DIR.glob("*.eml")):
+        msg = email.message_from_bytes(path.read_bytes(), policy=policy.default)
+        corpus[path.name] = to_gmail_payload(msg)
+
+    huge_text = ("Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 20 + "\n") * 8000
+    corpus["synthetic_10mb_plain"] = {
+        "mimeType": "text/plain",
+        "filename": "",
+        "headers": [{"name": "Content-Type", "value": "text/plain; charset=utf-8"}],
+        "body": {"size": len(huge_text), "data": base64.urlsafe_b64encode(huge_text.encode()).decode()},
+    }
+    return corpus
+
+
+def legacy_extract(payload):
+    """The pre-mime_parser logic from gmail_service.fetch_recent_emails."""
+    body = ""
+    if 'parts' in payload:
+        for part in payload['parts']:
+            if part['mimeType'] == 'text/plain':
+                if 'data' in part['body']:
+                    body += base64.urlsafe_b64decode(part['body']['data']).decode()
+    elif 'body' in payload:
+        if 'data' in payload['body']:
+            body = base64.urlsafe_b64decode(payload['body']['data']).decode()
+    return body
+
+
+def bench(fn, payload, iterations):
+    try:
+        result = fn(payload)
+    except Exception as e:
+        return None, f"{type(e).__name__}"
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(payload)
+    elapsed = (time.perf_counter() - start) / iterations
+    return elapsed, result
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    corpus = load_corpus()
+
+    print(f"{'fixture':42} {'legacy':>12} {'mime_parser':>12} {'legacy chars':>13} {'new chars':>10}")
+    totals = [0.0, 0.0]
+    for name, payload in corpus.items():
+        n = max(1, iterations // 50) if name.startswith("synthetic") else iterations
+        old_t, old_result = bench(legacy_extract, payload, n)
+        new_t, new_result = bench(extract_body, payload, n)
+        old_cell = f"{old_t * 1e6:10.1f}us" if old_t is not None else f"{old_result:>12}"
+        old_len = len(old_result) if old_t is not None else 0
+        print(f"{name:42} {old_cell:>12} {new_t * 1e6:10.1f}us {old_len:13} {len(new_result):10}")
+        totals[0] += old_t or 0
+        totals[1] += new_t
+    print(f"{'total (successful legacy runs only)':42} {totals[0] * 1e6:10.1f}us {totals[1] * 1e6:10.1f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark for priority scheduling in batch analysis.
+
+Simulates a 300-email backlog (mostly newsletters, a few escalations near the end)
+with a fake LLM that takes a fixed time per email, and compares arrival-order
+scheduling with services.priority. Reports time-to-first-urgent-result (TTFU)
+and time until every urgent email has been analyzed.
+
+Usage: python bench_priority.py [llm_latency_ms] [concurrency]
+"""
+import asyncio
+import random
+import sys
+import time
+
+from models import GmailMessage
+from services.priority import run_prioritized, priority_score, knowledge_keywords
+
+BACKLOG_SIZE = 300
+URGENT_COUNT = 10
+
+
+def build_backlog():
+    random.seed(7)
+    backlog = []
+    for i in range(BACKLOG_SIZE - URGENT_COUNT):
+        backlog.append(GmailMessage(
+            id=f"n{i}",
+            sender="Weekly Digest <news@newsletter.example>",
+            subject=f"Your weekly roundup #{i}",
+            body="Top stories this week, deals and updates.",
+            headers={"List-Unsubscribe": "<https://newsletter.example/u>"},
+        ))
+    # Escalations arrive late, behind the newsletters
+    for i in range(URGENT_COUNT):
+        position = random.randint(BACKLOG_SIZE - 3 * URGENT_COUNT, len(backlog))
+        backlog.insert(position, GmailMessage(
+            id=f"u{i}",
+            sender="Dana Ortiz <dana@bigclient.com>",
+            subject="URGENT: shipment refund escalation",
+            body="Our order is still missing and we need a refund today.",
+        ))
+    return backlog
+
+
+async def run(backlog, score, latency, concurrency):
+    async def fake_llm(email_data):
+        await asyncio.sleep(latency)
+        return email_data
+
+    started = time.perf_counter()
+    first_urgent = None
+    all_urgent = None
+    seen_urgent = 0
+    async for email_data in run_prioritized(backlog, score, fake_llm, concurrency):
+        if email_data.id.startswith("u"):
+            seen_urgent += 1
+            elapsed = time.perf_counter() - started
+            first_urgent = first_urgent or elapsed
+            if seen_urgent == URGENT_COUNT:
+                all_urgent = elapsed
+    total = time.perf_counter() - started
+    return first_urgent, all_urgent, total
+
+
+def main():
+    latency = (float(sys.argv[1]) if len(sys.argv) > 1 else 20.0) / 1000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    backlog = build_backlog()
+    keywords = knowledge_keywords(["Refund policy", "Shipment delays"])
+
+    print(f"{BACKLOG_SIZE} emails, {URGENT_COUNT} urgent, {latency * 1000:.0f}ms per LLM call, concurrency {concurrency}")
+    print(f"{'scheduler':12} {'TTFU':>10} {'all urgent':>12} {'total':>10}")
+    for name, score in (("fifo", lambda m: 0), ("priority", lambda m: priority_score(m, keywords))):
+        first, last, total = asyncio.run(run(backlog, score, latency, concurrency))
+        print(f"{name:12} {first * 1000:8.0f}ms {last * 1000:10.0f}ms {total * 1000:8.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark for the /api/history response path.
+
+Builds N LoggedEmail rows in memory and compares:
+  - the old path: response_model=List[LoggedEmail] validation + jsonable_encoder + json.dumps
+  - the new path: rows_to_dicts + render_json (orjson when installed)
+Then reports the body size with gzip and brotli (if installed).
+
+Usage: python bench_responses.py [rows]
+"""
+import sys
+import json
+import gzip
+import time
+import random
+from datetime import datetime
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from db_models import LoggedEmail
+from services.responses import rows_to_dicts, render_json, orjson, brotli, GZIP_LEVEL, BROTLI_QUALITY
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+REPEAT = 5
+
+
+def build_rows():
+    random.seed(3)
+    words = "order refund invoice meeting schedule shipment delayed account password update report".split()
+    rows = []
+    for i in range(ROWS):
+        body = " ".join(random.choice(words) for _ in range(random.randint(40, 400)))
+        rows.append(LoggedEmail(
+            id=i + 1, account_id=1, gmail_message_id=f"18c{i:08x}", sender=f"Customer {i} <c{i}@example.com>",
+            subject=f"Question about order #{1000 + i}", body=body, category="Support",
+            summary="Customer asks about their order status.", sentiment="Neutral", urgency=random.randint(1, 10),
+            suggested_reply="Hi, thanks for reaching out...", action_items_json='[{"description": "Check order", "priority": "High"}]',
+            created_at=datetime(2025, 1, 1, 12, 0, i % 60), is_replied=False,
+        ))
+    return rows
+
+
+def timed(fn):
+    best = float("inf")
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000, result
+
+
+def main():
+    rows = build_rows()
+    adapter = TypeAdapter(List[LoggedEmail])
+
+    def old_path():
+        validated = adapter.validate_python(rows, from_attributes=True)
+        return json.dumps(jsonable_encoder(validated), ensure_ascii=False, separators=(",", ":")).encode()
+
+    def new_path():
+        return render_json(rows_to_dicts(rows))
+
+    old_ms, old_body = timed(old_path)
+    new_ms, new_body = timed(new_path)
+    assert json.loads(old_body) == json.loads(new_body), "fast path changed the payload"
+
+    print(f"{ROWS} rows, orjson={'yes' if orjson else 'no'}, brotli={'yes' if brotli else 'no'}")
+    print(f"  old path (validate + jsonable_encoder): {old_ms:8.1f} ms")
+    print(f"  new path (rows_to_dicts + render_json): {new_ms:8.1f} ms  ({old_ms / new_ms:.1f}x faster)")
+
+    gz_ms, gz = timed(lambda: gzip.compress(new_body, compresslevel=GZIP_LEVEL))
+    print(f"  body: {len(new_body) / 1024:8.1f} KiB raw")
+    print(f"        {len(gz) / 1024:8.1f} KiB gzip   ({len(gz) / len(new_body):.0%}, {gz_ms:.1f} ms)")
+    if brotli:
+        br_ms, br = timed(lambda: brotli.compress(new_body, quality=BROTLI_QUALITY))
+        print(f"        {len(br) / 1024:8.1f} KiB brotli ({len(br) / len(new_body):.0%}, {br_ms:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
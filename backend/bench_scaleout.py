@@ -0,0 +1,105 @@
+"""
+Multi-process check for the shared-database coordination.
+
+Starts several worker processes against one database (SQLite file by default,
+or DATABASE_URL for Postgres). All of them race to:
+  - claim the same pending outbox rows (claim_batch),
+  - take the same per-message analysis leases,
+  - upsert the same LoggedEmail rows (save_analysis).
+Afterwards it checks that every outbox row and lease was taken exactly once and
+that no message has more than one LoggedEmail row.
+
+Usage: python bench_scaleout.py [processes] [items]
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+
+ARGS = [arg for arg in sys.argv[1:] if arg != "--worker"]
+PROCESSES = int(ARGS[0]) if len(ARGS) > 0 else 4
+ITEMS = int(ARGS[1]) if len(ARGS) > 1 else 200
+ACCOUNT_ID = 1
+
+
+def worker():
+    # Imported here so every process builds its own engine from DATABASE_URL
+    from sqlmodel import Session
+    from database import engine, write_engine
+    from models import GmailMessage, EmailAnalysis
+    from services import leases, outbox
+    from services.batch_analysis import save_analysis, analysis_lease
+    # SQL echo would fill the stdout pipe and block a worker while it holds the write lock
+    engine.echo = write_engine.echo = False
+    outbox.quotas.default_factory = lambda: outbox.QuotaBucket(1e9) # Measure claiming, not quota
+    claimed, leased = [], []
+    # Start together so the processes actually race
+    time.sleep(max(0.0, float(os.environ["SCALEOUT_START_AT"]) - time.time()))
+    with Session(engine) as session:
+        while True:
+            batch = outbox.claim_batch(session)
+            if not batch:
+                break
+            claimed.extend(item.id for item in batch)
+
+        analysis = EmailAnalysis(category="Other", summary="s", sentiment="Neutral", urgency=1, action_items=[])
+        for i in range(ITEMS):
+            message = GmailMessage(id=f"m{i}", sender="a@example.com", subject=f"Message {i}", body="body")
+            if leases.try_acquire(analysis_lease(ACCOUNT_ID, message.id), 60):
+                leased.append(message.id)
+            save_analysis(ACCOUNT_ID, message, analysis)
+    print(json.dumps({"claimed": claimed, "leased": leased}))
+
+
+def main():
+    if "DATABASE_URL" not in os.environ:
+        workdir = tempfile.mkdtemp(prefix="scaleout_")
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'scaleout.db')}"
+    print(f"Database: {os.environ['DATABASE_URL']}")
+
+    from sqlmodel import Session
+    from sqlalchemy import delete
+    from database import engine, create_db_and_tables
+    from db_models import OutboxMessage, LoggedEmail, Lease
+
+    create_db_and_tables()
+    with Session(engine) as session:
+        for table in (OutboxMessage, LoggedEmail, Lease):
+            session.execute(delete(table))
+        for i in range(ITEMS):
+            session.add(OutboxMessage(account_id=ACCOUNT_ID, kind="draft", to="a@example.com", subject=f"s{i}", body="b"))
+        session.commit()
+
+    os.environ["SCALEOUT_START_AT"] = str(time.time() + 5)
+    procs = [
+        subprocess.Popen([sys.executable, __file__, "--worker", str(PROCESSES), str(ITEMS)], stdout=subprocess.PIPE, text=True)
+        for _ in range(PROCESSES)
+    ]
+    results = []
+    for proc in procs:
+        out, _ = proc.communicate()
+        results.append(json.loads(out.strip().splitlines()[-1]))
+    elapsed = time.time() - float(os.environ["SCALEOUT_START_AT"])
+
+    claimed = [i for r in results for i in r["claimed"]]
+    leased = [i for r in results for i in r["leased"]]
+    with Session(engine) as session:
+        rows = session.execute(LoggedEmail.__table__.select()).all()
+
+    print(f"{PROCESSES} processes, {ITEMS} items, {elapsed:.2f}s")
+    print(f"Outbox rows claimed: {len(claimed)} ({len(set(claimed))} distinct, expected {ITEMS})")
+    print(f"Analysis leases taken: {len(leased)} ({len(set(leased))} distinct, expected {ITEMS})")
+    print(f"LoggedEmail rows: {len(rows)} (expected {ITEMS})")
+    print(f"Claims per process: {[len(r['claimed']) for r in results]}")
+    ok = len(claimed) == len(set(claimed)) == ITEMS and len(leased) == len(set(leased)) == ITEMS and len(rows) == ITEMS
+    print("OK" if ok else "DOUBLE PROCESSING DETECTED")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    if "--worker" in sys.argv:
+        worker()
+    else:
+        main()
@@ -0,0 +1,111 @@
+"""
+Cold-start benchmark for the API.
+
+1. Import-time breakdown: runs `python -X importtime -c "import main"` in a fresh
+   interpreter and sums the self time per top-level package.
+2. Cold start: launches uvicorn against a fresh SQLite database (migrated first,
+   like a deploy would) and polls /health until the first 200. Prints the
+   server's own /api/startup-profile next to it.
+
+Usage: python bench_startup.py [runs]
+"""
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import subprocess
+import urllib.request
+from collections import defaultdict
+
+RUNS = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+TOP = 15
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def fresh_env(workdir: str) -> dict:
+    env = dict(os.environ)
+    env["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'startup.db')}"
+    env["RUN_MIGRATIONS_ON_STARTUP"] = "false"
+    env["AUTO_SYNC_SECONDS"] = "0"
+    env.pop("GOOGLE_TOKEN_JSON", None)
+    return env
+
+
+def import_breakdown(env: dict):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=HERE, env=env, capture_output=True, text=True,
+    )
+    by_package = defaultdict(int)
+    total_us = 0
+    for line in result.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        by_package[name.split(".")[0]] += int(self_us)
+        if not name.startswith(" ") and name.strip() == "main":
+            total_us = int(cumulative_us)
+    return total_us, sorted(by_package.items(), key=lambda item: -item[1])
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get_json(url: str):
+    with urllib.request.urlopen(url, timeout=1) as response:
+        return json.loads(response.read())
+
+
+def cold_start(env: dict):
+    port = free_port()
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=env["BENCH_CWD"], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            if proc.poll() is not None:
+                raise RuntimeError("uvicorn exited before becoming ready")
+            try:
+                get_json(f"http://127.0.0.1:{port}/health")
+                break
+            except OSError:
+                time.sleep(0.01)
+        ready_ms = (time.perf_counter() - started) * 1000
+        return ready_ms, get_json(f"http://127.0.0.1:{port}/api/startup-profile")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    workdir = tempfile.mkdtemp(prefix="startup_")
+    env = fresh_env(workdir)
+    env["PYTHONPATH"] = HERE
+    env["BENCH_CWD"] = workdir # Keeps logs and index files out of the source tree
+    subprocess.run([sys.executable, os.path.join(HERE, "migrate.py")], cwd=workdir, env=env, check=True, capture_output=True)
+
+    total_us, packages = import_breakdown(env)
+    print(f"import main: {total_us / 1000:.1f} ms (self time by top-level package)")
+    for name, self_us in packages[:TOP]:
+        print(f"  {name:<28} {self_us / 1000:8.1f} ms")
+
+    print(f"\nCold start to first /health 200 ({RUNS} runs):")
+    timings = []
+    for run in range(RUNS):
+        ready_ms, profile = cold_start(env)
+        timings.append(ready_ms)
+        print(f"  run {run + 1}: {ready_ms:7.1f} ms  startup-profile: {profile}")
+    timings.sort()
+    print(f"  median: {timings[len(timings) // 2]:.1f} ms, best: {timings[0]:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
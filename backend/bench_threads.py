@@ -0,0 +1,67 @@
+"""
+Prompt size per new message in a long Gmail thread: full quoted history vs
+thread-aware analysis (rolling summary + the new message without its quotes).
+
+Builds a synthetic back-and-forth where every reply quotes the whole conversation
+below it (Gmail "On ... wrote:" style with "> " prefixes), then measures the
+classification prompt each message would get in both modes.
+
+Usage: python bench_threads.py [messages]
+"""
+import sys
+import random
+
+from services.ai_agent import build_classify_prompt
+from services.threads import strip_quoted_history, THREAD_SUMMARY_MAX_CHARS
+
+MESSAGES = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+SENTENCES = [
+    "Thanks for the update on the shipment.", "Can you confirm the new delivery date?",
+    "We still need the signed purchase order before Friday.", "The invoice total looks off by one line item.",
+    "I have attached the corrected spreadsheet.", "Our warehouse closes at 5pm on weekdays.",
+    "Please loop in the account manager as well.", "Let us know if the revised quote works for you.",
+]
+
+
+def tokens(text: str) -> int:
+    return max(1, len(text) // 4) # Close enough to a BPE count for English
+
+
+def build_thread():
+    random.seed(5)
+    people = ["Dana Lee <dana@client.com>", "Ops Team <ops@ourshop.com>"]
+    bodies, history = [], ""
+    for i in range(MESSAGES):
+        sender = people[i % 2]
+        new_text = " ".join(random.choice(SENTENCES) for _ in range(random.randint(2, 5)))
+        body = new_text
+        if history:
+            quoted = "\n".join("> " + line for line in history.splitlines())
+            body += f"\n\nOn Mon, 3 Mar 2025 at {9 + i % 8}:{i % 60:02d}, {people[(i + 1) % 2]} wrote:\n{quoted}"
+        bodies.append((sender, new_text, body))
+        history = body
+    return bodies
+
+
+def main():
+    thread = build_thread()
+    full, incremental = [], []
+    for i, (sender, new_text, body) in enumerate(thread):
+        # The rolling summary grows by about a sentence per message up to its size cap
+        summary = "x" * min(150 * i, THREAD_SUMMARY_MAX_CHARS)
+        subject = "Re: Order #4711 delivery" if i else "Order #4711 delivery"
+        full.append(tokens(build_classify_prompt(sender, subject, body)))
+        stripped = strip_quoted_history(body)
+        assert stripped == new_text, f"message {i}: quoted history not fully stripped"
+        incremental.append(tokens(build_classify_prompt(sender, subject, stripped, summary or None)))
+
+    print(f"Thread of {MESSAGES} messages, prompt tokens per new message (classification prompt):")
+    print(f"  {'message':>8} {'full history':>13} {'thread-aware':>13}")
+    for i in sorted({0, 1, 4, 9, 19, MESSAGES - 1}):
+        if i < MESSAGES:
+            print(f"  {i + 1:>8} {full[i]:>13} {incremental[i]:>13}")
+    print(f"  total    {sum(full):>13} {sum(incremental):>13}  ({sum(full) / sum(incremental):.1f}x fewer)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Single-prompt vs two-tier analysis, replayed offline.
+
+Writes a synthetic recording keyed on the exact prompts of both pipelines:
+  - single prompt: a large model returns the full analysis with the reply draft
+  - two-tier: a small model returns the classification only, and the reply prompt
+    (urgent emails only) returns the draft as plain text
+Latency grows with the completion tokens (small models decode faster), and every
+response carries an OpenRouter-style usage block. Then the same emails are run
+through both pipelines and completion tokens, model calls and throughput compared.
+
+Usage: python bench_two_tier.py [emails] [concurrency]
+LLM_REPLAY_SPEED divides the recorded latencies (default 10 here).
+"""
+import io
+import os
+import sys
+import json
+import random
+import tempfile
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+EMAILS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+CONCURRENCY = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+PATH = os.path.join(tempfile.mkdtemp(prefix="two_tier_"), "synthetic.jsonl.gz")
+
+os.environ["LLM_RECORD_MODE"] = "replay"
+os.environ["LLM_RECORD_PATH"] = PATH
+SPEED = float(os.environ.setdefault("LLM_REPLAY_SPEED", "10"))
+
+from services import ai_agent
+from services.llm_recorder import llm_recorder, LLMRecorder
+from services.ai_agent import (
+    analyze_email_with_openrouter, build_analysis_prompt, build_classify_prompt, build_reply_prompt,
+    usage_stats, CLASSIFY_MODELS, REPLY_MODELS, FREE_MODELS, REPLY_EAGER_URGENCY,
+)
+
+# Decode speed in ms per completion token, plus time to first token
+LARGE_MODEL_MS = (600, 30)
+SMALL_MODEL_MS = (250, 10)
+REPLY = ("Hi,\n\nThanks for getting in touch. I have looked into your order and it left our warehouse "
+         "yesterday; you should receive a tracking link by email shortly. If it has not arrived by Friday, "
+         "reply to this email and we will send a replacement right away. Let me know if there is anything "
+         "else I can help with in the meantime.\n\nBest regards,\nThe Operations Team")
+
+
+def tokens(text: str) -> int:
+    return max(1, len(text) // 4) # Close enough to a BPE count for English
+
+
+def build_emails():
+    random.seed(11)
+    emails = []
+    for i in range(EMAILS):
+        roll = random.random()
+        category, urgency = ("Spam", 1) if roll < 0.3 else ("Other", 3) if roll < 0.6 else ("Support", 5) if roll < 0.85 else ("Support", 9)
+        emails.append({
+            "sender": f"Customer {i} <c{i}@example.com>", "subject": f"Order #{1000 + i}",
+            "body": "Where is my order? " * random.randint(5, 40), "category": category, "urgency": urgency,
+            "summary": f"Customer {i} asks where order #{1000 + i} is.",
+        })
+    return emails
+
+
+def record(writer: LLMRecorder, model: str, prompt: str, content: str, speed_ms):
+    completion = tokens(content)
+    body = json.dumps({
+        "choices": [{"message": {"content": content}}],
+        "usage": {"prompt_tokens": tokens(prompt), "completion_tokens": completion},
+    })
+    writer.record(model, prompt, speed_ms[0] + speed_ms[1] * completion, 200, body)
+
+
+def write_synthetic(emails):
+    writer = LLMRecorder(mode="record", path=PATH)
+    for email in emails:
+        analysis = {
+            "category": email["category"], "summary": email["summary"], "sentiment": "Neutral",
+            "urgency": email["urgency"], "action_items": [{"description": "Check order status", "priority": "High"}],
+        }
+        args = (email["sender"], email["subject"], email["body"])
+        record(writer, FREE_MODELS[0], build_analysis_prompt(*args, "", "Professional", ""),
+               json.dumps({**analysis, "suggested_reply": REPLY}), LARGE_MODEL_MS)
+        record(writer, CLASSIFY_MODELS[0], build_classify_prompt(*args), json.dumps(analysis), SMALL_MODEL_MS)
+        record(writer, REPLY_MODELS[0], build_reply_prompt(*args, email["summary"], "", "Professional", ""), REPLY, LARGE_MODEL_MS)
+
+
+def run(label: str, two_tier: bool, emails):
+    ai_agent.LLM_TWO_TIER = two_tier
+    llm_recorder.load()
+    usage_stats.counts.clear()
+
+    def analyze(email):
+        return analyze_email_with_openrouter(email["sender"], email["subject"], email["body"])
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()), ThreadPoolExecutor(CONCURRENCY) as pool:
+        results = list(pool.map(analyze, emails))
+    elapsed = time.perf_counter() - started
+
+    stats = usage_stats.get_stats()
+    calls = sum(s["calls"] for s in stats.values())
+    completion = sum(s["completion_tokens"] for s in stats.values())
+    prompt = sum(s["prompt_tokens"] for s in stats.values())
+    print(f"{label}:")
+    print(f"  throughput: {EMAILS / elapsed / SPEED:.2f} emails/s real time ({elapsed * SPEED:.0f}s for {EMAILS})")
+    print(f"  tokens per email: {completion / EMAILS:.0f} completion, {prompt / EMAILS:.0f} prompt")
+    per_stage = ", ".join(f"{stage} {s['calls']}" for stage, s in stats.items())
+    print(f"  model calls: {calls} ({per_stage})")
+    print(f"  replies drafted: {sum(1 for r in results if r.suggested_reply)}, degraded: {sum(1 for r in results if r.degraded)}")
+    return completion, elapsed
+
+
+def main():
+    emails = build_emails()
+    write_synthetic(emails)
+    urgent = sum(1 for e in emails if e["urgency"] >= REPLY_EAGER_URGENCY)
+    print(f"{EMAILS} emails ({urgent} at urgency >= {REPLY_EAGER_URGENCY}), concurrency {CONCURRENCY}, speed x{SPEED:g}")
+    single_tokens, single_time = run("Single prompt (classification + reply)", False, emails)
+    tier_tokens, tier_time = run("Two-tier (classification, replies for urgent emails)", True, emails)
+    print(f"Completion tokens: -{1 - tier_tokens / single_tokens:.0%}, throughput: {single_time / tier_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
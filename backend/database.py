@@ -1,5 +1,11 @@
 import os
-from sqlmodel import SQLModel, create_engine, Session
+from sqlmodel import create_engine, Session
+from sqlalchemy import event
+
+# Single-mailbox deployments keep using this account
+DEFAULT_ACCOUNT_ID = 1
+
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "15000"))
 
 # Check for DATABASE_URL environment variable (Render/Production)
 database_url = os.environ.get("DATABASE_URL")
@@ -15,13 +21,61 @@ else:
     database_url = f"sqlite:///{sqlite_file_name}"
     connect_args = {"check_same_thread": False}
 
-engine = create_engine(database_url, echo=True, connect_args=connect_args)
+if database_url.startswith("sqlite"):
+    connect_args = {"check_same_thread": False}
+
+# SQL statements are not echoed; SQL_ECHO=true logs them through services/log_pipeline
+engine = create_engine(database_url, echo=False, connect_args=connect_args)
+
+# Short write transactions that several processes race on (leases, outbox claims,
+# analysis upserts). On Postgres this is just the main engine.
+write_engine = engine
+
+if engine.dialect.name == "sqlite":
+    # Several API processes may share the SQLite file: WAL lets readers and one
+    # writer run at the same time, and the busy timeout makes writers wait for
+    # the lock instead of failing with "database is locked".
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.close()
+
+    event.listen(engine, "connect", set_sqlite_pragmas)
+
+    # A deferred SQLite transaction that reads before it writes fails at once when
+    # another process committed in between; BEGIN IMMEDIATE takes the write lock
+    # up front (waiting up to the busy timeout) so these writes never hit that.
+    write_engine = create_engine(database_url, echo=False, connect_args=connect_args)
+
+    @event.listens_for(write_engine, "connect")
+    def set_write_pragmas(dbapi_connection, connection_record):
+        set_sqlite_pragmas(dbapi_connection, connection_record)
+        dbapi_connection.isolation_level = None # We emit BEGIN ourselves
+
+    @event.listens_for(write_engine, "begin")
+    def begin_immediate(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
 
 def create_db_and_tables():
-    # Import models to register them with SQLModel metadata
+    # Schema changes are versioned migrations (see migrations.py)
+    from migrations import run_migrations
     import db_models
-    SQLModel.metadata.create_all(engine)
+    run_migrations()
+
+    # Existing rows all belong to the default account
+    with Session(engine) as session:
+        if not session.get(db_models.Account, DEFAULT_ACCOUNT_ID):
+            session.add(db_models.Account(id=DEFAULT_ACCOUNT_ID, name="Default"))
+            session.commit()
 
 def get_session():
     with Session(engine) as session:
         yield session
+
+def sql_literal(value) -> str:
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
@@ -1,10 +1,21 @@
 from typing import Optional
 from sqlmodel import Field, SQLModel
+from sqlalchemy import Index
 from datetime import datetime
 
-class LoggedEmail(SQLModel, table=True):
+class Account(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
+    email: str = Field(default="", index=True)  # Mailbox address, informational
+    name: str = ""
+    key_hash: Optional[str] = None # SHA-256 of the account's API key (see services/accounts.py)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class EmailRecord(SQLModel):
+    # Columns shared by the hot LoggedEmail table and its ArchivedEmail copy
+    id: Optional[int] = Field(default=None, primary_key=True)
+    account_id: int = Field(default=1, index=True)
     gmail_message_id: Optional[str] = Field(default=None, index=True) # Unique ID from Gmail
+    thread_id: Optional[str] = None # Gmail threadId
     sender: str
     subject: str
     body: str  # We might store just the first 500 chars if it's huge
@@ -15,22 +26,128 @@ class LoggedEmail(SQLModel, table=True):
     sentiment: str
     urgency: int
     suggested_reply: Optional[str] = None
+    # Who produced the analysis: "llm", "prefilter", "near_duplicate" or "superseded".
+    # NULL on rows analyzed before this was recorded
+    analysis_source: Optional[str] = None
+    analysis_confidence: Optional[float] = None # The pre-filter's confidence; NULL for other sources
     
     # JSON string for list of action items
     action_items_json: str = "[]"
     
+    # What suggested_reply was drafted from (see services/knowledge.py)
+    reply_settings_version: Optional[int] = None
+    reply_knowledge_version: Optional[int] = None
+    reply_knowledge_ids: Optional[str] = None # Comma-separated matching KnowledgeBase ids; "" when none matched
+    
     created_at: datetime = Field(default_factory=datetime.utcnow)
     is_replied: bool = Field(default=False)
 
+class LoggedEmail(EmailRecord, table=True):
+    # One row per Gmail message per account, even with several API processes.
+    # Existing databases get these indexes from migrations.py.
+    __table_args__ = (
+        Index("ux_loggedemail_account_message", "account_id", "gmail_message_id", unique=True),
+        Index("ix_loggedemail_account_listing", "account_id", "id"),
+        Index("ix_loggedemail_account_category_urgency", "account_id", "category", "urgency"),
+        Index("ix_loggedemail_created_at", "created_at"), # Retention scans
+        Index("ix_loggedemail_account_thread", "account_id", "thread_id"),
+    )
+
+class ArchivedEmail(EmailRecord, table=True):
+    # LoggedEmail rows past the retention age (see services/retention.py); keeps the original id
+    __table_args__ = (
+        Index("ux_archivedemail_account_message", "account_id", "gmail_message_id", unique=True),
+        Index("ix_archivedemail_account_listing", "account_id", "id"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True, sa_column_kwargs={"autoincrement": False})
+    archived_at: datetime = Field(default_factory=datetime.utcnow)
+
+class ArchiveRollup(SQLModel, table=True):
+    # Per-account, per-category totals of archived emails, so counts survive archiving
+    account_id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    category: str = Field(primary_key=True)
+    emails: int = 0
+    replied: int = 0
+
+class EmailThread(SQLModel, table=True):
+    # Rolling summary per Gmail thread; new messages are analyzed against it (see services/threads.py)
+    account_id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    thread_id: str = Field(primary_key=True)
+    summary: str = ""
+    message_count: int = 0
+    last_message_id: str = "" # Newest analyzed message
+    last_internal_date: int = 0 # Its Gmail internalDate (ms since epoch)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
 class KnowledgeBase(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
+    account_id: int = Field(default=1, index=True)
     topic: str
     content: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class AISettings(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
+    account_id: int = Field(default=1, index=True)
     tone: str = "Professional"  # Professional, Friendly, Urgent, Concise
     signature: str = ""       # e.g., "Best,\nRuchit"
     hourly_rate: float = Field(default=50.0)
+    reply_version: int = 1 # Bumped when tone or signature change
+    knowledge_version: int = 1 # Bumped when the knowledge base changes
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class OutboxMessage(SQLModel, table=True):
+    __table_args__ = (Index("ix_outboxmessage_status_due", "status", "next_attempt_at"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    account_id: int = Field(default=1, index=True)
+    kind: str = "send"  # send, draft
+    to: str
+    subject: str
+    body: str
+    email_id: Optional[int] = Field(default=None, index=True)  # LoggedEmail this replies to
+    idempotency_key: Optional[str] = Field(default=None, index=True, unique=True)  # Same key = same message, queued once
+
+    status: str = Field(default="pending", index=True)  # pending, sending, sent, failed
+    attempts: int = 0
+    next_attempt_at: datetime = Field(default_factory=datetime.utcnow)
+    last_error: Optional[str] = None
+    gmail_id: Optional[str] = None  # Message/draft ID returned by Gmail
+
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    sent_at: Optional[datetime] = None
+
+class StoredCredential(SQLModel, table=True):
+    # OAuth state shared by all API processes: "client" (credentials.json) and "token:<account_id>"
+    name: str = Field(primary_key=True)
+    value: str
     updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class EmailFingerprint(SQLModel, table=True):
+    # Near-duplicate SimHash of an LLM-analyzed LoggedEmail, shared by all API processes
+    # (see services/near_duplicate.py). Processes load rows with a higher id than they have seen
+    id: Optional[int] = Field(default=None, primary_key=True)
+    email_id: int = Field(index=True, unique=True)
+    account_id: int
+    domain: str
+    fingerprint: str # 64-bit SimHash as 16 hex digits
+
+class CachedMessage(SQLModel, table=True):
+    # Fetched Gmail message shared by all API processes until analyzed or expired (see services/message_store.py)
+    account_id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    message_id: str = Field(primary_key=True)
+    email_json: str
+    stored_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+
+class Lease(SQLModel, table=True):
+    # Named lock with an expiry; whoever holds an unexpired lease owns the work
+    name: str = Field(primary_key=True)
+    holder: str
+    expires_at: datetime = Field(index=True)
+
+class SchemaMigration(SQLModel, table=True):
+    # Versioned schema changes applied to this database (see migrations.py)
+    version: int = Field(primary_key=True)
+    name: str
+    applied_at: datetime = Field(default_factory=datetime.utcnow)
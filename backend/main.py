@@ -1,18 +1,42 @@
-from fastapi import FastAPI, Depends, HTTPException
+import time
+_import_started = time.perf_counter()
+
+from pathlib import Path
+from dotenv import load_dotenv
+
+# Read .env before anything looks at the environment (DATABASE_URL, API keys...)
+load_dotenv(dotenv_path=Path(__file__).parent / '.env')
+
+# Structured, non-blocking logging before any module logs
+from services import log_pipeline
+from services.log_pipeline import get_logger, correlation, configure_logging, shutdown_logging
+configure_logging()
+logger = get_logger("api")
+
+from fastapi import FastAPI, Depends, HTTPException, Request, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlmodel import Session, select
 from typing import List, Optional
 import json
 import asyncio
 import os
+import threading
+import uuid
+from contextlib import contextmanager
 from pydantic import BaseModel
 
-from models import EmailRequest, EmailAnalysis
-from services.ai_agent import analyze_email_with_gemini
-from database import create_db_and_tables, get_session
-from db_models import LoggedEmail, KnowledgeBase, AISettings
+from models import EmailRequest, EmailAnalysis, AccountRequest
+from services.ai_agent import analyze_email_with_gemini, deadline_analysis, usage_stats
+from database import create_db_and_tables, get_session, engine, DEFAULT_ACCOUNT_ID
+from migrations import pending_migrations
+from db_models import LoggedEmail, ArchivedEmail, KnowledgeBase, AISettings, Account
+from services.executors import gmail_executor, llm_executor, ExecutorSaturated
+from services.accounts import get_account_id, is_connected, new_account_key
+from services.responses import FastJSONResponse, CompressionMiddleware, cached_json, rows_to_dicts
+from services.credentials import import_credentials, delete_token, connected_accounts
 
-app = FastAPI(title="AI Operations Assistant API", version="1.0.0")
+app = FastAPI(title="AI Operations Assistant API", version="1.0.0", default_response_class=FastJSONResponse)
 
 # CORS - Allow the frontend to call us
 origins = [
@@ -53,319 +77,498 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Brotli/gzip for large JSON bodies (history, inbox); small and streamed responses are left alone
+app.add_middleware(CompressionMiddleware)
+
+@app.middleware("http")
+async def request_id_middleware(request: Request, call_next):
+    # Every log record written while handling the request carries its ID
+    request_id = request.headers.get("X-Request-Id") or uuid.uuid4().hex
+    with correlation(request_id=request_id):
+        response = await call_next(request)
+    response.headers["X-Request-Id"] = request_id
+    return response
+
+@app.exception_handler(ExecutorSaturated)
+async def executor_saturated_handler(request: Request, exc: ExecutorSaturated):
+    # Backpressure: tell clients when to come back instead of queueing forever
+    return JSONResponse(
+        status_code=503,
+        content={"status": "error", "message": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+# Schema changes are a deploy step (python migrate.py). Local SQLite setups keep
+# creating the schema on startup so a fresh checkout still just runs.
+RUN_MIGRATIONS_ON_STARTUP = os.environ.get(
+    "RUN_MIGRATIONS_ON_STARTUP", "false" if os.environ.get("DATABASE_URL") else "true"
+).lower() == "true"
+
+# Milliseconds spent in each startup phase, served by /api/startup-profile
+startup_profile = {}
+
+@contextmanager
+def startup_phase(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_profile[name] = round((time.perf_counter() - started) * 1000, 1)
+
 @app.on_event("startup")
 def on_startup():
-    # Startup initiated
-    print("DEBUG: Startup initiated.")
-    print(f"DEBUG: Environment Keys available: {list(os.environ.keys())}")
-    
-    token_env = os.environ.get("GOOGLE_TOKEN_JSON")
-    if token_env:
-        print(f"DEBUG: GOOGLE_TOKEN_JSON found. Length: {len(token_env)}")
-        print(f"DEBUG: First 20 chars: {token_env[:20]!r}") # !r shows if there are quotes
-        try:
-            # strip extra quotes if user accidentally added them
-            clean_token = token_env.strip()
-            if clean_token.startswith("'") and clean_token.endswith("'"):
-                clean_token = clean_token[1:-1]
-            if clean_token.startswith('"') and clean_token.endswith('"') and not clean_token.startswith('"{'): 
-                 # heuristic: if it looks like a stringified json, maybe strip. 
-                 # But valid json starts with { so "{" is valid if it's just the json string.
-                 # If it is "\"{" then it is double encoded.
-                 pass
-
-            print("Writing token.json from environment variable...")
-            with open("token.json", "w") as f:
-                f.write(clean_token)
-            print("DEBUG: Successfully wrote token.json")
-        except Exception as e:
-            print(f"CRITICAL: Failed to write token.json: {e}")
-    else:
-        print("DEBUG: GOOGLE_TOKEN_JSON is Missing or Empty!")
-
-    # Restore credentials from Env Vars if files don't exist (for Cloud Deployment)
-    if not os.path.exists("credentials.json"):
-        creds_content = os.environ.get("GOOGLE_CREDENTIALS_JSON")
-        if creds_content:
-            print("Writing credentials.json from environment variable...")
-            with open("credentials.json", "w") as f:
-                f.write(creds_content)
-
-    create_db_and_tables()
+    logger.info("Startup initiated.")
+
+    with startup_phase("schema"):
+        if RUN_MIGRATIONS_ON_STARTUP:
+            create_db_and_tables()
+        else:
+            pending = pending_migrations()
+            if pending:
+                raise RuntimeError(f"Database has pending migrations {pending}. Run: python migrate.py")
+
+    # Tokens and client credentials are kept in the database, shared by all workers
+    with startup_phase("import_credentials"):
+        import_credentials()
+
+def load_near_duplicate_index():
+    with startup_phase("near_duplicate_index"):
+        load_index()
+
+@app.on_event("startup")
+async def start_background_workers():
+    app.state.outbox_task = asyncio.create_task(outbox.outbox_worker())
+    app.state.account_task = asyncio.create_task(account_workers.account_supervisor())
+    app.state.retention_task = asyncio.create_task(retention.retention_worker())
+    app.state.reply_refresh_task = asyncio.create_task(reply_refresh.reply_refresh_worker())
+    # Loading the index can take a while on a big mailbox; serve
+    # requests meanwhile (lookups just miss until it is ready)
+    threading.Thread(target=load_near_duplicate_index, name="near-dup-index", daemon=True).start()
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    for name in ("outbox_task", "account_task", "retention_task", "reply_refresh_task"):
+        task = getattr(app.state, name, None)
+        if task:
+            task.cancel()
+
+@app.on_event("shutdown")
+def flush_logs():
+    shutdown_logging()
 
 @app.get("/health")
 def health_check():
     return {"status": "healthy"}
 
+@app.get("/api/startup-profile")
+def startup_profile_report():
+    """
+    Milliseconds spent importing main and in each startup phase.
+    """
+    return startup_profile
+
+@app.get("/api/executor-stats")
+def executor_stats():
+    """
+    Queue depth and throughput of the Gmail and LLM executors.
+    """
+    return {"gmail": gmail_executor.get_stats(), "llm": llm_executor.get_stats()}
+
+@app.get("/api/fair-share-stats")
+def fair_share_stats():
+    """
+    LLM slots held, waiting and granted per account.
+    """
+    return llm_fair_share.get_stats()
+
+@app.get("/api/accounts")
+def list_accounts(session: Session = Depends(get_session), account_id: int = Depends(get_account_id)):
+    """Lists the accounts (mailboxes) this request may act on, and whether each has a Gmail token."""
+    ids = sorted({DEFAULT_ACCOUNT_ID, account_id})
+    accounts = session.exec(select(Account).where(Account.id.in_(ids)).order_by(Account.id)).all()
+    connected = connected_accounts()
+    return [
+        {"id": account.id, "email": account.email, "name": account.name, "connected": account.id in connected}
+        for account in accounts
+    ]
+
+@app.post("/api/accounts")
+def create_account(request: AccountRequest, session: Session = Depends(get_session)):
+    """
+    Adds an account. Send its id in the X-Account-Id header and the returned key in
+    X-Account-Key to act on it. The key is only shown here.
+    """
+    account = Account(email=request.email, name=request.name)
+    key = new_account_key(account)
+    session.add(account)
+    session.commit()
+    session.refresh(account)
+    return {"status": "success", "account": account.model_dump(exclude={"key_hash"}), "key": key}
+
 @app.get("/api/gmail-status")
-def gmail_status():
-    """Check if Gmail is connected by checking if token.json exists"""
-    import os
-    token_exists = os.path.exists("token.json")
+def gmail_status(account_id: int = Depends(get_account_id)):
+    """Check if Gmail is connected by checking if the account has a stored token"""
+    token_exists = is_connected(account_id)
     return {"connected": token_exists}
 
 @app.post("/api/logout")
-def logout():
-    """Deletes token.json to disconnect Gmail"""
-    import os
+def logout(account_id: int = Depends(get_account_id)):
+    """Deletes the account's stored token to disconnect Gmail"""
     try:
-        if os.path.exists("token.json"):
-            os.remove("token.json")
+        if delete_token(account_id):
             return {"status": "success", "message": "Logged out successfully"}
         else:
             return {"status": "success", "message": "Already logged out"}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
+def history_statement(model, account_id: int, category: Optional[str], min_urgency: Optional[int]):
+    statement = select(model).where(model.account_id == account_id)
+    if category:
+        statement = statement.where(model.category == category)
+    if min_urgency is not None:
+        statement = statement.where(model.urgency >= min_urgency)
+    return statement.order_by(model.id.desc())
+
 @app.get("/api/history", response_model=List[LoggedEmail])
-def get_history(session: Session = Depends(get_session)):
+def get_history(request: Request, category: Optional[str] = None, min_urgency: Optional[int] = None, include_archived: bool = False,
+                session: Session = Depends(get_session), account_id: int = Depends(get_account_id)):
     """
-    Fetch recent analyzed emails from the database.
+    Fetch recent analyzed emails from the database, optionally by category and minimum urgency.
+    include_archived=true appends emails moved to the archive by retention (they carry archived_at).
+    Returns 304 when the client's ETag is still current.
     """
-    statement = select(LoggedEmail).order_by(LoggedEmail.id.desc())
-    results = session.exec(statement).all()
-    return results
-
-from services.gmail_service import fetch_recent_emails, send_message, create_draft
-from models import SendEmailRequest, GmailMessage
+    results = rows_to_dicts(session.exec(history_statement(LoggedEmail, account_id, category, min_urgency)).all())
+    if include_archived:
+        results += rows_to_dicts(session.exec(history_statement(ArchivedEmail, account_id, category, min_urgency)).all())
+    return cached_json(request, results)
+
+@app.get("/api/emails/{email_id}")
+def get_email(email_id: int, session: Session = Depends(get_session), account_id: int = Depends(get_account_id)):
+    """One analyzed email, from the hot table or the archive."""
+    email = session.get(LoggedEmail, email_id)
+    if email and email.account_id == account_id:
+        return {**rows_to_dicts([email])[0], "archived": False}
+    archived = retention.get_archived_email(session, account_id, email_id)
+    if archived:
+        return {**rows_to_dicts([archived])[0], "archived": True}
+    raise HTTPException(status_code=404, detail=f"Email {email_id} not found")
+
+@app.post("/api/emails/{email_id}/reply")
+async def draft_email_reply(email_id: int, regenerate: bool = False, session: Session = Depends(get_session),
+                            account_id: int = Depends(get_account_id)):
+    """
+    The email's suggested reply, drafted now if analysis skipped it (two-tier analysis
+    only drafts replies for urgent emails). The draft is cached on the email;
+    regenerate=true drafts a new one.
+    """
+    email = session.get(LoggedEmail, email_id)
+    if not email or email.account_id != account_id:
+        raise HTTPException(status_code=404, detail=f"Email {email_id} not found")
+    if email.suggested_reply and not regenerate:
+        return {"id": email.id, "suggested_reply": email.suggested_reply, "cached": True}
+
+    llm_executor.admit() # Before taking the lease, so a 503 does not leave it held
+    lease = f"reply:{account_id}:{email_id}"
+    holder = await asyncio.to_thread(leases.try_acquire, lease, ROUTE_BUDGET_SECONDS["draft-reply"])
+    if not holder:
+        raise HTTPException(status_code=409, detail="A reply for this email is already being drafted")
+    try:
+        logger.info("✍️ Drafting reply for: %s", email.subject, extra={"email_id": email_id})
+        reply = await redraft_reply(session, email, account_id)
+        if reply is None:
+            raise HTTPException(status_code=504, detail="No reply could be drafted in time, try again")
+        return {"id": email_id, "suggested_reply": reply, "cached": False}
+    finally:
+        await asyncio.to_thread(leases.release, lease, holder)
+
+@app.get("/api/retention-stats")
+def retention_stats(session: Session = Depends(get_session), account_id: int = Depends(get_account_id)):
+    """
+    Hot and archived email counts for the account, and the archiver's last run.
+    """
+    return retention.get_stats(session, account_id)
+
+from services import outbox, account_workers, retention, reply_refresh, leases
+from services.prefilter import get_prefilter
+from services.near_duplicate import near_duplicate_index, load_index
+from services.fair_scheduler import llm_fair_share
+from services.structured_output import output_stats
+from services.deadlines import Deadline, deadline_stats, ROUTE_BUDGET_SECONDS
+from services.threads import thread_stats
+from services.batch_analysis import (
+    admit_batch, resolve_messages, run_batch_analysis, iter_batch_analysis,
+    fetch_unanalyzed, get_current_settings
+)
+from services.knowledge import load_knowledge, relevant_knowledge, knowledge_context, bump_version
+from services.reply_refresh import redraft_reply
+from models import SendEmailRequest, GmailMessage, AnalyzeBatchIdsRequest, BulkReplyRequest
+
+def check_email_account(session: Session, email_id: Optional[int], account_id: int):
+    """Rejects replies that reference another account's email."""
+    if email_id is None:
+        return
+    email = session.get(LoggedEmail, email_id)
+    if not email or email.account_id != account_id:
+        raise HTTPException(status_code=404, detail=f"Email {email_id} not found")
 
 @app.post("/api/send-reply")
-def api_send_reply(request: SendEmailRequest, session: Session = Depends(get_session)):
+def api_send_reply(request: SendEmailRequest, session: Session = Depends(get_session), account_id: int = Depends(get_account_id),
+                   idempotency_key: Optional[str] = Header(default=None)):
     """
-    Sends an email reply.
+    Queues an email reply in the outbox.
+    The background sender delivers it and marks the email as replied once Gmail confirms.
     """
+    check_email_account(session, request.email_id, account_id)
     try:
-        print(f"📧 Sending reply to {request.to}...")
-        send_message(request.to, request.subject, request.body)
-        
-        # Update database if email_id is provided
-        if request.email_id:
-            email_record = session.get(LoggedEmail, request.email_id)
-            if email_record:
-                email_record.is_replied = True
-                email_record.suggested_reply = request.body # Update with actual sent body
-                session.add(email_record)
-                session.commit()
-                
-        return {"status": "success", "message": "Email sent successfully"}
+        logger.info("📧 Queueing reply to %s...", request.to)
+        item = outbox.enqueue(session, account_id, "send", request.to, request.subject, request.body, request.email_id, idempotency_key)
+        return {"status": "success", "message": "Reply queued for sending", "outbox_id": item.id}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 @app.post("/api/create-draft")
-def api_create_draft(request: SendEmailRequest):
+def api_create_draft(request: SendEmailRequest, session: Session = Depends(get_session), account_id: int = Depends(get_account_id),
+                     idempotency_key: Optional[str] = Header(default=None)):
     """
-    Creates a draft email in Gmail.
+    Queues a draft email for creation in Gmail.
     """
+    check_email_account(session, request.email_id, account_id)
     try:
-        print(f"📝 Creating draft for {request.to}...")
-        create_draft(request.to, request.subject, request.body)
-        return {"status": "success", "message": "Draft created successfully"}
+        logger.info("📝 Queueing draft for %s...", request.to)
+        item = outbox.enqueue(session, account_id, "draft", request.to, request.subject, request.body, request.email_id, idempotency_key)
+        return {"status": "success", "message": "Draft queued", "outbox_id": item.id}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
+@app.post("/api/send-approved-replies")
+def send_approved_replies(request: BulkReplyRequest, session: Session = Depends(get_session), account_id: int = Depends(get_account_id)):
+    """
+    Queues the current suggested reply of each given email for sending.
+    Emails that are already replied to or have no suggested reply (not drafted yet) are skipped.
+    """
+    try:
+        emails = session.exec(
+            select(LoggedEmail)
+            .where(LoggedEmail.account_id == account_id)
+            .where(LoggedEmail.id.in_(request.email_ids))
+        ).all()
+        queued = 0
+        for email in emails:
+            if email.is_replied or not email.suggested_reply:
+                continue
+            outbox.enqueue(session, account_id, "send", email.sender, f"Re: {email.subject}", email.suggested_reply, email.id)
+            queued += 1
+        logger.info("📧 Queued %d approved replies.", queued)
+        return {"status": "success", "message": f"Queued {queued} replies", "queued": queued, "skipped": len(request.email_ids) - queued}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+@app.get("/api/outbox")
+def get_outbox_stats(session: Session = Depends(get_session), account_id: int = Depends(get_account_id)):
+    """
+    Counts of outbox messages by delivery status.
+    """
+    return outbox.get_stats(session, account_id)
+
 class GmailInboxResponse(BaseModel):
     emails: List[GmailMessage]
     next_page_token: Optional[str] = None
 
 @app.get("/api/gmail-inbox", response_model=GmailInboxResponse)
-def get_gmail_inbox(limit: int = 10, next_page_token: Optional[str] = None, session: Session = Depends(get_session)):
+async def get_gmail_inbox(limit: int = 10, next_page_token: Optional[str] = None, session: Session = Depends(get_session), account_id: int = Depends(get_account_id)):
     """
     Fetches recent emails from Gmail (raw, without analysis).
     Automatically skips emails that have already been analyzed (logged in DB).
     Supports pagination to ensure 'limit' number of NEW emails are returned if possible.
     """
+    gmail_executor.admit()
     try:
-        current_token = next_page_token
-        valid_emails = []
-        max_attempts = 20 # Search up to 20 batches (approx 200 emails) to find unanalyzed ones
-        
-        print(f"📥 Smart Fetch: Seeking {limit} unanalyzed emails...")
+        logger.info("📥 Smart Fetch: Seeking %d unanalyzed emails...", limit)
+        result_emails, current_token, batches = await fetch_unanalyzed(session, account_id, limit, next_page_token)
 
-        for attempt in range(max_attempts):
-            if len(valid_emails) >= limit:
-                break
-                
-            # Fetch a batch. We fetch slightly more than limit (limit + 5) to increase hit rate per batch.
-            # But we must respect the user's pagination token flow.
-            # Actually, standardizing on 'limit' is safer for now.
-            batch_emails, new_token = fetch_recent_emails(limit=limit, next_page_token=current_token)
-            
-            if not batch_emails:
-                print("DEBUG: No more emails from Gmail.")
-                break # No more emails in Gmail
-                
-            # Check DB for duplicates
-            # Get IDs of this batch
-            gmail_ids = [e['id'] for e in batch_emails]
-            
-            # Query DB for existing
-            statement = select(LoggedEmail.gmail_message_id).where(LoggedEmail.gmail_message_id.in_(gmail_ids))
-            existing_ids = session.exec(statement).all()
-            existing_set = set(existing_ids)
-            
-            # Filter
-            for email in batch_emails:
-                if email['id'] not in existing_set:
-                    valid_emails.append(email)
-            
-            current_token = new_token
-            
-            # If we don't have a next page, we can't continue
-            if not current_token:
-                break
-                
-            # If we have enough, we are good.
-            # If not, the loop continues to fetch the NEXT page.
-        
-        # Trim to requested limit (in case we over-fetched)
-        result_emails = valid_emails[:limit]
-        
         # Important: The 'next_page_token' we return should be the one from the LAST successful fetch
         # so the user can continue fetching from where we stopped.
         # If we stopped in the middle of a batch, technically we are skipping the rest of that batch...
         # But this is "Smart Fetch". It's better to just return the 'current_token' which points to the NEXT batch.
-        
-        print(f"✅ Returning {len(result_emails)} unanalyzed emails after checking {attempt + 1} batches.")
-        return GmailInboxResponse(emails=result_emails, next_page_token=current_token)
+
+        logger.info("✅ Returning %d unanalyzed emails after checking %d batches.", len(result_emails), batches)
+        # Bodies come straight from parse_message, so skip re-validating them as GmailMessage
+        return FastJSONResponse({"emails": result_emails, "next_page_token": current_token})
 
     except Exception as e:
         # Return empty list on error but don't crash
-        print(f"Error fetching inbox: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error fetching inbox: %s", e)
         return GmailInboxResponse(emails=[], next_page_token=None)
 
 @app.post("/api/analyze-email", response_model=EmailAnalysis)
-async def analyze_email_api(request: EmailRequest, session: Session = Depends(get_session)):
+async def analyze_email_api(request: EmailRequest, session: Session = Depends(get_session), account_id: int = Depends(get_account_id)):
     """
     Analyzes a single email.
     """
+    llm_executor.admit()
     try:
         # Get Context & Settings
-        context = get_knowledge_context(session)
-        tone, signature = get_current_settings(session)
-
-        print(f"🤖 Analyzing single email: {request.subject}")
-        analysis = await asyncio.to_thread(
+        context = knowledge_context(relevant_knowledge(load_knowledge(session, account_id), request.subject, request.body))
+        tone, signature = get_current_settings(session, account_id)
+
+        logger.info("🤖 Analyzing single email: %s", request.subject)
+        deadline = Deadline.for_route("analyze-email") # Starts before the wait for an LLM slot
+        # Attempts only check the budget between them; the scheduler holds the route to it
+        analysis = await llm_fair_share.run(
+            account_id, llm_executor, deadline,
             analyze_email_with_gemini,
             sender=request.sender,
             subject=request.subject,
             body=request.body,
             context=context,
             tone=tone,
-            signature=signature
+            signature=signature,
+            deadline=deadline,
+            draft_reply=True # The user is looking at this email, so draft the reply now
         )
         return analysis
+    except asyncio.TimeoutError:
+        return deadline_analysis(request.subject, deadline)
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Single email analysis failed: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/analyze-batch")
-async def analyze_batch(messages: List[GmailMessage], session: Session = Depends(get_session)):
+async def analyze_batch(messages: List[GmailMessage], session: Session = Depends(get_session), account_id: int = Depends(get_account_id)):
     """
     Analyzes a specific list of Gmail messages in parallel.
+    Prefer /api/analyze-batch-ids, which avoids sending the bodies back.
     """
+    admit_batch(len(messages))
     try:
-        # 0. Get Context & Settings
-        context = get_knowledge_context(session)
-        tone, signature = get_current_settings(session)
-        
-        analyzed_count = 0
-        
-        if not messages:
-            return {"status": "success", "message": "No messages to analyze."}
-
-        # Definition helper for parallel execution
-        async def analyze_and_return(email_data):
-            # Check if already processed
-            existing_email = session.exec(
-                select(LoggedEmail).where(LoggedEmail.gmail_message_id == email_data.id)
-            ).first()
-            
-            if existing_email:
-                 print(f"⏩ Email {email_data.id} already exists. Deleting pending re-analysis.")
-                 session.delete(existing_email)
-                 session.commit() # Commit deletion immediately so we can re-add it cleanly later
-                 # return None # Don't skip anymore
-
-            print(f"🤖 Analyzing email: {email_data.subject}")
-            analysis = await asyncio.to_thread(
-                analyze_email_with_gemini,
-                sender=email_data.sender,
-                subject=email_data.subject,
-                body=email_data.body,
-                context=context,
-                tone=tone,
-                signature=signature
-            )
-            return email_data, analysis
-
-        # Run analysis in parallel
-        print(f"🚀 Starting batch analysis for {len(messages)} emails...")
-        tasks = [analyze_and_return(msg) for msg in messages]
-        results = await asyncio.gather(*tasks)
-        
-        # Save results (Sequentially)
-        for result in results:
-            if not result: continue
-            
-            email_data, analysis = result
-            
-            db_email = LoggedEmail(
-                gmail_message_id=email_data.id,
-                sender=email_data.sender,
-                subject=email_data.subject,
-                body=email_data.body,
-                category=analysis.category,
-                summary=analysis.summary,
-                sentiment=analysis.sentiment,
-                urgency=analysis.urgency,
-                suggested_reply=analysis.suggested_reply,
-                action_items_json=json.dumps([item.dict() for item in analysis.action_items])
-            )
-            session.add(db_email)
-            analyzed_count += 1
-            
-        session.commit()
-        
-        return {"status": "success", "message": f"Successfully analyzed {analyzed_count} emails."}
-        
+        return await run_batch_analysis(messages, session, account_id)
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Batch analysis failed: %s", e)
         return {"status": "error", "message": str(e)}
 
+@app.post("/api/analyze-batch-ids")
+async def analyze_batch_ids(request: AnalyzeBatchIdsRequest, session: Session = Depends(get_session), account_id: int = Depends(get_account_id)):
+    """
+    Analyzes Gmail messages by ID.
+    Bodies are resolved from the server-side message store filled by /api/gmail-inbox,
+    falling back to Gmail for any message that has been evicted.
+    """
+    admit_batch(len(request.ids))
+    try:
+        ids = list(dict.fromkeys(request.ids)) # De-duplicate, keep order
+        messages = await resolve_messages(ids, account_id)
+        result = await run_batch_analysis(messages, session, account_id)
+        skipped = len(ids) - len(messages)
+        if skipped:
+            result["skipped"] = skipped
+        return result
+    except Exception as e:
+        logger.exception("Batch analysis failed: %s", e)
+        return {"status": "error", "message": str(e)}
+
+@app.post("/api/analyze-batch-stream")
+async def analyze_batch_stream(request: AnalyzeBatchIdsRequest, account_id: int = Depends(get_account_id)):
+    """
+    Same as /api/analyze-batch-ids, but streams one NDJSON line per email as soon as it is saved.
+    Highest-priority emails are analyzed (and therefore streamed) first.
+    """
+    admit_batch(len(request.ids))
+    ids = list(dict.fromkeys(request.ids))
+    messages = await resolve_messages(ids, account_id)
+
+    async def stream():
+        # Own session: the response outlives the request dependencies
+        with Session(engine) as session:
+            try:
+                async for item in iter_batch_analysis(messages, session, account_id):
+                    yield json.dumps(item) + "\n"
+            except Exception as e:
+                logger.exception("Streamed batch analysis failed: %s", e)
+                yield json.dumps({"status": "error", "message": str(e)}) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.get("/api/prefilter-stats")
+def get_prefilter_stats(account_id: int = Depends(get_account_id)):
+    """
+    Reports how many LLM calls the account's pre-filter has skipped since startup.
+    """
+    return get_prefilter(account_id).get_stats()
+
+@app.get("/api/deadline-stats")
+def get_deadline_stats():
+    """
+    Per route: analyses run, how many ran out of their time budget, and the budget.
+    """
+    return deadline_stats.get_stats()
+
+@app.get("/api/llm-output-stats")
+def get_llm_output_stats():
+    """
+    Per model: replies parsed cleanly, parsed after repair, and unusable (which cost a fallback call).
+    """
+    return output_stats.get_stats()
+
+@app.get("/api/reply-refresh-stats")
+def get_reply_refresh_stats(session: Session = Depends(get_session), account_id: int = Depends(get_account_id)):
+    """
+    Current settings/knowledge versions, replies still drafted from older ones, and the refresher's counters.
+    """
+    return reply_refresh.get_stats(session, account_id)
+
+@app.get("/api/thread-stats")
+def get_thread_stats():
+    """
+    Thread messages analyzed against a rolling summary, superseded within a batch,
+    and the quoted history that was left out of prompts.
+    """
+    return thread_stats.get_stats()
+
+@app.get("/api/llm-usage-stats")
+def get_llm_usage_stats():
+    """
+    Model calls and prompt/completion tokens per stage: classify and reply (two-tier), or analysis.
+    """
+    return usage_stats.get_stats()
+
+@app.get("/api/logging-stats")
+def get_logging_stats():
+    """
+    Log records queued, dropped because the queue was full, and left out by sampling.
+    """
+    return log_pipeline.get_stats()
+
+@app.get("/api/near-duplicate-stats")
+def get_near_duplicate_stats():
+    """
+    Reports the size of the near-duplicate index and how many analyses it reused.
+    """
+    return near_duplicate_index.get_stats()
+
 @app.get("/api/analytics")
-def get_analytics(session: Session = Depends(get_session)):
+def get_analytics(request: Request, session: Session = Depends(get_session), account_id: int = Depends(get_account_id)):
     """
     Returns dashboard analytics data based on processed emails.
     """
     try:
-        print("DEBUG: Fetching emails")
-        emails = session.exec(select(LoggedEmail)).all()
+        emails = session.exec(select(LoggedEmail).where(LoggedEmail.account_id == account_id)).all()
         
-        total_emails = len(emails)
+        # Archived emails still count towards the totals
+        total_emails = len(emails) + retention.archived_count(session, account_id)
         
         # Heuristics for "saved" metrics
         # Assume automated processing saves ~5 mins (0.083 hrs) per email
         time_saved_hours = total_emails * 0.083
         
         # Get hourly rate setting
-        print("DEBUG: Fetching settings")
-        settings = session.exec(select(AISettings)).first()
-        # Handle case where settings might be None or hourly_rate might be missing/None
-        hourly_rate = 50.0
-        if settings:
-             # Ensure we don't crash if hourly_rate is None (e.g. schema migration issue)
-             hourly_rate = getattr(settings, 'hourly_rate', 50.0) 
-             if hourly_rate is None: hourly_rate = 50.0
-
-        print(f"DEBUG: Hourly rate: {hourly_rate}")
+        settings = session.exec(select(AISettings).where(AISettings.account_id == account_id)).first()
+        # Older rows may have a NULL rate; the column itself always exists after migrations
+        hourly_rate = settings.hourly_rate if settings and settings.hourly_rate is not None else 50.0
+
         money_saved = time_saved_hours * hourly_rate
         
         # Collect all action items
-        print("DEBUG: Processing actions")
         all_pending_actions = []
         for email in emails:
             try:
@@ -378,7 +581,7 @@ def get_analytics(session: Session = Depends(get_session)):
                         "email_id": email.id
                     })
             except Exception as e:
-                # print(f"DEBUG: Error parsing actions for email {email.id}: {e}")
+                logger.debug("Error parsing actions for email %s: %s", email.id, e)
                 continue
                 
         # Filter to show mostly High/Medium priority
@@ -386,16 +589,15 @@ def get_analytics(session: Session = Depends(get_session)):
         if not pending_actions:
             pending_actions = all_pending_actions[:5]
             
-        return {
+        return cached_json(request, {
             "time_saved_hours": round(time_saved_hours, 1),
             "money_saved": int(money_saved),
             "tasks_automated": total_emails,
             "efficiency_score_percent": min(15 + total_emails, 99),  # Dynamic score
             "pending_actions": pending_actions
-        }
+        })
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Analytics failed: %s", e)
         return {
             "time_saved_hours": 0,
             "money_saved": 0,
@@ -416,22 +618,25 @@ class KnowledgeBaseRequest(BaseModel):
 
     
 @app.get("/api/knowledge", response_model=List[KnowledgeBase])
-def get_knowledge(session: Session = Depends(get_session)):
-    return session.exec(select(KnowledgeBase)).all()
+def get_knowledge(request: Request, session: Session = Depends(get_session), account_id: int = Depends(get_account_id)):
+    items = session.exec(select(KnowledgeBase).where(KnowledgeBase.account_id == account_id)).all()
+    return cached_json(request, rows_to_dicts(items))
 
 @app.post("/api/knowledge")
-def add_knowledge(item: KnowledgeBaseRequest, session: Session = Depends(get_session)):
-    kb_item = KnowledgeBase(topic=item.topic, content=item.content)
+def add_knowledge(item: KnowledgeBaseRequest, session: Session = Depends(get_session), account_id: int = Depends(get_account_id)):
+    kb_item = KnowledgeBase(account_id=account_id, topic=item.topic, content=item.content)
     session.add(kb_item)
+    bump_version(session, account_id, knowledge=True) # Replies this entry is relevant to get redrafted
     session.commit()
     return {"status": "success", "message": "Added to knowledge base"}
 
 @app.delete("/api/knowledge/{item_id}")
-def delete_knowledge(item_id: int, session: Session = Depends(get_session)):
+def delete_knowledge(item_id: int, session: Session = Depends(get_session), account_id: int = Depends(get_account_id)):
     item = session.get(KnowledgeBase, item_id)
-    if not item:
+    if not item or item.account_id != account_id:
         return {"status": "error", "message": "Item not found"}
     session.delete(item)
+    bump_version(session, account_id, knowledge=True)
     session.commit()
     return {"status": "success", "message": "Deleted"}
 
@@ -442,40 +647,26 @@ class SettingsRequest(BaseModel):
     hourly_rate: float = 50.0
 
 @app.get("/api/settings")
-def get_settings(session: Session = Depends(get_session)):
-    settings = session.exec(select(AISettings)).first()
-    settings = session.exec(select(AISettings)).first()
+def get_settings(request: Request, session: Session = Depends(get_session), account_id: int = Depends(get_account_id)):
+    settings = session.exec(select(AISettings).where(AISettings.account_id == account_id)).first()
     if not settings:
-        return {"tone": "Professional", "signature": "", "hourly_rate": 50.0}
-    return settings
+        return cached_json(request, {"tone": "Professional", "signature": "", "hourly_rate": 50.0})
+    return cached_json(request, rows_to_dicts([settings])[0])
 
 @app.post("/api/settings")
-def update_settings(request: SettingsRequest, session: Session = Depends(get_session)):
-    settings = session.exec(select(AISettings)).first()
+def update_settings(request: SettingsRequest, session: Session = Depends(get_session), account_id: int = Depends(get_account_id)):
+    settings = session.exec(select(AISettings).where(AISettings.account_id == account_id)).first()
     if not settings:
-        settings = AISettings(tone=request.tone, signature=request.signature, hourly_rate=request.hourly_rate)
-        session.add(settings)
-    else:
-        settings.tone = request.tone
-        settings.signature = request.signature
-        settings.hourly_rate = request.hourly_rate
-        session.add(settings)
+        settings = AISettings(account_id=account_id) # The defaults replies were drafted with so far
+    if (settings.tone, settings.signature) != (request.tone, request.signature):
+        bump_version(session, account_id, settings) # Existing replies get redrafted in the background
+    settings.tone = request.tone
+    settings.signature = request.signature
+    settings.hourly_rate = request.hourly_rate
+    session.add(settings)
     
     session.commit()
     session.refresh(settings)
     return {"status": "success", "settings": settings}
 
-def get_current_settings(session: Session):
-    settings = session.exec(select(AISettings)).first()
-    if not settings:
-        return "Professional", ""
-    return settings.tone, settings.signature
-
-# Helper to get knowledge context
-def get_knowledge_context(session: Session) -> str:
-    limit = 20 # Limit to avoid context overflow
-    items = session.exec(select(KnowledgeBase).limit(limit)).all()
-    context = ""
-    for item in items:
-        context += f"Topic: {item.topic}\nInfo: {item.content}\n\n"
-    return context
+startup_profile["import_main"] = round((time.perf_counter() - _import_started) * 1000, 1)
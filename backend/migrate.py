@@ -0,0 +1,34 @@
+"""
+Creates and upgrades the database schema.
+
+Run once per deploy, before starting the API:
+    python migrate.py
+API processes then skip schema work on startup (see RUN_MIGRATIONS_ON_STARTUP in main.py).
+"""
+import time
+from pathlib import Path
+from dotenv import load_dotenv
+
+load_dotenv(dotenv_path=Path(__file__).parent / '.env')
+
+from services.log_pipeline import configure_logging, shutdown_logging
+configure_logging(log_format="text")
+
+from database import create_db_and_tables
+from migrations import pending_migrations
+
+
+def main():
+    started = time.perf_counter()
+    create_db_and_tables()
+    pending = pending_migrations()
+    if pending:
+        raise SystemExit(f"❌ Migrations still pending: {pending}")
+    print(f"✅ Schema is up to date ({(time.perf_counter() - started) * 1000:.0f} ms)")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        shutdown_logging() # Flush the migration log before exiting
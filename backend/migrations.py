@@ -0,0 +1,254 @@
+"""
+Versioned schema migrations.
+
+Each migration runs once per database, in version order, and is recorded in the
+schemamigration table. `python migrate.py` applies whatever is pending.
+Migrations must be safe to re-run (IF NOT EXISTS ...): a process that dies
+between applying one and recording it runs it again next time.
+Never edit a shipped migration; add a new one at the end of MIGRATIONS.
+
+Index builds go through create_index, which uses CREATE INDEX CONCURRENTLY on
+Postgres so large tables keep taking writes while the index is built.
+"""
+import time
+
+from sqlalchemy import inspect, text, or_
+from sqlalchemy.exc import DBAPIError
+from sqlmodel import SQLModel, Session, select
+
+from database import engine, write_engine, sql_literal
+from services.log_pipeline import get_logger
+
+logger = get_logger("migrations")
+
+MIGRATION_LEASE = "schema-migrations"
+MIGRATION_LEASE_SECONDS = 1800
+
+
+def create_index(name: str, table: str, columns: list, unique: bool = False):
+    """Creates an index if it does not exist, without blocking writes on Postgres."""
+    unique_sql = "UNIQUE " if unique else ""
+    column_sql = ", ".join(f'"{column}"' for column in columns)
+    if engine.dialect.name != "postgresql":
+        with engine.begin() as conn:
+            conn.execute(text(f'CREATE {unique_sql}INDEX IF NOT EXISTS "{name}" ON "{table}" ({column_sql})'))
+        return
+    # CONCURRENTLY cannot run inside a transaction
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        # An interrupted concurrent build leaves an INVALID index that IF NOT EXISTS would keep
+        invalid = conn.execute(text(
+            "SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+            "WHERE c.relname = :name AND NOT i.indisvalid"
+        ), {"name": name}).first()
+        if invalid:
+            conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"'))
+        conn.execute(text(f'CREATE {unique_sql}INDEX CONCURRENTLY IF NOT EXISTS "{name}" ON "{table}" ({column_sql})'))
+
+
+def add_column(table_name: str, column_name: str):
+    """
+    Adds a model column to an existing table, with its scalar default.
+    A constant default does not rewrite the table (SQLite, Postgres 11+).
+    """
+    column = SQLModel.metadata.tables[table_name].columns[column_name]
+    if column_name in {c["name"] for c in inspect(engine).get_columns(table_name)}:
+        return
+    column_type = column.type.compile(dialect=engine.dialect)
+    default = column.default.arg if column.default is not None and column.default.is_scalar else None
+    ddl = f'ALTER TABLE "{table_name}" ADD COLUMN "{column_name}" {column_type}'
+    if default is not None:
+        ddl += f" DEFAULT {sql_literal(default)}"
+    logger.info("Adding column %s.%s", table_name, column_name)
+    with engine.begin() as conn:
+        conn.execute(text(ddl))
+    if column.index:
+        create_index(f"ix_{table_name}_{column_name}", table_name, [column_name], unique=bool(column.unique))
+
+
+# Migrations -----------------------------------------------------------------
+
+def add_legacy_columns():
+    """
+    Databases created before migrations existed only ever got create_all, which
+    never alters existing tables: bring their columns up to the models of that time.
+    """
+    existing_tables = set(inspect(engine).get_table_names())
+    for table in SQLModel.metadata.sorted_tables:
+        if table.name in existing_tables:
+            for column in table.columns:
+                add_column(table.name, column.name)
+
+
+def unique_message_index():
+    """
+    Older databases may hold duplicate rows for one message (concurrent batches raced
+    on delete-then-insert). Keep the newest row of each, then add the unique index.
+    The unique index also serves the `gmail_message_id IN (...)` lookups per account.
+    """
+    existing = {index["name"] for index in inspect(engine).get_indexes("loggedemail")}
+    if "ux_loggedemail_account_message" not in existing:
+        with engine.begin() as conn:
+            removed = conn.execute(text(
+                "DELETE FROM loggedemail WHERE gmail_message_id IS NOT NULL AND id NOT IN "
+                "(SELECT MAX(id) FROM loggedemail WHERE gmail_message_id IS NOT NULL GROUP BY account_id, gmail_message_id)"
+            )).rowcount
+        if removed:
+            logger.info("Removed %d duplicate analyzed emails", removed)
+    create_index("ux_loggedemail_account_message", "loggedemail", ["account_id", "gmail_message_id"], unique=True)
+
+
+def listing_indexes():
+    # History and pre-filter training: WHERE account_id = ? ORDER BY id DESC
+    create_index("ix_loggedemail_account_listing", "loggedemail", ["account_id", "id"])
+    # History filters: WHERE account_id = ? AND category = ? [AND urgency >= ?]
+    create_index("ix_loggedemail_account_category_urgency", "loggedemail", ["account_id", "category", "urgency"])
+    # Outbox claims: WHERE status = 'pending' AND next_attempt_at <= now
+    create_index("ix_outboxmessage_status_due", "outboxmessage", ["status", "next_attempt_at"])
+
+
+def retention_index():
+    # Retention: WHERE created_at < cutoff (the archive tables themselves come from create_all)
+    create_index("ix_loggedemail_created_at", "loggedemail", ["created_at"])
+
+
+def thread_tracking():
+    # Gmail threadId on analyzed emails; the emailthread table itself comes from create_all
+    add_column("loggedemail", "thread_id")
+    add_column("archivedemail", "thread_id")
+    create_index("ix_loggedemail_account_thread", "loggedemail", ["account_id", "thread_id"])
+
+
+def reply_dependencies():
+    # Settings/knowledge versions and knowledge ids behind each suggested reply
+    for table in ("loggedemail", "archivedemail"):
+        for column in ("reply_settings_version", "reply_knowledge_version", "reply_knowledge_ids"):
+            add_column(table, column)
+    add_column("aisettings", "reply_version")
+    add_column("aisettings", "knowledge_version")
+    # Existing drafts count as written with the current settings. Their knowledge ids are
+    # unknown, so the next knowledge base change redrafts them once.
+    with engine.begin() as conn:
+        conn.execute(text(
+            "UPDATE loggedemail SET reply_settings_version = 1, reply_knowledge_version = 1 "
+            "WHERE suggested_reply IS NOT NULL AND reply_settings_version IS NULL"
+        ))
+
+
+def analysis_source():
+    # Only LLM analyses are used to train the pre-filter. Older rows stay NULL (unknown)
+    # except the pre-filter's own, which its summary marks
+    for table in ("loggedemail", "archivedemail"):
+        add_column(table, "analysis_source")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "UPDATE loggedemail SET analysis_source = 'prefilter' "
+            "WHERE analysis_source IS NULL AND summary LIKE 'Automated message: %'"
+        ))
+
+
+def account_keys():
+    # Accounts other than the default need a key; older ones get one from python account_key.py
+    add_column("account", "key_hash")
+
+
+def shared_message_store():
+    # The cachedmessage table comes from create_all; recorded so API processes
+    # refuse to start on a database that does not have it yet
+    import db_models
+    db_models.CachedMessage.__table__.create(engine, checkfirst=True)
+
+
+def email_fingerprints():
+    """
+    The near-duplicate index moved from a per-process log file to the emailfingerprint
+    table (from create_all): fingerprint the LLM-analyzed emails already stored.
+    """
+    import db_models
+    from services.near_duplicate import fingerprint_email
+
+    with Session(engine) as session:
+        indexed = set(session.exec(select(db_models.EmailFingerprint.email_id)).all())
+        rows = session.exec(
+            select(db_models.LoggedEmail.id, db_models.LoggedEmail.sender, db_models.LoggedEmail.subject,
+                   db_models.LoggedEmail.body, db_models.LoggedEmail.account_id)
+            .where(or_(db_models.LoggedEmail.analysis_source == "llm", db_models.LoggedEmail.analysis_source.is_(None)))
+        ).all()
+        added = 0
+        for row_id, sender, subject, body, account_id in rows:
+            fp = fingerprint_email(sender, subject, body)
+            if fp and row_id not in indexed:
+                session.add(db_models.EmailFingerprint(email_id=row_id, account_id=account_id, domain=fp[1], fingerprint=f"{fp[0]:016x}"))
+                added += 1
+        session.commit()
+    logger.info("Fingerprinted %d analyzed emails", added)
+
+
+def analysis_confidence():
+    # Pre-filter confidence next to analysis_source; older rows stay NULL
+    for table in ("loggedemail", "archivedemail"):
+        add_column(table, "analysis_confidence")
+
+
+MIGRATIONS = [
+    (1, "add_legacy_columns", add_legacy_columns),
+    (2, "unique_message_index", unique_message_index),
+    (3, "listing_indexes", listing_indexes),
+    (4, "retention_index", retention_index),
+    (5, "thread_tracking", thread_tracking),
+    (6, "reply_dependencies", reply_dependencies),
+    (7, "analysis_source", analysis_source),
+    (8, "account_keys", account_keys),
+    (9, "shared_message_store", shared_message_store),
+    (10, "email_fingerprints", email_fingerprints),
+    (11, "analysis_confidence", analysis_confidence),
+]
+
+
+def migration_label(version: int, name: str) -> str:
+    return f"{version:04d}_{name}"
+
+
+def applied_versions() -> set:
+    from db_models import SchemaMigration
+    if SchemaMigration.__tablename__ not in inspect(engine).get_table_names():
+        return set()
+    with Session(engine) as session:
+        return set(session.exec(select(SchemaMigration.version)).all())
+
+
+def pending_migrations() -> list:
+    applied = applied_versions()
+    return [migration_label(version, name) for version, name, _ in MIGRATIONS if version not in applied]
+
+
+def run_migrations():
+    """Creates missing tables, then applies pending migrations. One process at a time."""
+    import db_models
+    from services import leases
+
+    # New tables are created at their current shape; this never touches existing ones
+    try:
+        db_models.Lease.__table__.create(engine, checkfirst=True)
+    except DBAPIError:
+        pass # Another process created it between the check and the CREATE
+    holder = leases.new_holder()
+    while not leases.try_acquire(MIGRATION_LEASE, MIGRATION_LEASE_SECONDS, holder):
+        logger.info("⏳ Another process is migrating the database, waiting...")
+        time.sleep(2)
+    try:
+        SQLModel.metadata.create_all(engine)
+        applied = applied_versions()
+        for version, name, apply in MIGRATIONS:
+            if version in applied:
+                continue
+            label = migration_label(version, name)
+            started = time.perf_counter()
+            logger.info("🛠️ Applying migration %s...", label)
+            apply()
+            with Session(write_engine) as session:
+                session.add(db_models.SchemaMigration(version=version, name=name))
+                session.commit()
+            logger.info("✅ Applied %s (%.0f ms)", label, (time.perf_counter() - started) * 1000)
+    finally:
+        leases.release(MIGRATION_LEASE, holder)
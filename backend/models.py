@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 class EmailRequest(BaseModel):
     sender: str
@@ -17,6 +17,9 @@ class EmailAnalysis(BaseModel):
     urgency: int   # 1-10
     action_items: List[ActionItem]
     suggested_reply: Optional[str] = None
+    confidence: Optional[float] = None # Set when the local pre-filter produced this analysis
+    degraded: Optional[str] = None # Set on fallback results: "deadline" (budget ran out) or "error" (all models failed)
+    thread_summary: Optional[str] = None # Updated summary of the whole thread, for messages analyzed against one
 
 class SendEmailRequest(BaseModel):
     to: str
@@ -29,3 +32,17 @@ class GmailMessage(BaseModel):
     sender: str
     subject: str
     body: str
+    label_ids: List[str] = []
+    headers: Dict[str, str] = {} # Only the bulk-mail headers used by the pre-filter
+    thread_id: Optional[str] = None
+    internal_date: int = 0 # Gmail internalDate, ms since epoch; orders messages within a thread
+
+class AnalyzeBatchIdsRequest(BaseModel):
+    ids: List[str]
+
+class BulkReplyRequest(BaseModel):
+    email_ids: List[int]
+
+class AccountRequest(BaseModel):
+    email: str
+    name: str = ""
@@ -0,0 +1,96 @@
+import os
+import asyncio
+from typing import Dict
+
+from sqlmodel import Session
+
+from models import GmailMessage
+from database import engine
+from services.accounts import owned_accounts
+from services.credentials import connected_accounts
+from services import leases
+from services.batch_analysis import fetch_unanalyzed, run_batch_analysis
+from services.log_pipeline import get_logger
+
+logger = get_logger("account_workers")
+
+# Background inbox sync: one loop per connected account owned by this instance
+# (see ACCOUNT_SHARD). Each loop fetches unanalyzed mail and analyzes it, sharing
+# LLM slots fairly with the other accounts. When several processes share the
+# database, an account is synced only by the process holding its lease.
+AUTO_SYNC_SECONDS = int(os.environ.get("AUTO_SYNC_SECONDS", "0")) # 0 disables auto-sync
+AUTO_SYNC_LIMIT = int(os.environ.get("AUTO_SYNC_LIMIT", "10"))
+ACCOUNT_REFRESH_SECONDS = 60
+ACCOUNT_LEASE_SECONDS = 3 * ACCOUNT_REFRESH_SECONDS # Survives two missed renewals
+lease_holder = leases.new_holder() # This process's supervisor; renews its account leases
+
+sync_tasks: Dict[int, asyncio.Task] = {}
+
+
+async def sync_account_once(account_id: int) -> int:
+    with Session(engine) as session:
+        emails, _, _ = await fetch_unanalyzed(session, account_id, AUTO_SYNC_LIMIT)
+        if not emails:
+            return 0
+        result = await run_batch_analysis([GmailMessage(**e) for e in emails], session, account_id, route="auto-sync")
+        logger.info("🔄 Auto-sync account %s: %s", account_id, result['message'])
+        return len(emails)
+
+
+async def account_sync_loop(account_id: int):
+    while True:
+        try:
+            await sync_account_once(account_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception("Auto-sync error for account %s: %s", account_id, e)
+        await asyncio.sleep(AUTO_SYNC_SECONDS)
+
+
+def renew_account_leases() -> set:
+    """Takes or renews the sync leases of this shard's connected accounts. Returns the ones held."""
+    with Session(engine) as session:
+        connected = connected_accounts()
+        candidates = [account_id for account_id in owned_accounts(session) if account_id in connected]
+    wanted = {account_id for account_id in candidates if leases.try_acquire(sync_lease(account_id), ACCOUNT_LEASE_SECONDS, lease_holder)}
+    leases.purge_expired()
+    return wanted
+
+
+async def account_supervisor():
+    """
+    Starts a sync loop for every connected owned account whose lease this process
+    holds, renews those leases, and stops loops for accounts it no longer owns.
+    """
+    if AUTO_SYNC_SECONDS <= 0:
+        return
+    try:
+        while True:
+            try:
+                wanted = await asyncio.to_thread(renew_account_leases)
+            except Exception as e:
+                # Leases cannot be renewed, so stop rather than risk double-processing
+                logger.exception("Account supervisor error: %s", e)
+                wanted = set()
+
+            for account_id in wanted - set(sync_tasks):
+                logger.info("🔄 Starting auto-sync for account %s", account_id)
+                sync_tasks[account_id] = asyncio.create_task(account_sync_loop(account_id))
+            for account_id in set(sync_tasks) - wanted:
+                logger.info("🔄 Stopping auto-sync for account %s", account_id)
+                sync_tasks.pop(account_id).cancel()
+
+            await asyncio.sleep(ACCOUNT_REFRESH_SECONDS)
+    finally:
+        for account_id, task in sync_tasks.items():
+            task.cancel()
+            try:
+                leases.release(sync_lease(account_id), lease_holder)
+            except Exception:
+                pass
+        sync_tasks.clear()
+
+
+def sync_lease(account_id: int) -> str:
+    return f"account-sync:{account_id}"
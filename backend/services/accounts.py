@@ -0,0 +1,69 @@
+import os
+import hmac
+import hashlib
+import secrets
+from typing import List, Optional
+
+from fastapi import Depends, Header, HTTPException
+from sqlmodel import Session, select
+
+from database import get_session, DEFAULT_ACCOUNT_ID
+from db_models import Account
+from services.credentials import load_token
+
+# Each account is one Gmail mailbox. Requests pick their account with the
+# X-Account-Id header and prove access with its X-Account-Key (issued when the
+# account is created, or by python account_key.py; only its hash is stored).
+# Without X-Account-Id they use the default account, so single-mailbox
+# deployments and the current frontend keep working unchanged.
+# "index/count", e.g. "0/3": this instance only runs background work for
+# accounts where account_id % count == index. Empty means all accounts.
+ACCOUNT_SHARD = os.environ.get("ACCOUNT_SHARD", "")
+
+
+def hash_key(key: str) -> str:
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def new_account_key(account: Account) -> str:
+    """Gives the account a new API key (replacing any old one) and returns it. Not committed."""
+    key = secrets.token_urlsafe(32)
+    account.key_hash = hash_key(key)
+    return key
+
+
+def get_account_id(x_account_id: Optional[int] = Header(default=None), x_account_key: Optional[str] = Header(default=None),
+                   session: Session = Depends(get_session)) -> int:
+    """FastAPI dependency resolving the account a request acts on."""
+    account_id = x_account_id or DEFAULT_ACCOUNT_ID
+    if account_id == DEFAULT_ACCOUNT_ID:
+        return account_id
+    account = session.get(Account, account_id)
+    # Same answer for unknown accounts and wrong keys, so ids cannot be probed
+    if not account or not account.key_hash or not x_account_key or not hmac.compare_digest(account.key_hash, hash_key(x_account_key)):
+        raise HTTPException(status_code=401, detail="Unknown account or invalid X-Account-Key")
+    return account_id
+
+
+def is_connected(account_id: int) -> bool:
+    return load_token(account_id) is not None
+
+
+def shard() -> tuple:
+    if not ACCOUNT_SHARD:
+        return 0, 1
+    index, count = ACCOUNT_SHARD.split("/")
+    return int(index), int(count)
+
+
+def owns_account(account_id: int) -> bool:
+    index, count = shard()
+    return account_id % count == index
+
+
+def owned_accounts(session: Session) -> List[int]:
+    index, count = shard()
+    statement = select(Account.id)
+    if count > 1:
+        statement = statement.where(Account.id % count == index)
+    return list(session.exec(statement).all())
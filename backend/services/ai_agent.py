@@ -1,31 +1,43 @@
 import os
-import json
-import requests
 import time
+import threading
+from collections import defaultdict
+from typing import List, Optional
 from dotenv import load_dotenv
 from models import EmailAnalysis
 from pathlib import Path
+from services.llm_recorder import llm_recorder, ReplayedError
+from services.structured_output import parse_analysis, parse_reply, output_stats
+from services.deadlines import Deadline, deadline_stats, DEFAULT_BUDGET_SECONDS, MIN_ATTEMPT_SECONDS, MAX_ATTEMPT_SECONDS
+from services.log_pipeline import get_logger
+
+logger = get_logger("ai_agent")
 
 env_path = Path(__file__).parent.parent / '.env'
-load_dotenv(dotenv_path=env_path)
 
-# Configure OpenRouter
-api_key = os.getenv("OPENROUTER_API_KEY")
-if not api_key:
-    print("Warning: OPENROUTER_API_KEY not found in environment variables.")
+# OpenRouter key and .env are read on the first analysis, not at import,
+# so API processes start without touching the filesystem or the HTTP stack
+api_key = None
+_configured = False
+_configure_lock = threading.Lock()
 
-# List of free models to try (in priority order)
-import re
-import logging
-
-# Configure logging
-logging.basicConfig(
-    filename='ai_debug.log', 
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
 
-# List of free models to try (in priority order)
+def configure():
+    global api_key, _configured
+    with _configure_lock:
+        if _configured:
+            return
+        load_dotenv(dotenv_path=env_path)
+        api_key = os.getenv("OPENROUTER_API_KEY")
+        if not api_key:
+            logger.warning("OPENROUTER_API_KEY not found in environment variables.")
+        _configured = True
+
+
+# Ask for response_format=json_object; models that reject it are remembered and asked without
+LLM_JSON_MODE = os.environ.get("LLM_JSON_MODE", "true").lower() == "true"
+json_mode_unsupported = set()
+
 # List of free models to try (in priority order)
 FREE_MODELS = [
     "meta-llama/llama-3.3-70b-instruct:free",
@@ -40,13 +52,113 @@ FREE_MODELS = [
     "deepseek/deepseek-r1-0528:free" # Experimental
 ]
 
-def analyze_email_with_openrouter(sender: str, subject: str, body: str, context: str = "", tone: str = "Professional", signature: str = "") -> EmailAnalysis:
+# Two-tier analysis: classification (category, summary, urgency, actions) on small, fast
+# models first; the suggested reply, the longest part of the answer, is drafted separately,
+# eagerly only for urgent emails and otherwise on demand (POST /api/emails/{id}/reply).
+# LLM_TWO_TIER=false goes back to one prompt that does both.
+LLM_TWO_TIER = os.environ.get("LLM_TWO_TIER", "true").lower() == "true"
+REPLY_EAGER_URGENCY = int(os.environ.get("REPLY_EAGER_URGENCY", "8"))
+NO_REPLY_CATEGORIES = {"Spam"}
+
+_SMALL_MODELS = [
+    "google/gemma-3-12b-it:free",
+    "mistralai/mistral-small-3.1-24b-instruct:free",
+    "meta-llama/llama-3.2-3b-instruct:free",
+]
+CLASSIFY_MODELS = [m.strip() for m in os.environ.get("LLM_CLASSIFY_MODELS", "").split(",") if m.strip()] or (
+    _SMALL_MODELS + [m for m in FREE_MODELS if m not in _SMALL_MODELS]
+)
+REPLY_MODELS = FREE_MODELS # Strongest first: this is the text the user sends
+
+
+class UsageStats:
+    """Calls and tokens per stage (classify, reply, analysis), from OpenRouter's usage field."""
+
+    def __init__(self):
+        self.counts = defaultdict(lambda: {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0})
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, usage: Optional[dict]):
+        usage = usage or {}
+        with self._lock:
+            counts = self.counts[stage]
+            counts["calls"] += 1
+            counts["prompt_tokens"] += int(usage.get("prompt_tokens") or 0)
+            counts["completion_tokens"] += int(usage.get("completion_tokens") or 0)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                stage: {**counts, "completion_tokens_per_call": round(counts["completion_tokens"] / counts["calls"], 1) if counts["calls"] else 0.0}
+                for stage, counts in self.counts.items()
+            }
+
+
+usage_stats = UsageStats()
+
+def post_chat(model_name: str, prompt: str, json_mode: bool = False, timeout: float = MAX_ATTEMPT_SECONDS):
     """
-    Uses OpenRouter (with free models) to analyze an email and return structured JSON data.
-    Tries multiple models if one fails due to rate limits.
+    One OpenRouter chat completion. In record mode the full exchange is stored;
+    in replay mode it is served from the recordings without touching the network.
+    json_mode asks the provider for a JSON object (response_format).
     """
-    
-    prompt = f"""
+    if llm_recorder.mode == "replay":
+        return llm_recorder.replay(model_name, prompt, timeout)
+    import requests
+
+    payload = {
+        "model": model_name,
+        "messages": [
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
+    }
+    if json_mode:
+        payload["response_format"] = {"type": "json_object"}
+
+    started = time.perf_counter()
+    try:
+        response = requests.post(
+            url="https://openrouter.ai/api/v1/chat/completions",
+            headers={
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json",
+                "HTTP-Referer": "http://localhost:3000", # OpenRouter requirement
+                "X-Title": "AI Operations Assistant", # OpenRouter requirement
+            },
+            json=payload,
+            timeout=(min(10.0, timeout), timeout) # (connect, read); the read timeout comes from the deadline
+        )
+    except requests.exceptions.RequestException as e:
+        if llm_recorder.mode == "record":
+            llm_recorder.record(model_name, prompt, (time.perf_counter() - started) * 1000, 0, "", error=str(e))
+        raise
+    if llm_recorder.mode == "record":
+        llm_recorder.record(model_name, prompt, (time.perf_counter() - started) * 1000, response.status_code, response.text)
+    return response
+
+def thread_section(thread_summary: Optional[str]) -> str:
+    # Earlier messages of the thread, as a rolling summary instead of the quoted history
+    if not thread_summary:
+        return ""
+    return f"""
+    Conversation so far (summary of the earlier messages in this thread):
+    {thread_summary}
+    """
+
+
+def thread_summary_field(thread_summary: Optional[str]) -> str:
+    if not thread_summary:
+        return ""
+    return ',\n        "thread_summary": "Update the conversation summary above to include this email, in at most 3 sentences."'
+
+
+def build_analysis_prompt(sender: str, subject: str, body: str, context: str, tone: str, signature: str,
+                          thread_summary: Optional[str] = None) -> str:
+    # Single-tier prompt: classification and the reply draft in one answer
+    return f"""
     You are an expert Operations Assistant for a small business. 
     Analyze the following email and extract structured data.
     
@@ -56,7 +168,7 @@ def analyze_email_with_openrouter(sender: str, subject: str, body: str, context:
     
     Business Knowledge Base (Use this to answer questions/draft replies):
     {context}
-    
+    {thread_section(thread_summary)}
     Email Details:
     - Sender: {sender}
     - Subject: {subject}
@@ -71,99 +183,229 @@ def analyze_email_with_openrouter(sender: str, subject: str, body: str, context:
         "action_items": [
             {{ "description": "Action 1", "priority": "High" | "Medium" | "Low" }}
         ],
-        "suggested_reply": "Draft a reply using the specified Tone ({tone}) and Signature. Use Knowledge Base info if relevant."
+        "suggested_reply": "Draft a reply using the specified Tone ({tone}) and Signature. Use Knowledge Base info if relevant."{thread_summary_field(thread_summary)}
     }}
     """
+
+
+def build_classify_prompt(sender: str, subject: str, body: str, thread_summary: Optional[str] = None) -> str:
+    # First tier: no reply, no knowledge base, so a small model answers in a few dozen tokens
+    return f"""
+    You are an expert Operations Assistant for a small business. 
+    Classify the following email and extract structured data.
+    {thread_section(thread_summary)}
+    Email Details:
+    - Sender: {sender}
+    - Subject: {subject}
+    - Body: {body}
     
-    last_error = None
-    logging.info(f"Starting analysis for email: {subject}")
+    Return the response in pure JSON format (no markdown code blocks) matching this schema:
+    {{
+        "category": "Work" | "Lead" | "Invoice" | "Support" | "Spam" | "Personal" | "Other",
+        "summary": "Provide a concise, one-sentence summary of the main point of the email.",
+        "sentiment": "Positive" | "Neutral" | "Negative",
+        "urgency": 1-10 (integer),
+        "action_items": [
+            {{ "description": "Action 1", "priority": "High" | "Medium" | "Low" }}
+        ]{thread_summary_field(thread_summary)}
+    }}
+    """
+
+
+def build_reply_prompt(sender: str, subject: str, body: str, summary: str, context: str, tone: str, signature: str,
+                       thread_summary: Optional[str] = None) -> str:
+    # Second tier: only the reply, as plain text
+    return f"""
+    You are an expert Operations Assistant for a small business. 
+    Draft a reply to the following email.
+    
+    Preferences:
+    - Tone: {tone}
+    - Signature to use: {signature}
     
-    # Try each model in sequence
-    for model_name in FREE_MODELS:
+    Business Knowledge Base (Use this to answer questions):
+    {context}
+    {thread_section(thread_summary)}
+    Email Details:
+    - Sender: {sender}
+    - Subject: {subject}
+    - Summary: {summary}
+    - Body: {body}
+    
+    Return only the text of the reply, ending with the signature. No subject line, no JSON, no commentary.
+    """
+
+
+def call_models(models: List[str], prompt: str, deadline: Deadline, parse, stage: str, json_mode: bool = False):
+    """
+    Tries each model in order, each with a share of the remaining budget, until one
+    answer parses. parse(text) returns (value, repaired) or raises ValueError.
+    Returns (value, None) on success and (None, last error) when no model delivered in time.
+    """
+    import requests
+
+    last_error = None
+    for index, model_name in enumerate(models):
+        timeout = deadline.attempt_timeout(len(models) - index)
+        if timeout is None:
+            break # Not enough time left for another attempt
         try:
-            logging.info(f"Trying model: {model_name}")
-            response = requests.post(
-                url="https://openrouter.ai/api/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {api_key}",
-                    "Content-Type": "application/json",
-                    "HTTP-Referer": "http://localhost:3000", # OpenRouter requirement
-                    "X-Title": "AI Operations Assistant", # OpenRouter requirement
-                },
-                json={
-                    "model": model_name,
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": prompt
-                        }
-                    ]
-                },
-                timeout=45 # Increased timeout
-            )
+            logger.debug("Trying model %s for %s (timeout %.1fs)", model_name, stage, timeout)
+            use_json_mode = json_mode and model_name not in json_mode_unsupported
+            response = post_chat(model_name, prompt, use_json_mode, timeout)
+            if use_json_mode and response.status_code in (400, 404, 422) and "response_format" in response.text:
+                # This model/provider does not take JSON mode; remember that and ask again without it
+                json_mode_unsupported.add(model_name)
+                output_stats.record(model_name, "json_mode_rejected")
+                timeout = deadline.attempt_timeout(len(models) - index)
+                if timeout is None:
+                    break
+                response = post_chat(model_name, prompt, False, timeout)
             
             if response.status_code != 200:
-                error_msg = f"❌ Model {model_name} failed with {response.status_code}: {response.text}"
-                print(error_msg)
-                logging.error(error_msg)
+                logger.warning("❌ Model failed with %s: %s", response.status_code, response.text[:500],
+                               extra={"model": model_name, "stage": stage, "status": response.status_code})
                 last_error = f"{response.status_code}: {response.text}"
                 
                 # If rate limited (429), try next model
                 if response.status_code == 429:
-                    print(f"Model {model_name} rate limited, trying next...")
-                    time.sleep(1)
+                    logger.info("Model %s rate limited, trying next...", model_name)
+                    backoff = llm_recorder.wall_seconds(1)
+                    if deadline.remaining() > backoff + MIN_ATTEMPT_SECONDS:
+                        time.sleep(backoff)
                 continue
                 
             result = response.json()
+            usage_stats.record(stage, result.get("usage"))
             if 'choices' not in result or not result['choices']:
-                 error_msg = f"❌ Invalid response from {model_name}: {result}"
-                 print(error_msg)
-                 logging.error(error_msg)
+                 logger.warning("❌ Invalid response: %s", str(result)[:500], extra={"model": model_name, "stage": stage})
                  continue
                  
             text_response = result['choices'][0]['message']['content']
-            logging.info(f"Raw response from {model_name}: {text_response[:200]}...") # Log first 200 chars
+            logger.debug("Raw response from %s: %s...", model_name, text_response[:200]) # Log first 200 chars
             
-            # Robust JSON extraction using regex
-            # Looks for the first occurrence of '{' and the last occurrence of '}'
+            # Tolerant parse: fences, prose, quotes, trailing commas and truncation are repaired
+            # and fields coerced, so only replies with no usable JSON cost another model call
             try:
-                json_match = re.search(r'(\{[\s\S]*\})', text_response)
-                if json_match:
-                    text_response = json_match.group(1)
-                else:
-                    logging.warning("No JSON block found in response, attempting raw parse")
-                
-                data = json.loads(text_response)
-                print(f"Successfully analyzed with model: {model_name}")
-                logging.info("Successfully parsed JSON")
-                return EmailAnalysis(**data)
-            except json.JSONDecodeError as e:
-                logging.error(f"JSON Parse Error for {model_name}: {e}. Content: {text_response}")
-                print(f"JSON Parse Error: {e}")
+                value, repaired = parse(text_response)
+            except ValueError as e:
+                if stage != "reply":
+                    output_stats.record(model_name, "failed")
+                logger.warning("Parse error: %s. Content: %s", e, text_response[:500], extra={"model": model_name, "stage": stage})
                 continue # Try next model if this one returned garbage
+            if stage != "reply":
+                output_stats.record(model_name, "repaired" if repaired else "clean")
+            logger.info("Successfully completed %s with model: %s", stage, model_name,
+                        extra={"model": model_name, "stage": stage, "repaired": repaired})
+            return value, None
             
-        except requests.exceptions.RequestException as e:
-            print(f"Error with model {model_name}: {e}")
-            logging.error(f"Request Error: {e}")
+        except (requests.exceptions.RequestException, ReplayedError) as e:
+            logger.warning("Request error: %s", e, extra={"model": model_name, "stage": stage})
             last_error = str(e)
             continue
         except Exception as e:
-            print(f"Error parsing response from {model_name}: {e}")
-            logging.error(f"General Error: {e}")
+            logger.exception("Error handling response", extra={"model": model_name, "stage": stage})
             last_error = str(e)
             continue
+    return None, last_error
+
+
+def wants_reply(analysis: EmailAnalysis, draft_reply: Optional[bool]) -> bool:
+    if draft_reply is not None:
+        return draft_reply
+    return analysis.urgency >= REPLY_EAGER_URGENCY and analysis.category not in NO_REPLY_CATEGORIES
+
+
+def analyze_email_with_openrouter(sender: str, subject: str, body: str, context: str = "", tone: str = "Professional", signature: str = "",
+                                  deadline: Optional[Deadline] = None, draft_reply: Optional[bool] = None,
+                                  thread_summary: Optional[str] = None) -> EmailAnalysis:
+    """
+    Uses OpenRouter (with free models) to analyze an email and return structured JSON data.
+    Tries multiple models if one fails due to rate limits, within the deadline's time budget.
+    With LLM_TWO_TIER the reply is only drafted when draft_reply is True, or when it is
+    None and the email is urgent (REPLY_EAGER_URGENCY); otherwise suggested_reply is None
+    and generate_reply drafts it on demand.
+    thread_summary (the rolling summary of the thread this email continues) replaces
+    the quoted history; the analysis then carries the updated thread_summary.
+    """
+    deadline = deadline or Deadline(DEFAULT_BUDGET_SECONDS)
+    
+    configure()
+    logger.debug("Starting analysis for email: %s", subject)
+
+    if LLM_TWO_TIER:
+        prompt = build_classify_prompt(sender, subject, body, thread_summary)
+        analysis, last_error = call_models(CLASSIFY_MODELS, prompt, deadline, parse_analysis, "classify", LLM_JSON_MODE)
+        if analysis:
+            analysis.suggested_reply = None # Small models sometimes add one anyway
+            if wants_reply(analysis, draft_reply):
+                # Whatever is left of the budget; if it runs out the reply is drafted on demand later
+                analysis.suggested_reply = draft(sender, subject, body, analysis.summary, context, tone, signature, deadline, thread_summary)
+    else:
+        prompt = build_analysis_prompt(sender, subject, body, context, tone, signature, thread_summary)
+        analysis, last_error = call_models(FREE_MODELS, prompt, deadline, parse_analysis, "analysis", LLM_JSON_MODE)
+
+    if analysis:
+        # Late if the caller already gave up on it (see deadline_analysis)
+        deadline_stats.record(deadline.route, missed=deadline.expired())
+        return analysis
     
+    missed = deadline.remaining() < MIN_ATTEMPT_SECONDS
+    deadline_stats.record(deadline.route, missed=missed)
+    if missed:
+        return deadline_analysis(subject, deadline, last_error)
+
     # If all models failed, return error response
-    print(f"All models failed. Last error: {last_error}")
-    logging.critical(f"All models failed. Last error: {last_error}")
+    logger.error("All models failed. Last error: %s", last_error)
     return EmailAnalysis(
         category="Other", 
         summary=f"Analysis failed. Please check logs. Last error: {str(last_error)[:100]}", 
         sentiment="Neutral", 
         urgency=5, 
         action_items=[{"description": "Check API Keys and network", "priority": "High"}],
-        suggested_reply="Analysis unavailable."
+        suggested_reply="Analysis unavailable.",
+        degraded="error"
     )
 
+
+def deadline_analysis(subject: str, deadline: Deadline, last_error=None) -> EmailAnalysis:
+    """
+    The degraded result for an email whose time budget ran out. Also returned by callers that
+    stop waiting for an analysis still running in an executor thread.
+    """
+    logger.error("⏱️ Analysis deadline (%.0fs, %s) passed for: %s. Last error: %s", deadline.budget, deadline.route, subject, last_error,
+                 extra={"route": deadline.route})
+    return EmailAnalysis(
+        category="Other",
+        summary=f"Not analyzed in time: {subject}"[:200],
+        sentiment="Neutral",
+        urgency=5,
+        action_items=[{"description": "Review this email manually", "priority": "Medium"}],
+        suggested_reply=None,
+        degraded="deadline"
+    )
+
+
+def draft(sender: str, subject: str, body: str, summary: str, context: str, tone: str, signature: str, deadline: Deadline,
+          thread_summary: Optional[str] = None) -> Optional[str]:
+    prompt = build_reply_prompt(sender, subject, body, summary, context, tone, signature, thread_summary)
+    reply, last_error = call_models(REPLY_MODELS, prompt, deadline, parse_reply, "reply")
+    if reply is None:
+        logger.warning("No reply drafted for: %s. Last error: %s", subject, last_error)
+    return reply
+
+
+def generate_reply(sender: str, subject: str, body: str, summary: str = "", context: str = "", tone: str = "Professional",
+                   signature: str = "", deadline: Optional[Deadline] = None, thread_summary: Optional[str] = None) -> Optional[str]:
+    """
+    Drafts the suggested reply for an already analyzed email (the second tier).
+    Returns None when no model produced one within the deadline.
+    """
+    deadline = deadline or Deadline(DEFAULT_BUDGET_SECONDS)
+    configure()
+    reply = draft(sender, subject, body, summary, context, tone, signature, deadline, thread_summary)
+    deadline_stats.record(deadline.route, missed=(reply is None and deadline.remaining() < MIN_ATTEMPT_SECONDS) or deadline.expired())
+    return reply
+
 # Keep the old function name for backward compatibility
 analyze_email_with_gemini = analyze_email_with_openrouter
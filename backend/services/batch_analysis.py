@@ -0,0 +1,388 @@
+import os
+import json
+import asyncio
+import time
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlmodel import Session, select
+from sqlalchemy.exc import IntegrityError
+
+from models import GmailMessage
+from database import DEFAULT_ACCOUNT_ID, write_engine
+from db_models import LoggedEmail, AISettings
+from services.ai_agent import analyze_email_with_gemini, deadline_analysis
+from services.gmail_service import fetch_recent_emails, fetch_emails_by_id
+from services.executors import gmail_executor, llm_executor
+from services.fair_scheduler import llm_fair_share
+from services.message_store import message_store
+from services.prefilter import get_prefilter
+from services.near_duplicate import near_duplicate_index, find_reusable_analysis
+from services.priority import run_prioritized, priority_score, knowledge_keywords, URGENT_THRESHOLD, BATCH_LLM_CONCURRENCY
+from services.knowledge import load_knowledge, matching_knowledge, relevant_knowledge, knowledge_context, knowledge_ids, reply_versions
+from services.retention import archived_message_ids
+from services.deadlines import Deadline
+from services.threads import latest_per_thread, thread_context, strip_quoted_history, update_thread, thread_stats
+from services import leases
+from services.log_pipeline import get_logger, set_batch_id, reset_batch_id
+
+logger = get_logger("batch")
+
+# Shared by the batch endpoints and the per-account background workers.
+# A message is analyzed by one batch at a time, across all API processes:
+# each batch takes a lease per message and skips messages leased by another.
+ANALYSIS_LEASE_SECONDS = int(os.environ.get("ANALYSIS_LEASE_SECONDS", "300"))
+
+
+def get_current_settings(session: Session, account_id: int = DEFAULT_ACCOUNT_ID):
+    settings = session.exec(select(AISettings).where(AISettings.account_id == account_id)).first()
+    if not settings:
+        return "Professional", ""
+    return settings.tone, settings.signature
+
+
+def admit_batch(size: int):
+    """
+    Rejects a batch up front (503) if the LLM executor cannot take its workers.
+    Once admitted, a batch always runs to completion.
+    """
+    llm_executor.admit(slots=max(1, min(size, BATCH_LLM_CONCURRENCY)))
+
+
+async def fetch_unanalyzed(session: Session, account_id: int, limit: int, next_page_token: Optional[str] = None) -> Tuple[List[dict], Optional[str], int]:
+    """
+    Pages through the account's inbox until `limit` emails that are not yet in LoggedEmail
+    are found. Returns (emails, next page token, batches checked).
+    """
+    current_token = next_page_token
+    valid_emails = []
+    max_attempts = 20 # Search up to 20 batches (approx 200 emails) to find unanalyzed ones
+    attempt = 0
+
+    for attempt in range(max_attempts):
+        if len(valid_emails) >= limit:
+            break
+
+        # Fetch a batch. We fetch slightly more than limit (limit + 5) to increase hit rate per batch.
+        # But we must respect the user's pagination token flow.
+        # Actually, standardizing on 'limit' is safer for now.
+        batch_emails, new_token = await gmail_executor.run(
+            fetch_recent_emails, limit=limit, next_page_token=current_token, account_id=account_id
+        )
+
+        if not batch_emails:
+            logger.debug("No more emails from Gmail.")
+            break # No more emails in Gmail
+
+        # Keep bodies server-side so analyze-batch-ids can resolve them by ID
+        await asyncio.to_thread(message_store.put_many, batch_emails, account_id)
+
+        # Check DB for duplicates
+        # Get IDs of this batch
+        gmail_ids = [e['id'] for e in batch_emails]
+
+        # Query DB for existing
+        statement = (
+            select(LoggedEmail.gmail_message_id)
+            .where(LoggedEmail.account_id == account_id)
+            .where(LoggedEmail.gmail_message_id.in_(gmail_ids))
+        )
+        existing_set = set(session.exec(statement).all())
+        # Archived emails were analyzed too; don't pull them back in
+        existing_set |= archived_message_ids(session, account_id, [i for i in gmail_ids if i not in existing_set])
+
+        # Filter
+        for email in batch_emails:
+            if email['id'] not in existing_set:
+                valid_emails.append(email)
+
+        current_token = new_token
+
+        # If we don't have a next page, we can't continue
+        if not current_token:
+            break
+
+    # Trim to requested limit (in case we over-fetched)
+    return valid_emails[:limit], current_token, attempt + 1
+
+
+async def resolve_messages(ids: List[str], account_id: int = DEFAULT_ACCOUNT_ID) -> List[GmailMessage]:
+    """
+    Looks up message bodies in the message store, fetching any expired ones from Gmail in one batch.
+    Messages that cannot be fetched are left out.
+    """
+    cached = await asyncio.to_thread(message_store.get_many, ids, account_id)
+    missing = list(dict.fromkeys(message_id for message_id in ids if message_id not in cached))
+
+    if missing:
+        logger.info("📥 %d of %d messages not in store, fetching from Gmail...", len(missing), len(ids))
+        try:
+            fetched = await gmail_executor.run(fetch_emails_by_id, missing, account_id=account_id)
+        except Exception as e:
+            logger.warning("Error fetching %d emails: %s", len(missing), e)
+            fetched = {}
+        await asyncio.to_thread(message_store.put_many, fetched.values(), account_id)
+        cached.update(fetched)
+
+    return [GmailMessage(**cached[message_id]) for message_id in ids if message_id in cached]
+
+
+async def run_batch_analysis(messages: List[GmailMessage], session: Session, account_id: int = DEFAULT_ACCOUNT_ID,
+                             route: str = "analyze-batch") -> dict:
+    """
+    Analyzes and stores messages, returns a summary.
+    """
+    if not messages:
+        return {"status": "success", "message": "No messages to analyze."}
+
+    analyzed_count = 0
+    source_counts = {"llm": 0, "prefilter": 0, "near_duplicate": 0, "superseded": 0, "in_progress": 0}
+    degraded_count = 0
+    prefilter_confidences = []
+    time_to_first_urgent_ms = None
+
+    async for item in iter_batch_analysis(messages, session, account_id, route):
+        if item["source"] == "in_progress":
+            source_counts["in_progress"] += 1
+            continue
+        if item.get("degraded"):
+            degraded_count += 1
+            continue
+        analyzed_count += 1
+        source_counts[item["source"]] += 1
+        if item["source"] == "prefilter":
+            prefilter_confidences.append(item["confidence"])
+        if time_to_first_urgent_ms is None and item["urgency"] >= URGENT_THRESHOLD:
+            time_to_first_urgent_ms = item["elapsed_ms"]
+
+    return {
+        "status": "success",
+        "message": f"Successfully analyzed {analyzed_count} emails.",
+        "prefiltered": source_counts["prefilter"],
+        "prefilter_mean_confidence": round(sum(prefilter_confidences) / len(prefilter_confidences), 3) if prefilter_confidences else None,
+        "near_duplicates": source_counts["near_duplicate"],
+        "superseded_in_thread": source_counts["superseded"],
+        "in_progress_elsewhere": source_counts["in_progress"],
+        "not_analyzed": degraded_count,
+        "time_to_first_urgent_ms": time_to_first_urgent_ms
+    }
+
+
+async def iter_batch_analysis(messages: List[GmailMessage], session: Session, account_id: int = DEFAULT_ACCOUNT_ID,
+                              route: str = "analyze-batch"):
+    """
+    Analyzes messages with bounded concurrency, highest priority pre-score first,
+    and yields a small summary dict for each email as soon as it is saved.
+    Messages another batch is already analyzing are yielded first with source "in_progress".
+    LLM slots are shared fairly with other accounts' batches.
+    Each email gets the route's time budget (slot wait included); emails that miss it
+    or fail on every model are yielded with "degraded" and not saved, so a later sync retries them.
+    Only the newest message of each Gmail thread is analyzed, against the thread's rolling
+    summary when there is one; older messages of the thread are saved with its analysis
+    and yielded with source "superseded".
+    """
+    # 0. Get Context & Settings
+    knowledge = load_knowledge(session, account_id)
+    tone, signature = get_current_settings(session, account_id)
+    versions = reply_versions(session, account_id)
+    keywords = knowledge_keywords(item.topic for item in knowledge)
+
+    def reply_inputs(email_data) -> Tuple[int, int, str]:
+        # Recorded with a reply so that only settings/knowledge changes that affect it redraft it
+        return (*versions, knowledge_ids(matching_knowledge(knowledge, email_data.subject, email_data.body)))
+
+    prefilter = get_prefilter(account_id)
+    prefilter.ensure_trained(session, account_id)
+
+    # Definition helper for parallel execution
+    async def analyze_and_return(email_data):
+        deadline = Deadline.for_route(route)
+
+        # Obvious bulk mail / notifications never reach the LLM
+        analysis = prefilter.classify(email_data)
+        if analysis:
+            logger.info("⚡ Pre-filtered email (%s, %s): %s", analysis.category, analysis.confidence, email_data.subject, extra={"email_id": email_data.id})
+            return email_data, analysis, "prefilter"
+
+        # Templated mail: reuse the analysis of a near-identical earlier email
+        analysis = find_reusable_analysis(session, email_data, account_id)
+        if analysis:
+            return email_data, analysis, "near_duplicate"
+
+        # Continuing a thread: its summary stands in for the quoted history
+        body, thread_summary = email_data.body, None
+        thread = thread_context(session, account_id, email_data)
+        if thread:
+            body, thread_summary = strip_quoted_history(email_data.body), thread.summary
+            thread_stats.record(incremental=1, quoted_chars_skipped=len(email_data.body) - len(body))
+
+        logger.info("🤖 Analyzing email: %s%s", email_data.subject, " (thread)" if thread else "", extra={"email_id": email_data.id})
+        try:
+            # Holds the email to its budget even while a model call is still running
+            analysis = await llm_fair_share.run(
+                account_id, llm_executor, deadline,
+                analyze_email_with_gemini,
+                sender=email_data.sender,
+                subject=email_data.subject,
+                body=body,
+                context=knowledge_context(relevant_knowledge(knowledge, email_data.subject, email_data.body)),
+                tone=tone,
+                signature=signature,
+                deadline=deadline,
+                thread_summary=thread_summary
+            )
+        except asyncio.TimeoutError:
+            analysis = deadline_analysis(email_data.subject, deadline)
+        return email_data, analysis, "llm"
+
+    started = time.perf_counter()
+    claimed = []
+    holders = {} # message id -> lease holder token
+    for email_data in messages:
+        # Lease and save calls are short write transactions that can wait on the database
+        # write lock (up to the busy timeout), so they run off the event loop
+        holder = await asyncio.to_thread(leases.try_acquire, analysis_lease(account_id, email_data.id), ANALYSIS_LEASE_SECONDS)
+        if holder:
+            holders[email_data.id] = holder
+            claimed.append(email_data)
+        else:
+            logger.info("⏩ Email %s is being analyzed by another request, skipping.", email_data.id)
+            yield {"gmail_message_id": email_data.id, "source": "in_progress", "elapsed_ms": 0.0}
+
+    # Run analysis in parallel, most important emails first. Records logged by the
+    # analysis tasks and their LLM threads carry the batch ID
+    batch_token = set_batch_id()
+    latest, superseded = latest_per_thread(claimed)
+    logger.info("🚀 Starting batch analysis for %d emails (account %s)...", len(latest), account_id)
+    unsaved = {email_data.id for email_data in claimed}
+    try:
+        results = run_prioritized(latest, lambda msg: priority_score(msg, keywords), analyze_and_return)
+
+        # Save each result as soon as it is ready so urgent emails show up first
+        async for email_data, analysis, source in results:
+            if analysis.degraded:
+                await asyncio.to_thread(leases.release, analysis_lease(account_id, email_data.id), holders[email_data.id])
+                unsaved.discard(email_data.id)
+                yield {
+                    "id": None,
+                    "gmail_message_id": email_data.id,
+                    "category": analysis.category,
+                    "urgency": analysis.urgency,
+                    "source": source,
+                    "degraded": analysis.degraded,
+                    "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+                }
+                continue
+
+            db_email = await asyncio.to_thread(
+                save_analysis, account_id, email_data, analysis, reply_inputs(email_data) if analysis.suggested_reply else None, source
+            )
+            await asyncio.to_thread(leases.release, analysis_lease(account_id, email_data.id), holders[email_data.id])
+            unsaved.discard(email_data.id)
+            await asyncio.to_thread(message_store.discard, email_data.id, account_id) # Saved; the body now lives in LoggedEmail
+
+            # Index fresh LLM analyses so later templated copies can reuse them
+            if source == "llm":
+                near_duplicate_index.add(db_email.id, db_email.sender, db_email.subject, db_email.body, account_id)
+
+            yield {
+                "id": db_email.id,
+                "gmail_message_id": email_data.id,
+                "category": analysis.category,
+                "urgency": analysis.urgency,
+                "source": source,
+                "confidence": db_email.analysis_confidence,
+                "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+            }
+
+            # Older messages of the same thread take this analysis, without its reply and actions
+            older = superseded.get(email_data.id, [])
+            for old_data in older:
+                old_email = await asyncio.to_thread(
+                    save_analysis, account_id, old_data, analysis.model_copy(update={"suggested_reply": None, "action_items": []}),
+                    None, "superseded"
+                )
+                await asyncio.to_thread(leases.release, analysis_lease(account_id, old_data.id), holders[old_data.id])
+                unsaved.discard(old_data.id)
+                await asyncio.to_thread(message_store.discard, old_data.id, account_id)
+                yield {
+                    "id": old_email.id,
+                    "gmail_message_id": old_data.id,
+                    "category": analysis.category,
+                    "urgency": analysis.urgency,
+                    "source": "superseded",
+                    "confidence": None,
+                    "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+                }
+            thread_stats.record(superseded=len(older))
+            await asyncio.to_thread(update_thread, account_id, email_data, analysis, superseded=len(older))
+    finally:
+        # Leases of messages that were not saved (error, client went away)
+        for message_id in unsaved:
+            await asyncio.to_thread(leases.release, analysis_lease(account_id, message_id), holders[message_id])
+        reset_batch_id(batch_token)
+
+
+def analysis_lease(account_id: int, message_id: str) -> str:
+    return f"analyze:{account_id}:{message_id}"
+
+
+def save_analysis(account_id: int, email_data: GmailMessage, analysis, reply_inputs: Optional[tuple] = None,
+                  source: Optional[str] = None) -> LoggedEmail:
+    """
+    Inserts or updates the message's LoggedEmail row. The unique (account_id, gmail_message_id)
+    index makes this idempotent: a re-analysis overwrites the row instead of adding another.
+    reply_inputs is (settings version, knowledge version, knowledge ids) of a suggested reply;
+    source is what produced the analysis ("llm", "prefilter", ...).
+    Runs in its own short write transaction and returns a detached row.
+    """
+    with Session(write_engine) as session:
+        db_email = upsert_analysis(session, account_id, email_data, analysis, reply_inputs, source)
+        session.refresh(db_email)
+        session.expunge(db_email)
+        return db_email
+
+
+def upsert_analysis(session: Session, account_id: int, email_data: GmailMessage, analysis, reply_inputs: Optional[tuple] = None,
+                    source: Optional[str] = None) -> LoggedEmail:
+    def find_existing():
+        return session.exec(
+            select(LoggedEmail)
+            .where(LoggedEmail.account_id == account_id)
+            .where(LoggedEmail.gmail_message_id == email_data.id)
+        ).first()
+
+    def apply(db_email: LoggedEmail):
+        db_email.sender = email_data.sender
+        db_email.thread_id = email_data.thread_id
+        db_email.subject = email_data.subject
+        db_email.body = email_data.body
+        db_email.category = analysis.category
+        db_email.summary = analysis.summary
+        db_email.sentiment = analysis.sentiment
+        db_email.urgency = analysis.urgency
+        db_email.suggested_reply = analysis.suggested_reply
+        db_email.analysis_source = source
+        db_email.analysis_confidence = analysis.confidence if source == "prefilter" else None
+        db_email.reply_settings_version, db_email.reply_knowledge_version, db_email.reply_knowledge_ids = reply_inputs or (None, None, None)
+        db_email.action_items_json = json.dumps([item.dict() for item in analysis.action_items])
+        db_email.created_at = datetime.utcnow()
+        db_email.is_replied = False
+        session.add(db_email)
+        return db_email
+
+    db_email = find_existing()
+    if db_email:
+        logger.info("⏩ Email %s already exists. Replacing its analysis.", email_data.id)
+    else:
+        db_email = LoggedEmail(account_id=account_id, gmail_message_id=email_data.id, sender="", subject="", body="",
+                               category="", summary="", sentiment="", urgency=0)
+    apply(db_email)
+    try:
+        session.commit()
+    except IntegrityError:
+        # Another process inserted the same message first; update its row instead
+        session.rollback()
+        db_email = apply(find_existing())
+        session.commit()
+    return db_email
@@ -0,0 +1,132 @@
+import os
+import json
+import glob
+from datetime import datetime
+from typing import Optional
+
+from sqlmodel import Session, select
+from sqlalchemy.exc import IntegrityError
+
+from database import engine, write_engine, DEFAULT_ACCOUNT_ID
+from db_models import StoredCredential
+from services.log_pipeline import get_logger
+
+logger = get_logger("credentials")
+
+# Gmail OAuth state lives in the database so every API process sees the same
+# tokens: a refresh or logout in one worker applies to all of them.
+# token.json / tokens/*.json / credentials.json are only read once, to import
+# state from older single-process deployments.
+LEGACY_TOKEN_DIR = os.environ.get("TOKEN_DIR", "tokens")
+CLIENT_CREDENTIAL = "client"
+
+
+def token_name(account_id: int) -> str:
+    return f"token:{account_id}"
+
+
+def get_credential(name: str) -> Optional[str]:
+    with Session(engine) as session:
+        item = session.get(StoredCredential, name)
+        return item.value if item else None
+
+
+def set_credential(name: str, value: str):
+    """Inserts or overwrites the credential. Safe when several workers store it at once (e.g. at boot)."""
+    with Session(write_engine) as session:
+        def apply(item: StoredCredential):
+            item.value = value
+            item.updated_at = datetime.utcnow()
+            session.add(item)
+
+        item = session.get(StoredCredential, name)
+        apply(item or StoredCredential(name=name, value=value))
+        try:
+            session.commit()
+        except IntegrityError:
+            # Another process inserted it first; overwrite its row
+            session.rollback()
+            apply(session.get(StoredCredential, name))
+            session.commit()
+
+
+def delete_credential(name: str) -> bool:
+    with Session(engine) as session:
+        item = session.get(StoredCredential, name)
+        if not item:
+            return False
+        session.delete(item)
+        session.commit()
+        return True
+
+
+def load_token(account_id: int = DEFAULT_ACCOUNT_ID) -> Optional[dict]:
+    value = get_credential(token_name(account_id))
+    return json.loads(value) if value else None
+
+
+def save_token(account_id: int, token_json: str):
+    set_credential(token_name(account_id), token_json)
+
+
+def delete_token(account_id: int) -> bool:
+    return delete_credential(token_name(account_id))
+
+
+def connected_accounts() -> set:
+    with Session(engine) as session:
+        names = session.exec(select(StoredCredential.name).where(StoredCredential.name.startswith("token:"))).all()
+    return {int(name.split(":", 1)[1]) for name in names}
+
+
+def load_client_config() -> Optional[dict]:
+    value = get_credential(CLIENT_CREDENTIAL)
+    return json.loads(value) if value else None
+
+
+def clean_env_json(value: str) -> str:
+    # strip extra quotes if user accidentally added them
+    value = value.strip()
+    if value.startswith("'") and value.endswith("'"):
+        value = value[1:-1]
+    return value
+
+
+def import_credentials():
+    """
+    Copies OAuth state from env vars (cloud deployments) and legacy files into the database.
+    Env vars always win, like they did when they were written to token.json at startup;
+    files only fill in what the database does not have yet.
+    """
+    token_env = os.environ.get("GOOGLE_TOKEN_JSON")
+    if token_env:
+        logger.debug("GOOGLE_TOKEN_JSON found. Length: %d", len(token_env))
+        try:
+            token = clean_env_json(token_env)
+            json.loads(token)
+            save_token(DEFAULT_ACCOUNT_ID, token)
+            logger.info("Stored GOOGLE_TOKEN_JSON for the default account")
+        except Exception as e:
+            logger.critical("Failed to store GOOGLE_TOKEN_JSON: %s", e)
+    else:
+        logger.debug("GOOGLE_TOKEN_JSON is missing or empty.")
+
+    creds_env = os.environ.get("GOOGLE_CREDENTIALS_JSON")
+    if creds_env:
+        set_credential(CLIENT_CREDENTIAL, clean_env_json(creds_env))
+
+    legacy_files = [(token_name(DEFAULT_ACCOUNT_ID), "token.json"), (CLIENT_CREDENTIAL, "credentials.json")]
+    for path in glob.glob(os.path.join(LEGACY_TOKEN_DIR, "account_*.json")):
+        account_id = os.path.basename(path)[len("account_"):-len(".json")]
+        if account_id.isdigit():
+            legacy_files.append((token_name(int(account_id)), path))
+
+    for name, path in legacy_files:
+        if not os.path.exists(path) or get_credential(name):
+            continue
+        try:
+            with open(path, "r") as f:
+                set_credential(name, f.read())
+            logger.info("Imported %s into the database", path)
+        except Exception as e:
+            logger.warning("Failed to import %s: %s", path, e)
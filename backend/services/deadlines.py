@@ -0,0 +1,73 @@
+import os
+import time
+import threading
+from collections import defaultdict
+from typing import Optional
+
+# Time budgets for LLM analysis. Each route gives an analysis one total budget;
+# the model fallback chain spends it attempt by attempt, so one call can no longer
+# take 10 models x 45s. When the budget runs out the caller gets a fallback
+# EmailAnalysis marked degraded="deadline" instead of waiting longer.
+ROUTE_BUDGET_SECONDS = {
+    "analyze-email": float(os.environ.get("LLM_BUDGET_ANALYZE_EMAIL_SECONDS", "60")),
+    "analyze-batch": float(os.environ.get("LLM_BUDGET_BATCH_EMAIL_SECONDS", "90")), # Per email, slot wait included
+    "auto-sync": float(os.environ.get("LLM_BUDGET_AUTO_SYNC_SECONDS", "180")),
+    "draft-reply": float(os.environ.get("LLM_BUDGET_DRAFT_REPLY_SECONDS", "45")), # On-demand reply, the user is waiting
+    "reply-refresh": float(os.environ.get("LLM_BUDGET_REPLY_REFRESH_SECONDS", "90")), # Background redraft after a settings change
+}
+DEFAULT_BUDGET_SECONDS = float(os.environ.get("LLM_BUDGET_DEFAULT_SECONDS", "90"))
+MIN_ATTEMPT_SECONDS = float(os.environ.get("LLM_MIN_ATTEMPT_SECONDS", "3"))
+MAX_ATTEMPT_SECONDS = 45.0 # The old fixed per-request timeout
+# The remaining budget is split as if this many attempts were still to come: most
+# analyses succeed on the first or second model, so early attempts get a fair share
+PLANNED_ATTEMPTS = 3
+
+
+class Deadline:
+    def __init__(self, seconds: float, route: str = "default"):
+        self.route = route
+        self.budget = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    @classmethod
+    def for_route(cls, route: str) -> "Deadline":
+        return cls(ROUTE_BUDGET_SECONDS.get(route, DEFAULT_BUDGET_SECONDS), route)
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def attempt_timeout(self, attempts_left: int) -> Optional[float]:
+        """Timeout for the next attempt, or None if not enough budget is left to make one."""
+        remaining = self.remaining()
+        if remaining < MIN_ATTEMPT_SECONDS:
+            return None
+        share = remaining / max(1, min(attempts_left, PLANNED_ATTEMPTS))
+        return min(MAX_ATTEMPT_SECONDS, remaining, max(MIN_ATTEMPT_SECONDS, share))
+
+
+class DeadlineStats:
+    def __init__(self):
+        self.counts = defaultdict(lambda: {"calls": 0, "missed": 0})
+        self._lock = threading.Lock()
+
+    def record(self, route: str, missed: bool):
+        with self._lock:
+            self.counts[route]["calls"] += 1
+            self.counts[route]["missed"] += int(missed)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                route: {
+                    **counts,
+                    "budget_seconds": ROUTE_BUDGET_SECONDS.get(route, DEFAULT_BUDGET_SECONDS),
+                    "miss_rate": round(counts["missed"] / counts["calls"], 3) if counts["calls"] else 0.0,
+                }
+                for route, counts in self.counts.items()
+            }
+
+
+deadline_stats = DeadlineStats()
@@ -0,0 +1,109 @@
+import os
+import time
+import asyncio
+import functools
+import threading
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, TypeVar
+
+# Separate thread pools for blocking Gmail (googleapiclient/httplib2) and LLM (requests) calls,
+# so a large analysis batch cannot starve inbox loads and sends in FastAPI's default pool.
+GMAIL_EXECUTOR_WORKERS = int(os.environ.get("GMAIL_EXECUTOR_WORKERS", "8"))
+GMAIL_EXECUTOR_MAX_QUEUE = int(os.environ.get("GMAIL_EXECUTOR_MAX_QUEUE", "32"))
+LLM_EXECUTOR_WORKERS = int(os.environ.get("LLM_EXECUTOR_WORKERS", "16"))
+LLM_EXECUTOR_MAX_QUEUE = int(os.environ.get("LLM_EXECUTOR_MAX_QUEUE", "256"))
+
+R = TypeVar("R")
+
+
+class ExecutorSaturated(Exception):
+    """Raised when an executor's queue is full; mapped to 503 + Retry-After."""
+
+    def __init__(self, name: str, retry_after: int):
+        super().__init__(f"{name} executor is saturated, retry in {retry_after}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class BoundedExecutor:
+    """
+    ThreadPoolExecutor with queue-depth tracking and admission control.
+    Callers check admit() before starting work; run() itself never rejects,
+    so work that was admitted (e.g. a whole batch) always completes.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-worker")
+        self._lock = threading.Lock()
+        self.pending = 0 # submitted, not finished
+        self.completed = 0
+        self.rejected = 0
+        self.avg_seconds = 1.0 # moving average of task duration
+
+    @property
+    def active(self) -> int:
+        return min(self.pending, self.max_workers)
+
+    @property
+    def queued(self) -> int:
+        return max(0, self.pending - self.max_workers)
+
+    def admit(self, slots: int = 1):
+        """Raises ExecutorSaturated if the queue cannot take `slots` more tasks."""
+        if self.queued + slots > self.max_queue:
+            self.rejected += 1
+            raise ExecutorSaturated(self.name, self.retry_after())
+
+    def retry_after(self) -> int:
+        # Time for the current backlog to drain, rounded up
+        waves = (self.pending / self.max_workers) if self.max_workers else 1
+        return max(1, int(waves * self.avg_seconds + 0.999))
+
+    def submit(self, fn: Callable[..., R], *args, **kwargs) -> "Future[R]":
+        """
+        Starts fn on the pool. The task counts as pending until its thread finishes,
+        even if the caller stops waiting for it (asyncio.wait_for timing out).
+        """
+        with self._lock:
+            self.pending += 1
+        # Copy the caller's context so log records from the worker keep its request/batch IDs
+        context = contextvars.copy_context()
+        future = self._pool.submit(functools.partial(context.run, self._timed, fn, *args, **kwargs))
+        future.add_done_callback(self._finished)
+        return future
+
+    async def run(self, fn: Callable[..., R], *args, **kwargs) -> R:
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def _finished(self, future: Future):
+        with self._lock:
+            self.pending -= 1
+            if not future.cancelled(): # Cancelled while still queued: never ran
+                self.completed += 1
+
+    def _timed(self, fn, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.avg_seconds = 0.8 * self.avg_seconds + 0.2 * elapsed
+
+    def get_stats(self) -> dict:
+        return {
+            "workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "queued": self.queued,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_task_seconds": round(self.avg_seconds, 3),
+        }
+
+
+gmail_executor = BoundedExecutor("gmail", GMAIL_EXECUTOR_WORKERS, GMAIL_EXECUTOR_MAX_QUEUE)
+llm_executor = BoundedExecutor("llm", LLM_EXECUTOR_WORKERS, LLM_EXECUTOR_MAX_QUEUE)
@@ -0,0 +1,97 @@
+import os
+import asyncio
+from collections import OrderedDict, deque, Counter
+from typing import Deque
+
+from services.deadlines import Deadline
+
+# Fair share of LLM capacity across accounts.
+# Each account has its own FIFO of waiters; freed slots go round-robin to the next
+# account that is waiting, so one huge inbox cannot hold every slot.
+LLM_FAIR_SHARE_SLOTS = int(os.environ.get("LLM_FAIR_SHARE_SLOTS", os.environ.get("LLM_EXECUTOR_WORKERS", "16")))
+
+
+class FairShareScheduler:
+    def __init__(self, slots: int):
+        self.slots = slots
+        self.in_use = 0
+        self.active: Counter = Counter() # account -> slots held
+        self.granted: Counter = Counter() # account -> slots granted since startup
+        self._waiters: "OrderedDict[int, Deque[asyncio.Future]]" = OrderedDict()
+
+    async def acquire(self, account_id: int):
+        if self.in_use < self.slots and not self._waiters:
+            self._grant(account_id)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(account_id, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Slot was handed to us as we were cancelled; pass it on
+                self.release(account_id)
+            else:
+                self._discard(account_id, future)
+            raise
+
+    def release(self, account_id: int):
+        self.in_use -= 1
+        self.active[account_id] -= 1
+        if self.active[account_id] <= 0:
+            del self.active[account_id]
+        self._wake_next()
+
+    async def run(self, account_id: int, executor, deadline: Deadline, fn, /, *args, **kwargs):
+        """
+        Runs fn on the executor in one of the account's slots and waits for it until
+        the deadline, raising asyncio.TimeoutError after that. A model call still running
+        then finishes in its thread and is dropped; it keeps the slot until it does.
+        """
+        await self.acquire(account_id)
+        try:
+            future = executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self.release(account_id)
+            raise
+        loop = asyncio.get_running_loop()
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self.release, account_id))
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout=deadline.remaining())
+
+    def _grant(self, account_id: int):
+        self.in_use += 1
+        self.active[account_id] += 1
+        self.granted[account_id] += 1
+
+    def _wake_next(self):
+        while self._waiters and self.in_use < self.slots:
+            # Round-robin: take the first waiting account, then move it to the back
+            account_id, queue = next(iter(self._waiters.items()))
+            future = queue.popleft()
+            if queue:
+                self._waiters.move_to_end(account_id)
+            else:
+                del self._waiters[account_id]
+            if future.cancelled():
+                continue
+            self._grant(account_id)
+            future.set_result(None)
+
+    def _discard(self, account_id: int, future: asyncio.Future):
+        queue = self._waiters.get(account_id)
+        if queue and future in queue:
+            queue.remove(future)
+            if not queue:
+                del self._waiters[account_id]
+
+    def get_stats(self) -> dict:
+        return {
+            "slots": self.slots,
+            "in_use": self.in_use,
+            "active_by_account": dict(self.active),
+            "waiting_by_account": {account: len(queue) for account, queue in self._waiters.items()},
+            "granted_by_account": dict(self.granted),
+        }
+
+
+llm_fair_share = FairShareScheduler(LLM_FAIR_SHARE_SLOTS)
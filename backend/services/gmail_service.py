@@ -1,63 +1,74 @@
 import os.path
 import base64
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from bs4 import BeautifulSoup
 from email.mime.text import MIMEText
-from googleapiclient.errors import HttpError
 
-# If modifying these scopes, delete the file token.json.
-# If modifying these scopes, delete the file token.json.
+from database import DEFAULT_ACCOUNT_ID
+from services.credentials import load_token, save_token, load_client_config
+from services.mime_parser import extract_body, get_header
+from services.log_pipeline import get_logger
+
+logger = get_logger("gmail")
+
+# If modifying these scopes, delete the stored token (POST /api/logout).
 SCOPES = [
     'https://www.googleapis.com/auth/gmail.readonly',
     'https://www.googleapis.com/auth/gmail.send',
     'https://www.googleapis.com/auth/gmail.compose'
 ]
 
-def get_gmail_service():
-    """Shows basic usage of the Gmail API.
-    Lists the user's Gmail labels.
+# Headers kept on parsed messages (used by the pre-filter)
+BULK_HEADERS = ['List-Unsubscribe', 'List-Id', 'Precedence', 'Auto-Submitted']
+GMAIL_BATCH_SIZE = 50 # Gmail recommends <= 50 requests per batch
+
+def get_gmail_service(account_id=DEFAULT_ACCOUNT_ID):
+    """Builds an authorized Gmail API client for an account.
+    Runs the local OAuth flow if the account has no valid token yet.
     """
+    # The Google client stack is slow to import; load it on first use, not at API startup
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from googleapiclient.discovery import build
+
     creds = None
-    # The file token.json stores the user's access and refresh tokens, and is
+    # The stored token holds the user's access and refresh tokens, and is
     # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists('token.json'):
-        print("DEBUG: token.json found.")
+    # time. It lives in the database so all API processes share it.
+    token = load_token(account_id)
+    if token:
         try:
-            creds = Credentials.from_authorized_user_file('token.json', SCOPES)
+            creds = Credentials.from_authorized_user_info(token, SCOPES)
         except Exception as e:
-            print(f"DEBUG: Error loading token.json: {e}")
+            logger.warning("Error loading token for account %s: %s", account_id, e)
             creds = None
     else:
-        print("DEBUG: token.json NOT found.")
+        logger.debug("No token stored for account %s.", account_id)
     
     # If there are no (valid) credentials available, let the user log in.
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
-            print("DEBUG: Token expired, attempting refresh...")
+            logger.info("Token expired, attempting refresh...", extra={"account_id": account_id})
             try:
                 creds.refresh(Request())
-                print("DEBUG: Token refreshed successfully.")
+                logger.info("Token refreshed successfully.", extra={"account_id": account_id})
             except Exception as e:
-                print(f"DEBUG: Token refresh failed: {e}")
+                logger.warning("Token refresh failed: %s", e, extra={"account_id": account_id})
                 creds = None
 
         if not creds or not creds.valid:
             # Check if running on Render
             if os.environ.get("RENDER") or os.environ.get("on_render"): # Render sets 'RENDER' usually, checking generic
-                 print("CRITICAL: Authentication failed on Render. Cannot open local browser.")
-                 print("ACTION REQUIRED: Please update the GOOGLE_TOKEN_JSON environment variable with a fresh local token.")
+                 logger.critical("Authentication failed on Render. Cannot open local browser.")
+                 logger.critical("ACTION REQUIRED: Please update the GOOGLE_TOKEN_JSON environment variable with a fresh local token.")
                  raise RuntimeError("Authentication failed on Cloud Server. Check server logs.")
 
-            if not os.path.exists('credentials.json'):
-                raise FileNotFoundError("credentials.json not found. Please download it from Google Cloud Console.")
+            client_config = load_client_config()
+            if not client_config:
+                raise FileNotFoundError("Client credentials not found. Set GOOGLE_CREDENTIALS_JSON or put credentials.json (from Google Cloud Console) next to the app and restart.")
                 
-            print("Starting OAuth flow (Local)...")
-            flow = InstalledAppFlow.from_client_secrets_file(
-                'credentials.json', SCOPES)
+            logger.info("Starting OAuth flow (Local)...")
+            from google_auth_oauthlib.flow import InstalledAppFlow
+            flow = InstalledAppFlow.from_client_config(
+                client_config, SCOPES)
             success_message = """
             <html>
                 <head>
@@ -128,21 +139,20 @@ def get_gmail_service():
             </html>
             """
             creds = flow.run_local_server(port=0, success_message=success_message)
-            print("OAuth flow completed.")
+            logger.info("OAuth flow completed.")
             
         # Save the credentials for the next run
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
+        save_token(account_id, creds.to_json())
 
     service = build('gmail', 'v1', credentials=creds)
     return service
 
-def fetch_recent_emails(limit=5, next_page_token=None):
+def fetch_recent_emails(limit=5, next_page_token=None, account_id=DEFAULT_ACCOUNT_ID):
     """
     Fetches the most recent 'limit' emails from the inbox.
     Supports pagination.
     """
-    service = get_gmail_service()
+    service = get_gmail_service(account_id)
     
     # Call the Gmail API
     # Modified to fetch 'full' format to ensure we get body snippet if standard parsing fails
@@ -157,47 +167,68 @@ def fetch_recent_emails(limit=5, next_page_token=None):
     email_data = []
     
     if not messages:
-        print('No labels found.')
+        logger.debug("No messages found.")
         return [], None
 
     for message in messages:
         try:
             msg = service.users().messages().get(userId='me', id=message['id']).execute()
-            
-            # Extract headers
-            headers = msg['payload']['headers']
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), "No Subject")
-            sender = next((h['value'] for h in headers if h['name'] == 'From'), "Unknown Sender")
-            
-            # Extract Body
-            body = ""
-            if 'parts' in msg['payload']:
-                for part in msg['payload']['parts']:
-                    if part['mimeType'] == 'text/plain':
-                         if 'data' in part['body']:
-                            data = part['body']['data']
-                            body += base64.urlsafe_b64decode(data).decode()
-            elif 'body' in msg['payload']:
-                 if 'data' in msg['payload']['body']:
-                    data = msg['payload']['body']['data']
-                    body = base64.urlsafe_b64decode(data).decode()
-            
-            # Simple cleanup
-            if not body:
-                body = msg.get('snippet', "") # Fallback to snippet
-                
-            email_data.append({
-                "id": message['id'],            
-                "sender": sender,
-                "subject": subject,
-                "body": body
-            })
+            email_data.append(parse_message(msg))
         except Exception as e:
-            print(f"Error fetching email {message['id']}: {e}")
+            logger.warning("Error fetching email %s: %s", message['id'], e, extra={"account_id": account_id})
             continue
 
     return email_data, new_next_page_token
 
+def fetch_emails_by_id(message_ids, account_id=DEFAULT_ACCOUNT_ID):
+    """
+    Fetches several emails by Gmail message ID in batch HTTP calls.
+    Used to re-hydrate messages that are no longer in the server-side message store.
+    Returns {message_id: email dict}; messages that cannot be fetched are logged and left out.
+    """
+    service = get_gmail_service(account_id)
+    emails = {}
+
+    def callback(request_id, response, exception):
+        if exception is not None:
+            logger.warning("Error fetching email %s: %s", request_id, exception, extra={"account_id": account_id})
+        else:
+            emails[request_id] = parse_message(response)
+
+    for start in range(0, len(message_ids), GMAIL_BATCH_SIZE):
+        batch = service.new_batch_http_request(callback=callback)
+        for message_id in message_ids[start:start + GMAIL_BATCH_SIZE]:
+            batch.add(service.users().messages().get(userId='me', id=message_id), request_id=message_id)
+        batch.execute()
+    return emails
+
+def parse_message(msg):
+    """
+    Converts a Gmail API message resource into our simple email dict.
+    """
+    # Extract headers
+    headers = msg['payload'].get('headers', [])
+    subject = get_header(headers, 'Subject', "No Subject")
+    sender = get_header(headers, 'From', "Unknown Sender")
+
+    # Extract Body (walks nested multiparts, honours charsets, caps decoded size)
+    body = extract_body(msg['payload'])
+
+    # Simple cleanup
+    if not body:
+        body = msg.get('snippet', "") # Fallback to snippet
+
+    return {
+        "id": msg['id'],
+        "sender": sender,
+        "subject": subject,
+        "body": body,
+        "label_ids": msg.get('labelIds', []),
+        "thread_id": msg.get('threadId'),
+        "internal_date": int(msg.get('internalDate') or 0),
+        "headers": {name: value for name in BULK_HEADERS if (value := get_header(headers, name))}
+    }
+
 def create_message(sender, to, subject, message_text):
     """Create a message for an email."""
     message = MIMEText(message_text)
@@ -206,26 +237,52 @@ def create_message(sender, to, subject, message_text):
     message['subject'] = subject
     return {'raw': base64.urlsafe_b64encode(message.as_bytes()).decode()}
 
-def send_message(to, subject, message_text):
+def send_message(to, subject, message_text, account_id=DEFAULT_ACCOUNT_ID):
     """Send an email message."""
-    service = get_gmail_service()
+    from googleapiclient.errors import HttpError
+    service = get_gmail_service(account_id)
     try:
         message = create_message("me", to, subject, message_text)
         sent_message = service.users().messages().send(userId="me", body=message).execute()
         return sent_message
     except HttpError as error:
-        print(f'An error occurred: {error}')
+        logger.error("An error occurred: %s", error)
         raise error
 
-def create_draft(to, subject, message_text):
+def create_draft(to, subject, message_text, account_id=DEFAULT_ACCOUNT_ID):
     """Create a draft email."""
-    service = get_gmail_service()
+    from googleapiclient.errors import HttpError
+    service = get_gmail_service(account_id)
     try:
         message = create_message("me", to, subject, message_text)
         draft = {'message': message}
         draft_response = service.users().drafts().create(userId="me", body=draft).execute()
-        print(f'Draft id: {draft_response["id"]}')
+        logger.info("Draft id: %s", draft_response["id"])
         return draft_response
     except HttpError as error:
-        print(f'An error occurred: {error}')
+        logger.error("An error occurred: %s", error)
         raise error
+
+def execute_batch(requests, account_id=DEFAULT_ACCOUNT_ID):
+    """
+    Sends several send/draft requests in one Gmail batch HTTP call.
+    requests: list of (key, kind, to, subject, body) where kind is 'send' or 'draft'.
+    Returns {key: (response, error)}; errors are per request, not raised.
+    """
+    service = get_gmail_service(account_id)
+    results = {}
+
+    def callback(request_id, response, exception):
+        results[request_id] = (response, exception)
+
+    batch = service.new_batch_http_request(callback=callback)
+    for key, kind, to, subject, message_text in requests:
+        message = create_message("me", to, subject, message_text)
+        if kind == "draft":
+            request = service.users().drafts().create(userId="me", body={'message': message})
+        else:
+            request = service.users().messages().send(userId="me", body=message)
+        batch.add(request, request_id=str(key))
+
+    batch.execute()
+    return results
@@ -0,0 +1,87 @@
+import os
+import re
+from typing import List, Optional, Tuple
+
+from sqlmodel import Session, select
+
+from database import DEFAULT_ACCOUNT_ID
+from db_models import KnowledgeBase, AISettings
+
+# What a suggested reply was drafted from, so a settings or knowledge base change
+# only redrafts the replies it affects (see services/reply_refresh.py).
+# A reply prompt gets the knowledge base entries whose topic words appear in the
+# email as whole words (best matches first, at most KNOWLEDGE_MAX_ENTRIES), or the
+# first KNOWLEDGE_FALLBACK_ENTRIES entries when none do. The reply records the ids of
+# the matching entries (none for the fallback, so adding an unrelated entry does not
+# touch it) plus the account's settings and knowledge versions at drafting time.
+KNOWLEDGE_MAX_ENTRIES = int(os.environ.get("KNOWLEDGE_MAX_ENTRIES", "5"))
+KNOWLEDGE_FALLBACK_ENTRIES = 20 # The whole-knowledge-base context replies used before
+RELEVANCE_SCAN_CHARS = 5000
+# Three characters so that topics like "SLA", "FAQ" or "API" count
+_WORD_RE = re.compile(r"[a-z0-9][a-z0-9\-]*")
+_TOPIC_MIN_CHARS = 3
+_STOP_WORDS = {"the", "and", "for", "our", "you", "are", "how", "with", "from", "that", "this", "your", "have",
+               "will", "about", "what", "when", "info"}
+
+
+def topic_words(topic: str) -> set:
+    return {w for w in _WORD_RE.findall(topic.lower()) if len(w) >= _TOPIC_MIN_CHARS and w not in _STOP_WORDS}
+
+
+def load_knowledge(session: Session, account_id: int = DEFAULT_ACCOUNT_ID) -> List[KnowledgeBase]:
+    return session.exec(
+        select(KnowledgeBase).where(KnowledgeBase.account_id == account_id).order_by(KnowledgeBase.id)
+    ).all()
+
+
+def matching_knowledge(items: List[KnowledgeBase], subject: str, body: str) -> List[KnowledgeBase]:
+    """Entries whose topic words appear in the email, best matches first. Empty if none do."""
+    words = set(_WORD_RE.findall(f"{subject} {body[:RELEVANCE_SCAN_CHARS]}".lower()))
+    scored = []
+    for item in items:
+        hits = len(topic_words(item.topic) & words)
+        if hits:
+            scored.append((-hits, item.id, item))
+    scored.sort(key=lambda entry: entry[:2])
+    return [item for _, _, item in scored[:KNOWLEDGE_MAX_ENTRIES]]
+
+
+def relevant_knowledge(items: List[KnowledgeBase], subject: str, body: str) -> List[KnowledgeBase]:
+    """The entries a reply prompt gets: the matching ones, or the fallback."""
+    return matching_knowledge(items, subject, body) or list(items[:KNOWLEDGE_FALLBACK_ENTRIES]) # Loaded in id order
+
+
+def knowledge_context(items: List[KnowledgeBase]) -> str:
+    context = ""
+    for item in items:
+        context += f"Topic: {item.topic}\nInfo: {item.content}\n\n"
+    return context
+
+
+def knowledge_ids(items: List[KnowledgeBase]) -> str:
+    # Pass matching_knowledge(): "" marks a reply drafted with the fallback entries
+    return ",".join(str(item.id) for item in items)
+
+
+def reply_versions(session: Session, account_id: int = DEFAULT_ACCOUNT_ID) -> Tuple[int, int]:
+    """(settings version, knowledge version) that new replies are drafted with."""
+    settings = session.exec(select(AISettings).where(AISettings.account_id == account_id)).first()
+    if not settings:
+        return 1, 1
+    return settings.reply_version, settings.knowledge_version
+
+
+def bump_version(session: Session, account_id: int, settings: Optional[AISettings] = None, knowledge: bool = False):
+    """
+    Marks replies drafted before now as outdated: the settings version after a tone or
+    signature change, the knowledge version after a knowledge base change. Not committed.
+    """
+    settings = settings or session.exec(select(AISettings).where(AISettings.account_id == account_id)).first()
+    if not settings:
+        settings = AISettings(account_id=account_id)
+    if knowledge:
+        settings.knowledge_version += 1
+    else:
+        settings.reply_version += 1
+    session.add(settings)
+    return settings
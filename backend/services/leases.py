@@ -0,0 +1,57 @@
+import os
+import uuid
+import socket
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import update, insert, delete, or_
+from sqlalchemy.exc import IntegrityError
+
+from database import write_engine
+from db_models import Lease
+
+# Leases coordinate work between API processes sharing one database.
+# A lease is a row (name, holder, expires_at); taking it is a single conditional
+# UPDATE or INSERT, so it works the same on SQLite and Postgres. Holders renew
+# before expiry; a crashed process simply lets its leases lapse.
+# The holder is a token per acquisition, not per process, so two requests in the
+# same process exclude each other too. Long-running workers keep one token
+# (new_holder()) and pass it back to renew.
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def new_holder() -> str:
+    return f"{INSTANCE_ID}:{uuid.uuid4().hex[:8]}"
+
+
+def try_acquire(name: str, ttl_seconds: float, holder: Optional[str] = None) -> Optional[str]:
+    """
+    Takes the lease, or renews it if `holder` is the token it was taken with.
+    Returns the holder token to renew and release it with, or None if someone else holds it.
+    """
+    holder = holder or new_holder()
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=ttl_seconds)
+    try:
+        with write_engine.begin() as conn:
+            renewed = conn.execute(
+                update(Lease)
+                .where(Lease.name == name)
+                .where(or_(Lease.holder == holder, Lease.expires_at < now))
+                .values(holder=holder, expires_at=expires_at)
+            ).rowcount
+            if not renewed:
+                conn.execute(insert(Lease).values(name=name, holder=holder, expires_at=expires_at))
+        return holder
+    except IntegrityError:
+        return None # Someone else holds it
+
+
+def release(name: str, holder: str):
+    with write_engine.begin() as conn:
+        conn.execute(delete(Lease).where(Lease.name == name).where(Lease.holder == holder))
+
+
+def purge_expired() -> int:
+    with write_engine.begin() as conn:
+        return conn.execute(delete(Lease).where(Lease.expires_at < datetime.utcnow())).rowcount
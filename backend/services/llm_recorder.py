@@ -0,0 +1,129 @@
+import os
+import gzip
+import json
+import time
+import hashlib
+import threading
+from collections import defaultdict, deque
+from typing import Dict, Optional
+
+# Record / replay for OpenRouter calls.
+#   LLM_RECORD_MODE=record  real calls; every request/response pair is appended to LLM_RECORD_PATH
+#   LLM_RECORD_MODE=replay  no network; responses are served from LLM_RECORD_PATH with their
+#                           original latency (divided by LLM_REPLAY_SPEED, 0 = no waiting)
+# The store is gzip-compressed JSON lines, one gzip member per record, so appending
+# never rewrites the file and a torn last write only loses that record.
+# Replay first looks for the same model + prompt hash, then falls back to that model's
+# recordings in order, so the fallback chain and JSON extraction see real traffic shapes.
+LLM_RECORD_MODE = os.environ.get("LLM_RECORD_MODE", "off").lower()
+LLM_RECORD_PATH = os.environ.get("LLM_RECORD_PATH", "llm_recordings.jsonl.gz")
+LLM_REPLAY_SPEED = float(os.environ.get("LLM_REPLAY_SPEED", "1.0"))
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:16]
+
+
+class RecordedResponse:
+    """The parts of requests.Response that the analysis code reads."""
+
+    def __init__(self, status_code: int, text: str):
+        self.status_code = status_code
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class ReplayedError(Exception):
+    """A recorded transport error (timeout, connection reset...) raised again on replay."""
+
+
+class LLMRecorder:
+    def __init__(self, mode: str = LLM_RECORD_MODE, path: str = LLM_RECORD_PATH, speed: float = LLM_REPLAY_SPEED):
+        self.mode = mode
+        self.path = path
+        self.speed = speed
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._by_prompt: Optional[Dict[tuple, deque]] = None
+        self._by_model: Optional[Dict[str, deque]] = None
+
+    def record(self, model: str, prompt: str, latency_ms: float, status: int, body: str, error: str = None):
+        entry = {
+            "ts": time.time(),
+            "model": model,
+            "prompt_hash": prompt_hash(prompt),
+            "prompt_chars": len(prompt),
+            "latency_ms": round(latency_ms, 1),
+            "status": status,
+            "body": body,
+        }
+        if error:
+            entry["error"] = error
+        line = (json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+        with self._lock:
+            with open(self.path, "ab") as f:
+                f.write(gzip.compress(line))
+            self.recorded += 1
+
+    def load(self):
+        by_prompt, by_model = defaultdict(deque), defaultdict(deque)
+        for entry in read_recordings(self.path):
+            by_prompt[(entry["model"], entry["prompt_hash"])].append(entry)
+            by_model[entry["model"]].append(entry)
+        self._by_prompt, self._by_model = by_prompt, by_model
+
+    def next_recording(self, model: str, prompt: str) -> Optional[dict]:
+        with self._lock:
+            if self._by_prompt is None:
+                self.load()
+            for queue in (self._by_prompt.get((model, prompt_hash(prompt))), self._by_model.get(model)):
+                if queue:
+                    entry = queue[0]
+                    queue.rotate(-1) # Cycle, so a short recording can drive a long run
+                    return entry
+        return None
+
+    def replay(self, model: str, prompt: str, timeout: float = None) -> RecordedResponse:
+        entry = self.next_recording(model, prompt)
+        if entry is None:
+            self.misses += 1
+            return RecordedResponse(503, f"No recording for model {model}")
+        self.replayed += 1
+        # Timeouts are wall-clock, like the recorded latency once divided by the speed
+        wait = entry["latency_ms"] / 1000 / self.speed if self.speed > 0 else 0.0
+        timed_out = timeout is not None and wait > timeout
+        time.sleep(timeout if timed_out else wait)
+        if timed_out: # The live call would have been cut off at its timeout
+            raise ReplayedError(f"Read timed out. (read timeout={timeout:.1f})")
+        if entry.get("error"):
+            raise ReplayedError(entry["error"])
+        return RecordedResponse(entry["status"], entry["body"])
+
+    def wall_seconds(self, seconds: float) -> float:
+        """A real-time wait (e.g. rate-limit backoff) on the replay clock."""
+        if self.mode != "replay":
+            return seconds
+        return seconds / self.speed if self.speed > 0 else 0.0
+
+    def get_stats(self) -> dict:
+        return {"mode": self.mode, "path": self.path, "recorded": self.recorded, "replayed": self.replayed, "misses": self.misses}
+
+
+def read_recordings(path: str):
+    """Yields recorded entries; stops quietly at a torn last record."""
+    if not os.path.exists(path):
+        return
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        except (EOFError, OSError, json.JSONDecodeError):
+            return
+
+
+llm_recorder = LLMRecorder()
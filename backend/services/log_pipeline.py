@@ -0,0 +1,234 @@
+import os
+import sys
+import json
+import queue
+import random
+import logging
+import uuid
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Optional
+
+# Non-blocking logging. Callers only format the message and put the record on a
+# bounded in-memory queue; one listener thread writes JSON lines (or plain text)
+# to stdout and, optionally, a size-rotated file. A full queue drops records
+# instead of blocking the request. Every record carries the request and batch
+# correlation IDs from the context it was logged in.
+#   LOG_LEVEL        minimum level (INFO)
+#   LOG_FORMAT       json | text (json)
+#   LOG_FILE         also write to this file, rotated at LOG_MAX_BYTES x LOG_BACKUP_COUNT
+#   LOG_SAMPLE_RATES fraction of records kept per level, e.g. "DEBUG=0.1,INFO=1";
+#                    WARNING and above are always kept
+#   SQL_ECHO         log every SQL statement through this pipeline (off)
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json").lower()
+LOG_FILE = os.environ.get("LOG_FILE", "")
+LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT", "5"))
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+SQL_ECHO = os.environ.get("SQL_ECHO", "false").lower() == "true"
+
+ROOT_LOGGER = "ops"
+# Attributes every LogRecord has; anything else came in through extra= and is a field
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id", "batch_id"}
+
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+batch_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("batch_id", default=None)
+
+
+def parse_sample_rates(value: str) -> dict:
+    rates = {}
+    for part in value.split(","):
+        name, _, rate = part.partition("=")
+        level = logging.getLevelName(name.strip().upper())
+        if isinstance(level, int) and rate.strip():
+            rates[level] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+LOG_SAMPLE_RATES = parse_sample_rates(os.environ.get("LOG_SAMPLE_RATES", "DEBUG=0.1"))
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger under the application root, e.g. get_logger("ai_agent") -> "ops.ai_agent"."""
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+@contextmanager
+def correlation(request_id: Optional[str] = None, batch_id: Optional[str] = None):
+    """Tags every record logged inside the block (including tasks and executor threads started from it)."""
+    tokens = []
+    if request_id is not None:
+        tokens.append((request_id_var, request_id_var.set(request_id)))
+    if batch_id is not None:
+        tokens.append((batch_id_var, batch_id_var.set(batch_id)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def set_batch_id(batch_id: Optional[str] = None) -> contextvars.Token:
+    """
+    Tags records with a batch ID (a new one by default) until reset_batch_id(token).
+    For async generators, where a with-block would span yields.
+    """
+    return batch_id_var.set(batch_id or uuid.uuid4().hex[:12])
+
+
+def reset_batch_id(token: contextvars.Token):
+    try:
+        batch_id_var.reset(token)
+    except ValueError:
+        pass # Generator closed by the event loop in another context; nothing to restore there
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name.removeprefix(ROOT_LOGGER + "."),
+            "msg": record.getMessage(),
+        }
+        for key in ("request_id", "batch_id"):
+            value = getattr(record, key, None)
+            if value:
+                entry[key] = value
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        ids = " ".join(f"{key}={value}" for key in ("request_id", "batch_id") if (value := getattr(record, key, None)))
+        return f"{line} [{ids}]" if ids else line
+
+
+class LogStats:
+    def __init__(self):
+        self.queued = 0
+        self.dropped = 0 # Queue full
+        self.sampled_out = 0
+        self._lock = threading.Lock()
+
+    def add(self, field: str):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def get_stats(self, log_queue: Optional[queue.SimpleQueue] = None) -> dict:
+        with self._lock:
+            return {
+                "level": LOG_LEVEL,
+                "format": LOG_FORMAT,
+                "file": LOG_FILE or None,
+                "sample_rates": {logging.getLevelName(level): rate for level, rate in LOG_SAMPLE_RATES.items()},
+                "queued": self.queued,
+                "dropped": self.dropped,
+                "sampled_out": self.sampled_out,
+                "queue_depth": log_queue.qsize() if log_queue is not None else 0,
+            }
+
+
+log_stats = LogStats()
+
+
+class SamplingQueueHandler(QueueHandler):
+    """QueueHandler that samples low levels, adds correlation IDs and never blocks."""
+
+    def __init__(self, log_queue: queue.SimpleQueue, sample_rates: dict, max_size: int = LOG_QUEUE_SIZE):
+        super().__init__(log_queue)
+        self.sample_rates = sample_rates
+        self.max_size = max_size
+
+    def emit(self, record: logging.LogRecord):
+        rate = self.sample_rates.get(record.levelno, 1.0)
+        if rate < 1.0 and random.random() >= rate:
+            log_stats.add("sampled_out")
+            return
+        super().emit(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve everything that depends on the caller (args, exception, context)
+        # here; the listener thread only serializes. The record is not shared with
+        # other handlers (the app logger does not propagate), so it is not copied
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.request_id = request_id_var.get()
+        record.batch_id = batch_id_var.get()
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        # SimpleQueue (C, lock-free put) bounded by a size check; may overshoot by a few records
+        if self.queue.qsize() >= self.max_size:
+            log_stats.add("dropped")
+            return
+        self.queue.put_nowait(record)
+        log_stats.add("queued")
+
+
+_listener: Optional[QueueListener] = None
+_queue: Optional[queue.SimpleQueue] = None
+_configure_lock = threading.Lock()
+
+
+def configure_logging(stream=None, log_file: str = LOG_FILE, log_format: str = LOG_FORMAT):
+    """Installs the pipeline on the application logger (idempotent). Call once per process."""
+    global _listener, _queue
+    with _configure_lock:
+        if _listener is not None:
+            return
+        formatter = JSONFormatter() if log_format == "json" else TextFormatter()
+        handlers = [logging.StreamHandler(stream or sys.stdout)]
+        if log_file:
+            handlers.append(RotatingFileHandler(log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        _queue = queue.SimpleQueue()
+        _listener = QueueListener(_queue, *handlers, respect_handler_level=False)
+        _listener.start()
+
+        queue_handler = SamplingQueueHandler(_queue, LOG_SAMPLE_RATES)
+        loggers = [logging.getLogger(ROOT_LOGGER)]
+        if SQL_ECHO:
+            loggers.append(logging.getLogger("sqlalchemy.engine"))
+        for logger in loggers:
+            logger.setLevel(LOG_LEVEL if logger.name == ROOT_LOGGER else logging.INFO)
+            logger.addHandler(queue_handler)
+            logger.propagate = False
+
+
+def shutdown_logging():
+    """Flushes queued records; the pipeline can be configured again afterwards."""
+    global _listener, _queue
+    with _configure_lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        for name in (ROOT_LOGGER, "sqlalchemy.engine"):
+            logger = logging.getLogger(name)
+            for handler in [h for h in logger.handlers if isinstance(h, SamplingQueueHandler)]:
+                logger.removeHandler(handler)
+        for handler in _listener.handlers:
+            handler.close()
+        _listener, _queue = None, None
+
+
+def get_stats() -> dict:
+    return log_stats.get_stats(_queue)
@@ -0,0 +1,153 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from sqlmodel import Session, select
+from sqlalchemy import delete
+from sqlalchemy.exc import IntegrityError
+
+from database import DEFAULT_ACCOUNT_ID, engine, write_engine
+from db_models import CachedMessage
+from services.log_pipeline import get_logger
+
+logger = get_logger("message_store")
+
+# Server-side cache of fetched Gmail messages.
+# /api/gmail-inbox puts every message it returns in here so that
+# /api/analyze-batch-ids only needs the message IDs from the frontend.
+# Messages are written through to the cachedmessage table, so a batch request
+# that reaches another worker or instance than the inbox fetch still finds them.
+MESSAGE_STORE_MAX_ITEMS = int(os.environ.get("MESSAGE_STORE_MAX_ITEMS", "500"))
+MESSAGE_STORE_TTL_SECONDS = int(os.environ.get("MESSAGE_STORE_TTL_SECONDS", "3600"))
+PRUNE_INTERVAL_SECONDS = 600
+
+
+class MessageStore:
+    """
+    Bounded in-process LRU of {(account, id): email dict} with a TTL, in front of the
+    shared cachedmessage table. Misses in memory are read from the table in one query.
+    Rows are removed when discarded or, by any process, once older than the TTL.
+    Database calls block, so async callers run these methods in a thread.
+    """
+
+    def __init__(self, max_items: int = 500, ttl_seconds: int = 3600):
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+
+    def put(self, email: dict, account_id: int = DEFAULT_ACCOUNT_ID):
+        self.put_many([email], account_id)
+
+    def put_many(self, emails: Iterable[dict], account_id: int = DEFAULT_ACCOUNT_ID):
+        emails = list(emails)
+        if not emails:
+            return
+        self._remember(emails, account_id)
+        self._write(emails, account_id)
+        if time.time() - self._last_prune > PRUNE_INTERVAL_SECONDS:
+            self.prune_expired()
+
+    def get(self, message_id: str, account_id: int = DEFAULT_ACCOUNT_ID) -> Optional[dict]:
+        return self.get_many([message_id], account_id).get(message_id)
+
+    def get_many(self, message_ids: List[str], account_id: int = DEFAULT_ACCOUNT_ID) -> Dict[str, dict]:
+        found = {}
+        now = time.time()
+        with self._lock:
+            for message_id in message_ids:
+                key = _key(account_id, message_id)
+                entry = self._items.get(key)
+                if not entry:
+                    continue
+                stored_at, email = entry
+                if now - stored_at <= self.ttl_seconds:
+                    self._items.move_to_end(key)
+                    found[message_id] = email
+                else:
+                    del self._items[key]
+
+        missing = [message_id for message_id in message_ids if message_id not in found]
+        if missing:
+            shared = self._read(missing, account_id)
+            self._remember(shared.values(), account_id)
+            found.update(shared)
+        return found
+
+    def discard(self, message_id: str, account_id: int = DEFAULT_ACCOUNT_ID):
+        """Drops a message that is no longer needed (e.g. once its analysis is saved)."""
+        with self._lock:
+            self._items.pop(_key(account_id, message_id), None)
+        with write_engine.begin() as conn:
+            conn.execute(
+                delete(CachedMessage)
+                .where(CachedMessage.account_id == account_id)
+                .where(CachedMessage.message_id == message_id)
+            )
+
+    def prune_expired(self) -> int:
+        """Removes shared rows older than the TTL, which would never be read back."""
+        self._last_prune = time.time()
+        with write_engine.begin() as conn:
+            return conn.execute(delete(CachedMessage).where(CachedMessage.stored_at < self._cutoff())).rowcount
+
+    def __len__(self):
+        return len(self._items)
+
+    def _remember(self, emails: Iterable[dict], account_id: int):
+        now = time.time()
+        with self._lock:
+            for email in emails:
+                key = _key(account_id, email["id"])
+                self._items[key] = (now, email)
+                self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False) # Still in the shared table
+
+    def _write(self, emails: List[dict], account_id: int):
+        ids = [email["id"] for email in emails]
+        rows = [{"account_id": account_id, "message_id": email["id"], "email_json": json.dumps(email),
+                 "stored_at": datetime.utcnow()} for email in emails]
+        for attempt in range(2):
+            try:
+                with write_engine.begin() as conn:
+                    conn.execute(
+                        delete(CachedMessage)
+                        .where(CachedMessage.account_id == account_id)
+                        .where(CachedMessage.message_id.in_(ids))
+                    )
+                    conn.execute(CachedMessage.__table__.insert(), rows)
+                return
+            except IntegrityError:
+                # Another process stored the same messages between our delete and insert
+                if attempt:
+                    logger.warning("⚠️ Message store write failed for %d messages", len(rows))
+
+    def _read(self, message_ids: List[str], account_id: int) -> Dict[str, dict]:
+        with Session(engine) as session:
+            rows = session.exec(
+                select(CachedMessage.message_id, CachedMessage.email_json)
+                .where(CachedMessage.account_id == account_id)
+                .where(CachedMessage.message_id.in_(message_ids))
+                .where(CachedMessage.stored_at >= self._cutoff())
+            ).all()
+        return {message_id: json.loads(email_json) for message_id, email_json in rows}
+
+    def _cutoff(self) -> datetime:
+        return datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+
+
+def _key(account_id: int, message_id: str) -> str:
+    # Gmail message IDs are only unique within a mailbox
+    return f"{account_id}:{message_id}"
+
+
+message_store = MessageStore(
+    max_items=MESSAGE_STORE_MAX_ITEMS,
+    ttl_seconds=MESSAGE_STORE_TTL_SECONDS,
+)
@@ -0,0 +1,149 @@
+import base64
+import codecs
+import re
+from html import unescape
+from html.parser import HTMLParser
+from typing import List, Optional
+
+# Never decode more than this many bytes of body text per message.
+# Anything past the cap is dropped; the LLM prompt does not need it anyway.
+MAX_BODY_BYTES = 256 * 1024
+
+_CHARSET_RE = re.compile(r'charset\s*=\s*"?([^";\s]+)"?', re.IGNORECASE)
+_BLANK_LINES_RE = re.compile(r'\n\s*\n\s*\n+')
+
+
+def get_header(headers: List[dict], name: str, default: Optional[str] = None) -> Optional[str]:
+    """Case-insensitive header lookup on a Gmail headers list."""
+    name = name.lower()
+    for header in headers or []:
+        if header.get('name', '').lower() == name:
+            return header.get('value', default)
+    return default
+
+
+def extract_body(payload: dict, max_bytes: int = MAX_BODY_BYTES) -> str:
+    """
+    Extracts readable text from a Gmail API message payload.
+
+    Walks the MIME tree iteratively (no recursion, so deeply nested forwards are fine),
+    prefers text/plain parts and falls back to text/html converted to text.
+    Attachments are never decoded and at most max_bytes of text are decoded per message.
+    Gmail has already undone the Content-Transfer-Encoding of every part, so each
+    body.data is only base64url-wrapped bytes in the part's declared charset.
+    """
+    plain_parts = []
+    html_parts = []
+
+    # Depth-first, in document order
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        children = part.get('parts')
+        if children:
+            stack.extend(reversed(children))
+            continue
+
+        mime_type = (part.get('mimeType') or '').lower()
+        if mime_type not in ('text/plain', 'text/html'):
+            continue
+        if part.get('filename'):
+            continue # Text attachment, not the message body
+
+        body = part.get('body') or {}
+        data = body.get('data')
+        if not data:
+            continue # Stored as attachmentId; never fetched
+
+        if mime_type == 'text/plain':
+            plain_parts.append(part)
+        else:
+            html_parts.append(part)
+
+    if plain_parts:
+        return _decode_parts(plain_parts, max_bytes).strip()
+    if html_parts:
+        return html_to_text(_decode_parts(html_parts, max_bytes))
+    return ""
+
+
+def _decode_parts(parts: List[dict], max_bytes: int) -> str:
+    texts = []
+    remaining = max_bytes
+    for part in parts:
+        if remaining <= 0:
+            break
+        raw = _b64url_decode(part['body']['data'], remaining)
+        remaining -= len(raw)
+        charset = _part_charset(part)
+        texts.append(decode_bytes(raw, charset))
+    return "\n".join(texts)
+
+
+def _b64url_decode(data: str, max_bytes: int) -> bytes:
+    # Only decode what we need: 4 base64 chars -> 3 bytes
+    max_chars = ((max_bytes + 2) // 3) * 4
+    chunk = data[:max_chars]
+    chunk += '=' * (-len(chunk) % 4)
+    return base64.urlsafe_b64decode(chunk)[:max_bytes]
+
+
+def _part_charset(part: dict) -> Optional[str]:
+    content_type = get_header(part.get('headers'), 'Content-Type', '')
+    match = _CHARSET_RE.search(content_type or '')
+    return match.group(1) if match else None
+
+
+def decode_bytes(raw: bytes, charset: Optional[str]) -> str:
+    """
+    Decodes body bytes with the declared charset.
+    Unknown charsets fall back to UTF-8; undecodable bytes are replaced instead of failing.
+    """
+    charset = (charset or 'utf-8').strip().lower()
+    if charset in ('us-ascii', 'ascii'):
+        charset = 'utf-8' # Mislabelled 8-bit mail is common
+    try:
+        codecs.lookup(charset)
+    except LookupError:
+        charset = 'utf-8'
+    return raw.decode(charset, errors='replace')
+
+
+class _HTMLToText(HTMLParser):
+    BLOCK_TAGS = {'p', 'div', 'br', 'tr', 'li', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'table', 'blockquote', 'hr'}
+    SKIP_TAGS = {'script', 'style', 'head', 'title'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.chunks = []
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag in self.BLOCK_TAGS:
+            self.chunks.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag in self.BLOCK_TAGS:
+            self.chunks.append("\n")
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.chunks.append(data)
+
+
+def html_to_text(html: str) -> str:
+    """Cheap HTML -> text conversion (drops scripts/styles, keeps paragraph breaks)."""
+    parser = _HTMLToText()
+    try:
+        parser.feed(html)
+        parser.close()
+        text = "".join(parser.chunks)
+    except Exception:
+        # Malformed markup: strip tags the crude way
+        text = unescape(re.sub(r'<[^>]+>', ' ', html))
+    lines = [" ".join(line.split()) for line in text.splitlines()]
+    return _BLANK_LINES_RE.sub("\n\n", "\n".join(lines)).strip()
@@ -0,0 +1,239 @@
+import os
+import re
+import hashlib
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from sqlmodel import Session, select
+from sqlalchemy import delete
+from sqlalchemy.exc import IntegrityError
+
+from models import EmailAnalysis
+from database import DEFAULT_ACCOUNT_ID, engine, write_engine
+from db_models import EmailFingerprint
+from services.log_pipeline import get_logger
+
+logger = get_logger("near_duplicate")
+
+# SimHash index over normalized LoggedEmail bodies.
+# Templated mail (invoices, alerts, order confirmations) from the same sender
+# lands within a few bits of an earlier email, so we can reuse its classification.
+# Numbers, URLs and addresses are normalized away, so two invoices for different
+# amounts match: only category, sentiment and urgency carry over. The summary,
+# action items and reply would quote the other email, so the reply is drafted on demand.
+# Fingerprints are kept in the emailfingerprint table; each process holds the index in
+# memory and loads rows other processes added before every lookup.
+NEAR_DUP_ENABLED = os.environ.get("NEAR_DUP_ENABLED", "true").lower() == "true"
+NEAR_DUP_MAX_DISTANCE = int(os.environ.get("NEAR_DUP_MAX_DISTANCE", "3"))
+# Postgres may commit ids out of order: each refresh also re-reads this many ids below the highest seen
+REFRESH_OVERLAP_IDS = 100
+
+FINGERPRINT_BITS = 64
+# With 4 bands of 16 bits, any two fingerprints within 3 bits share at least one band exactly
+BANDS = 4
+BAND_BITS = FINGERPRINT_BITS // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+
+# Normalization: strip the parts of templated mail that change per message
+_URL_RE = re.compile(r'https?://\S+')
+_EMAIL_RE = re.compile(r'\S+@\S+')
+_NUMBER_RE = re.compile(r'\d[\d,.:/\-]*')
+_WORD_RE = re.compile(r'\w+')
+MIN_TOKENS = 8 # Too-short bodies collide too easily
+
+
+def normalize(subject: str, body: str) -> List[str]:
+    text = f"{subject}\n{body[:4000]}".lower()
+    text = _URL_RE.sub(" url ", text)
+    text = _EMAIL_RE.sub(" email ", text)
+    text = _NUMBER_RE.sub(" num ", text)
+    return _WORD_RE.findall(text)
+
+
+def simhash(tokens: List[str]) -> int:
+    """64-bit SimHash over word 3-shingles."""
+    weights = [0] * FINGERPRINT_BITS
+    shingles = [" ".join(tokens[i:i + 3]) for i in range(max(1, len(tokens) - 2))]
+    for shingle in shingles:
+        h = int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), "big")
+        for bit in range(FINGERPRINT_BITS):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def sender_domain(sender: str) -> str:
+    return sender.rsplit("@", 1)[-1].strip(" >").lower() if "@" in sender else sender.lower()
+
+
+def fingerprint_email(sender: str, subject: str, body: str) -> Optional[Tuple[int, str]]:
+    tokens = normalize(subject, body)
+    if len(tokens) < MIN_TOKENS:
+        return None
+    return simhash(tokens), sender_domain(sender)
+
+
+class NearDuplicateIndex:
+    """
+    Banded SimHash index: {band number: {band value: [row ids]}}.
+    Persisted in the emailfingerprint table; refresh() loads the rows added since the
+    last call, by this or any other process. Matches never cross accounts.
+    """
+
+    def __init__(self, persist: bool = True):
+        self.persist = persist
+        self.entries: Dict[int, Tuple[int, str, int]] = {} # row id -> (fingerprint, domain, account)
+        self.bands: List[Dict[int, List[int]]] = [defaultdict(list) for _ in range(BANDS)]
+        self.last_seen = 0 # Highest emailfingerprint id loaded
+        self.hits = 0
+        self.lookups = 0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def refresh(self) -> int:
+        """Loads fingerprints added since the last refresh. Returns how many were loaded."""
+        if not self.persist or not self._refresh_lock.acquire(blocking=False):
+            return 0 # The first load is still running; lookups miss until it is done
+        try:
+            with Session(engine) as session:
+                rows = session.exec(
+                    select(EmailFingerprint.id, EmailFingerprint.email_id, EmailFingerprint.fingerprint,
+                           EmailFingerprint.domain, EmailFingerprint.account_id)
+                    .where(EmailFingerprint.id > self.last_seen - REFRESH_OVERLAP_IDS)
+                    .order_by(EmailFingerprint.id)
+                ).all()
+            loaded = 0
+            with self._lock:
+                for fingerprint_id, row_id, fingerprint, domain, account_id in rows:
+                    entry = (int(fingerprint, 16), domain, account_id)
+                    if self.entries.get(row_id) != entry:
+                        self._insert(row_id, *entry)
+                        loaded += 1
+                    self.last_seen = max(self.last_seen, fingerprint_id)
+            return loaded
+        finally:
+            self._refresh_lock.release()
+
+    def add(self, row_id: int, sender: str, subject: str, body: str, account_id: int = DEFAULT_ACCOUNT_ID):
+        fp = fingerprint_email(sender, subject, body)
+        if not fp:
+            return
+        with self._lock:
+            self._insert(row_id, *fp, account_id)
+        if not self.persist:
+            return
+        # A re-analyzed email gets a new row, so other processes pick up its new fingerprint
+        try:
+            with write_engine.begin() as conn:
+                conn.execute(delete(EmailFingerprint).where(EmailFingerprint.email_id == row_id))
+                conn.execute(EmailFingerprint.__table__.insert().values(
+                    email_id=row_id, account_id=account_id, domain=fp[1], fingerprint=f"{fp[0]:016x}"
+                ))
+        except IntegrityError:
+            pass # Another process indexed the same email at the same time
+
+    def remove(self, row_id: int):
+        with self._lock:
+            self._remove(row_id)
+        if self.persist:
+            with write_engine.begin() as conn:
+                conn.execute(delete(EmailFingerprint).where(EmailFingerprint.email_id == row_id))
+
+    def find(self, sender: str, subject: str, body: str, account_id: int = DEFAULT_ACCOUNT_ID) -> List[Tuple[int, int]]:
+        """Returns [(row id, hamming distance)] for same-account, same-domain matches, closest first."""
+        self.lookups += 1
+        fp = fingerprint_email(sender, subject, body)
+        if not fp:
+            return []
+        fingerprint, domain = fp
+        candidates = set()
+        for band in range(BANDS):
+            value = fingerprint >> (band * BAND_BITS) & BAND_MASK
+            candidates.update(self.bands[band].get(value, ()))
+
+        matches = []
+        for row_id in candidates:
+            entry = self.entries.get(row_id)
+            if not entry or entry[1] != domain or entry[2] != account_id:
+                continue
+            distance = bin(fingerprint ^ entry[0]).count("1")
+            if distance <= NEAR_DUP_MAX_DISTANCE:
+                matches.append((row_id, distance))
+        matches.sort(key=lambda m: m[1])
+        return matches
+
+    def _insert(self, row_id: int, fingerprint: int, domain: str, account_id: int):
+        self._remove(row_id)
+        self.entries[row_id] = (fingerprint, domain, account_id)
+        for band in range(BANDS):
+            self.bands[band][fingerprint >> (band * BAND_BITS) & BAND_MASK].append(row_id)
+
+    def _remove(self, row_id: int) -> bool:
+        entry = self.entries.pop(row_id, None)
+        if not entry:
+            return False
+        for band in range(BANDS):
+            bucket = self.bands[band].get(entry[0] >> (band * BAND_BITS) & BAND_MASK)
+            if bucket and row_id in bucket:
+                bucket.remove(row_id)
+        return True
+
+    def get_stats(self) -> dict:
+        return {
+            "enabled": NEAR_DUP_ENABLED,
+            "indexed_emails": len(self.entries),
+            "max_distance": NEAR_DUP_MAX_DISTANCE,
+            "lookups": self.lookups,
+            "reused_analyses": self.hits,
+        }
+
+
+near_duplicate_index = NearDuplicateIndex()
+
+
+def load_index():
+    """Loads the stored fingerprints (migration 10 built them for emails analyzed before)."""
+    near_duplicate_index.refresh()
+    logger.info("🧬 Loaded near-duplicate index (%d emails).", len(near_duplicate_index))
+
+
+def find_reusable_analysis(session, email_data, account_id: int = DEFAULT_ACCOUNT_ID) -> Optional[EmailAnalysis]:
+    """
+    Returns an EmailAnalysis with the classification of the closest indexed near-duplicate,
+    if any, and no actions or reply. Stale index entries (rows deleted since) are dropped as they are found.
+    """
+    if not NEAR_DUP_ENABLED:
+        return None
+    from db_models import LoggedEmail
+
+    near_duplicate_index.refresh() # Fingerprints other processes added since the last lookup
+    for row_id, distance in near_duplicate_index.find(email_data.sender, email_data.subject, email_data.body, account_id):
+        match = session.get(LoggedEmail, row_id)
+        if not match or match.gmail_message_id == email_data.id or not _still_matches(match, row_id):
+            near_duplicate_index.remove(row_id)
+            continue
+        near_duplicate_index.hits += 1
+        logger.info("🧬 Reusing analysis of email %s (distance %s) for: %s", row_id, distance, email_data.subject, extra={"email_id": email_data.id})
+        return EmailAnalysis(
+            category=match.category,
+            summary=f"Similar to an earlier email: {email_data.subject}"[:200],
+            sentiment=match.sentiment,
+            urgency=match.urgency,
+            action_items=[],
+            suggested_reply=None,
+        )
+    return None
+
+
+def _still_matches(row, row_id: int) -> bool:
+    # Guards against stale entries whose row ids now belong to different emails
+    entry = near_duplicate_index.entries.get(row_id)
+    fp = fingerprint_email(row.sender, row.subject, row.body)
+    return bool(entry and fp) and (*fp, row.account_id) == entry
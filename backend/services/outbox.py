@@ -0,0 +1,293 @@
+import os
+import time
+import asyncio
+import hashlib
+from datetime import datetime, timedelta
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from sqlmodel import Session, select, func
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+
+from database import engine, write_engine
+from db_models import OutboxMessage, LoggedEmail
+from services.executors import gmail_executor
+from services.accounts import shard
+from services.log_pipeline import get_logger
+
+logger = get_logger("outbox")
+
+# Outbox for replies and drafts.
+# Endpoints only insert rows; a background task delivers them in Gmail batch
+# requests, retries with exponential backoff and marks LoggedEmail.is_replied
+# once Gmail has confirmed the send.
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", "20"))  # Gmail recommends <= 50 per batch
+OUTBOX_POLL_SECONDS = float(os.environ.get("OUTBOX_POLL_SECONDS", "1.0"))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", "6"))
+OUTBOX_BACKOFF_SECONDS = float(os.environ.get("OUTBOX_BACKOFF_SECONDS", "2.0"))
+OUTBOX_MAX_BACKOFF_SECONDS = 15 * 60
+# A claimed ('sending') row that is not settled within this time is retried by any process
+OUTBOX_CLAIM_TIMEOUT_SECONDS = int(os.environ.get("OUTBOX_CLAIM_TIMEOUT_SECONDS", "300"))
+
+# Gmail per-user quota: 250 units/second; messages.send costs 100, drafts.create 10
+GMAIL_QUOTA_UNITS_PER_SECOND = float(os.environ.get("GMAIL_QUOTA_UNITS_PER_SECOND", "250"))
+QUOTA_COST = {"send": 100, "draft": 10}
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class QuotaBucket:
+    """Token bucket over Gmail quota units."""
+
+    def __init__(self, units_per_second: float):
+        self.rate = units_per_second
+        self.capacity = units_per_second
+        self.tokens = units_per_second
+        self.updated = time.monotonic()
+
+    def take(self, units: float) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= units:
+            self.tokens -= units
+            return True
+        return False
+
+    def give_back(self, units: float):
+        self.tokens = min(self.capacity, self.tokens + units)
+
+    def wait_time(self, units: float) -> float:
+        return max(0.0, (units - self.tokens) / self.rate)
+
+
+# Gmail quotas are per mailbox
+quotas: Dict[int, QuotaBucket] = defaultdict(lambda: QuotaBucket(GMAIL_QUOTA_UNITS_PER_SECOND))
+
+
+def enqueue(session: Session, account_id: int, kind: str, to: str, subject: str, body: str,
+            email_id: Optional[int] = None, idempotency_key: Optional[str] = None) -> OutboxMessage:
+    """
+    Adds a message to the outbox and commits.
+    Requests with the same idempotency key (sent by the client, or derived from the email
+    and body) get the existing row back, so retries and double clicks queue one message.
+    A still-pending reply for the same email with a different body is updated instead.
+    """
+    if idempotency_key is None and email_id is not None:
+        idempotency_key = f"{kind}:{email_id}:{hashlib.sha1(body.encode()).hexdigest()[:16]}"
+    key = f"{account_id}:{idempotency_key}" if idempotency_key else None
+
+    item = find_by_key(session, key) if key else None
+    if item:
+        if item.status == "failed":
+            # Asking again for a message that failed for good means: try again
+            item.status, item.attempts, item.next_attempt_at = "pending", 0, datetime.utcnow()
+            session.add(item)
+            session.commit()
+        return item
+
+    if email_id is not None:
+        item = session.exec(
+            select(OutboxMessage)
+            .where(OutboxMessage.account_id == account_id)
+            .where(OutboxMessage.email_id == email_id)
+            .where(OutboxMessage.kind == kind)
+            .where(OutboxMessage.status == "pending")
+        ).first()
+    if item:
+        item.to, item.subject, item.body, item.idempotency_key = to, subject, body, key
+    else:
+        item = OutboxMessage(account_id=account_id, kind=kind, to=to, subject=subject, body=body,
+                             email_id=email_id, idempotency_key=key)
+    session.add(item)
+    try:
+        session.commit()
+    except IntegrityError:
+        # Another process queued the same key first
+        session.rollback()
+        item = find_by_key(session, key)
+    return item
+
+
+def find_by_key(session: Session, key: str) -> Optional[OutboxMessage]:
+    return session.exec(select(OutboxMessage).where(OutboxMessage.idempotency_key == key)).first()
+
+
+def claim_batch(session: Session) -> List[OutboxMessage]:
+    """
+    Marks due pending rows of this shard's accounts as 'sending', within each mailbox's Gmail quota.
+    Each row is claimed with a conditional UPDATE, so concurrent processes never claim the same row.
+    """
+    now = datetime.utcnow()
+    statement = (
+        select(OutboxMessage)
+        .where(OutboxMessage.status == "pending")
+        .where(OutboxMessage.next_attempt_at <= now)
+    )
+    index, count = shard()
+    if count > 1:
+        statement = statement.where(OutboxMessage.account_id % count == index)
+    due = [(item.id, item.account_id, item.kind) for item in session.exec(statement.order_by(OutboxMessage.id).limit(OUTBOX_BATCH_SIZE)).all()]
+    session.commit()
+    if not due:
+        return [] # Idle polls never take the write lock
+
+    claimed_ids = []
+    with write_engine.begin() as conn:
+        for item_id, account_id, kind in due:
+            cost = QUOTA_COST.get(kind, 100)
+            if not quotas[account_id].take(cost):
+                continue # This mailbox is out of quota; others may still send
+            taken = conn.execute(
+                update(OutboxMessage)
+                .where(OutboxMessage.id == item_id)
+                .where(OutboxMessage.status == "pending")
+                .values(
+                    status="sending",
+                    attempts=OutboxMessage.attempts + 1,
+                    next_attempt_at=now + timedelta(seconds=OUTBOX_CLAIM_TIMEOUT_SECONDS)
+                )
+            ).rowcount
+            if taken:
+                claimed_ids.append(item_id)
+            else:
+                quotas[account_id].give_back(cost) # Another process got it
+    if not claimed_ids:
+        return []
+    return list(session.exec(select(OutboxMessage).where(OutboxMessage.id.in_(claimed_ids)).order_by(OutboxMessage.id)).all())
+
+
+def record_results(session: Session, claimed_ids: List[int], results: dict):
+    """Applies Gmail batch results: marks sent rows, schedules retries, updates LoggedEmail."""
+    claimed = session.exec(select(OutboxMessage).where(OutboxMessage.id.in_(claimed_ids))).all()
+    for item in claimed:
+        response, error = results.get(str(item.id), (None, RuntimeError("No response from Gmail batch")))
+        if error is None:
+            item.status = "sent"
+            item.sent_at = datetime.utcnow()
+            item.gmail_id = (response or {}).get("id")
+            item.last_error = None
+            if item.kind == "send" and item.email_id:
+                mark_replied(session, item.account_id, item.email_id, item.body)
+        else:
+            schedule_retry(item, error)
+        session.add(item)
+    session.commit()
+
+
+def mark_replied(session: Session, account_id: int, email_id: int, body: str):
+    # Idempotent: a second confirmation for the same email changes nothing
+    email_record = session.get(LoggedEmail, email_id)
+    if email_record and email_record.account_id == account_id and not (email_record.is_replied and email_record.suggested_reply == body):
+        email_record.is_replied = True
+        email_record.suggested_reply = body # Update with actual sent body
+        session.add(email_record)
+
+
+def schedule_retry(item: OutboxMessage, error: Exception):
+    status = getattr(getattr(error, "resp", None), "status", None)
+    item.last_error = str(error)[:500]
+    retryable = status is None or int(status) in RETRYABLE_STATUS
+    if not retryable or item.attempts >= OUTBOX_MAX_ATTEMPTS:
+        item.status = "failed"
+        logger.error("❌ Outbox message %s failed permanently: %s", item.id, item.last_error)
+        return
+    delay = min(OUTBOX_BACKOFF_SECONDS * (2 ** (item.attempts - 1)), OUTBOX_MAX_BACKOFF_SECONDS)
+    item.status = "pending"
+    item.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+    logger.warning("🔁 Outbox message %s will retry in %.0fs (%s)", item.id, delay, item.last_error[:80])
+
+
+def execute_requests(requests: List[tuple], account_id: int) -> dict:
+    """Runs on the Gmail executor; takes plain tuples so no ORM objects cross threads."""
+    from services.gmail_service import execute_batch
+
+    try:
+        return execute_batch(requests, account_id)
+    except Exception as e:
+        # Whole batch failed (auth, network): every item retries
+        return {str(request[0]): (None, e) for request in requests}
+
+
+def recover_stuck(session: Session):
+    """
+    Rows whose claim timed out (the process delivering them crashed) are retried,
+    so delivery is at-least-once. Rows another live process is sending are left alone.
+    """
+    stuck = session.exec(
+        select(OutboxMessage)
+        .where(OutboxMessage.status == "sending")
+        .where(OutboxMessage.next_attempt_at < datetime.utcnow())
+    ).all()
+    for item in stuck:
+        item.status = "pending"
+        item.next_attempt_at = datetime.utcnow()
+        session.add(item)
+    session.commit()
+    if stuck:
+        logger.warning("🔁 Re-queued %d outbox messages left in 'sending'.", len(stuck))
+
+
+def claim_requests() -> Dict[int, List[tuple]]:
+    """Claims a batch and returns it as plain request tuples per mailbox. Runs in a worker thread."""
+    by_account = defaultdict(list)
+    with Session(engine) as session:
+        for item in claim_batch(session):
+            by_account[item.account_id].append((item.id, item.kind, item.to, item.subject, item.body))
+    return by_account
+
+
+def save_results(claimed_ids: List[int], results: dict):
+    with Session(write_engine) as session:
+        record_results(session, claimed_ids, results)
+
+
+def requeue_stuck():
+    with Session(engine) as session:
+        recover_stuck(session)
+
+
+async def deliver_once() -> int:
+    """Delivers one batch. Returns the number of messages attempted."""
+    # Claims wait for the SQLite write lock (up to the busy timeout), so they stay off the event loop
+    by_account = await asyncio.to_thread(claim_requests)
+    if not by_account:
+        return 0
+    claimed_ids = [request[0] for requests in by_account.values() for request in requests]
+    logger.info("📤 Delivering %d outbox messages...", len(claimed_ids))
+    # One Gmail batch per mailbox, run concurrently
+    batches = await asyncio.gather(*(
+        gmail_executor.run(execute_requests, requests, account_id)
+        for account_id, requests in by_account.items()
+    ))
+    results = {}
+    for batch_results in batches:
+        results.update(batch_results)
+    await asyncio.to_thread(save_results, claimed_ids, results)
+    return len(claimed_ids)
+
+
+async def outbox_worker():
+    while True:
+        try:
+            await asyncio.to_thread(requeue_stuck)
+            delivered = await deliver_once()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception("Outbox worker error: %s", e)
+            delivered = 0
+        if not delivered:
+            await asyncio.sleep(OUTBOX_POLL_SECONDS)
+
+
+def get_stats(session: Session, account_id: int) -> dict:
+    rows = session.exec(
+        select(OutboxMessage.status, func.count())
+        .where(OutboxMessage.account_id == account_id)
+        .group_by(OutboxMessage.status)
+    ).all()
+    counts = {"pending": 0, "sending": 0, "sent": 0, "failed": 0}
+    counts.update({status: count for status, count in rows})
+    return counts
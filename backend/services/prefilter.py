@@ -0,0 +1,223 @@
+import os
+import re
+import math
+import time
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from models import EmailAnalysis
+from database import DEFAULT_ACCOUNT_ID
+from services.log_pipeline import get_logger
+
+logger = get_logger("prefilter")
+
+# Local pre-classification that runs before the LLM.
+# Header rules catch bulk mail and notifications; a naive Bayes model trained on
+# LoggedEmail history catches what the rules miss. Only high-confidence Spam/Other
+# predictions skip the LLM, everything else goes through the normal analysis.
+PREFILTER_ENABLED = os.environ.get("PREFILTER_ENABLED", "true").lower() == "true"
+PREFILTER_MIN_CONFIDENCE = float(os.environ.get("PREFILTER_MIN_CONFIDENCE", "0.9"))
+PREFILTER_MIN_TRAINING_ROWS = int(os.environ.get("PREFILTER_MIN_TRAINING_ROWS", "50"))
+PREFILTER_RETRAIN_SECONDS = int(os.environ.get("PREFILTER_RETRAIN_SECONDS", "600"))
+PREFILTER_MAX_TRAINING_ROWS = 5000
+
+# Only these categories may skip the LLM
+SKIPPABLE_CATEGORIES = {"Spam", "Other"}
+
+NOREPLY_RE = re.compile(r'\b(no-?reply|do-?not-?reply|notifications?|mailer-daemon|bounce[s]?)[@+.\-]', re.IGNORECASE)
+TOKEN_RE = re.compile(r"[a-z0-9][a-z0-9'\-]{1,24}")
+
+# Words that mean a human should look even if the mail is automated (invoices, security alerts...)
+GUARD_KEYWORDS = {
+    "invoice", "payment", "overdue", "failed", "declined", "urgent", "security",
+    "password", "refund", "contract", "legal", "outage", "suspended", "action required",
+}
+
+# (category, weight) per header signal; weights combine as independent evidence
+GMAIL_LABEL_RULES = {
+    "SPAM": ("Spam", 0.99),
+    "CATEGORY_PROMOTIONS": ("Spam", 0.9),
+    "CATEGORY_SOCIAL": ("Other", 0.85),
+    "CATEGORY_FORUMS": ("Other", 0.8),
+    "CATEGORY_UPDATES": ("Other", 0.6),
+}
+
+
+class NaiveBayesClassifier:
+    """Multinomial naive Bayes over sender domain, subject and body tokens."""
+
+    def __init__(self):
+        self.class_counts: Counter = Counter()
+        self.token_counts: Dict[str, Counter] = defaultdict(Counter)
+        self.class_totals: Counter = Counter()
+        self.class_urgency: Dict[str, float] = {}
+        self.vocabulary: set = set()
+        self.trained_rows = 0
+
+    def fit(self, rows: List[Tuple[str, str, str, str, int]]):
+        """rows: (sender, subject, body, category, urgency)"""
+        self.__init__()
+        urgency_sums: Counter = Counter()
+        for sender, subject, body, category, urgency in rows:
+            self.class_counts[category] += 1
+            urgency_sums[category] += urgency or 0
+            for token in tokenize(sender, subject, body):
+                self.token_counts[category][token] += 1
+                self.class_totals[category] += 1
+                self.vocabulary.add(token)
+        self.class_urgency = {c: urgency_sums[c] / n for c, n in self.class_counts.items()}
+        self.trained_rows = len(rows)
+
+    def predict(self, sender: str, subject: str, body: str) -> Optional[Tuple[str, float]]:
+        if not self.trained_rows:
+            return None
+        tokens = tokenize(sender, subject, body)
+        vocab_size = len(self.vocabulary) + 1
+        log_scores = {}
+        for category, count in self.class_counts.items():
+            score = math.log(count / self.trained_rows)
+            counts = self.token_counts[category]
+            denominator = self.class_totals[category] + vocab_size
+            for token in tokens:
+                score += math.log((counts[token] + 1) / denominator)
+            log_scores[category] = score
+
+        # Normalize with log-sum-exp to get a posterior
+        best = max(log_scores, key=log_scores.get)
+        top = log_scores[best]
+        total = sum(math.exp(s - top) for s in log_scores.values())
+        return best, 1.0 / total
+
+
+def tokenize(sender: str, subject: str, body: str) -> List[str]:
+    tokens = []
+    domain = sender.rsplit("@", 1)[-1].strip(" >").lower() if "@" in sender else ""
+    if domain:
+        tokens.append("domain:" + domain)
+    if NOREPLY_RE.search(sender):
+        tokens.append("sender:noreply")
+    tokens.extend("subj:" + t for t in TOKEN_RE.findall(subject.lower()))
+    tokens.extend(TOKEN_RE.findall(body[:2000].lower()))
+    return tokens
+
+
+class PreFilter:
+    def __init__(self):
+        self.classifier = NaiveBayesClassifier()
+        self.trained_at = 0.0
+        self.stats = Counter()
+        self._lock = threading.Lock()
+
+    def ensure_trained(self, session, account_id: int = DEFAULT_ACCOUNT_ID):
+        """
+        (Re)trains the model from the account's LoggedEmail history when it is stale. Only
+        LLM analyses count: rows labelled by the pre-filter itself, or copied from another
+        email, would feed its own guesses back in.
+        """
+        if time.time() - self.trained_at < PREFILTER_RETRAIN_SECONDS:
+            return
+        from sqlmodel import select
+        from sqlalchemy import or_
+        from db_models import LoggedEmail
+
+        with self._lock:
+            if time.time() - self.trained_at < PREFILTER_RETRAIN_SECONDS:
+                return
+            rows = session.exec(
+                select(LoggedEmail.sender, LoggedEmail.subject, LoggedEmail.body, LoggedEmail.category, LoggedEmail.urgency)
+                .where(LoggedEmail.account_id == account_id)
+                .where(or_(LoggedEmail.analysis_source == "llm", LoggedEmail.analysis_source.is_(None)))
+                .order_by(LoggedEmail.id.desc())
+                .limit(PREFILTER_MAX_TRAINING_ROWS)
+            ).all()
+            classifier = NaiveBayesClassifier()
+            if len(rows) >= PREFILTER_MIN_TRAINING_ROWS:
+                classifier.fit(rows)
+                logger.info("🧮 Pre-filter model for account %s trained on %d emails.", account_id, len(rows))
+            self.classifier = classifier
+            self.trained_at = time.time()
+
+    def classify(self, email_data) -> Optional[EmailAnalysis]:
+        """
+        Returns a cheap EmailAnalysis when the email is confidently Spam/Other, else None.
+        email_data is a GmailMessage.
+        """
+        self.stats["seen"] += 1
+        if not PREFILTER_ENABLED:
+            return None
+
+        text = f"{email_data.subject}\n{email_data.body[:2000]}".lower()
+        if any(keyword in text for keyword in GUARD_KEYWORDS):
+            return None
+
+        category, confidence, reason = self._header_rules(email_data)
+
+        prediction = self.classifier.predict(email_data.sender, email_data.subject, email_data.body)
+        if prediction:
+            predicted, probability = prediction
+            if predicted in SKIPPABLE_CATEGORIES and probability > confidence:
+                category, confidence, reason = predicted, probability, "model"
+
+        if not category or confidence < PREFILTER_MIN_CONFIDENCE:
+            return None
+
+        self.stats["skipped_llm_calls"] += 1
+        self.stats[f"skipped_by_{reason}"] += 1
+        urgency = round(self.classifier.class_urgency.get(category, 1)) or 1
+        return EmailAnalysis(
+            category=category,
+            summary=f"Automated message: {email_data.subject}"[:200],
+            sentiment="Neutral",
+            urgency=max(1, min(urgency, 3)),
+            action_items=[],
+            suggested_reply=None,
+            confidence=round(confidence, 3),
+        )
+
+    def _header_rules(self, email_data) -> Tuple[Optional[str], float, str]:
+        signals = []
+        for label in email_data.label_ids:
+            if label in GMAIL_LABEL_RULES:
+                signals.append(GMAIL_LABEL_RULES[label])
+
+        headers = {k.lower(): v.lower() for k, v in email_data.headers.items()}
+        if NOREPLY_RE.search(email_data.sender):
+            signals.append(("Other", 0.7))
+        if "list-unsubscribe" in headers or "list-id" in headers:
+            signals.append(("Other", 0.7))
+        if headers.get("precedence") in ("bulk", "list", "junk"):
+            signals.append(("Other", 0.6))
+        if headers.get("auto-submitted", "no") != "no":
+            signals.append(("Other", 0.6))
+
+        if not signals:
+            return None, 0.0, "rules"
+
+        # Strongest category wins; independent signals combine as 1 - prod(1 - w)
+        category = max(signals, key=lambda s: s[1])[0]
+        miss = 1.0
+        for _, weight in signals:
+            miss *= (1 - weight)
+        return category, 1 - miss, "rules"
+
+    def get_stats(self) -> dict:
+        seen = self.stats["seen"]
+        return {
+            "enabled": PREFILTER_ENABLED,
+            "min_confidence": PREFILTER_MIN_CONFIDENCE,
+            "model_training_rows": self.classifier.trained_rows,
+            "emails_seen": seen,
+            "skipped_llm_calls": self.stats["skipped_llm_calls"],
+            "skipped_by_rules": self.stats["skipped_by_rules"],
+            "skipped_by_model": self.stats["skipped_by_model"],
+            "skip_rate_percent": round(100 * self.stats["skipped_llm_calls"] / seen, 1) if seen else 0.0,
+        }
+
+
+# One model per account: mailboxes differ, and training must not mix tenants' mail
+prefilters: Dict[int, PreFilter] = defaultdict(PreFilter)
+
+
+def get_prefilter(account_id: int = DEFAULT_ACCOUNT_ID) -> PreFilter:
+    return prefilters[account_id]
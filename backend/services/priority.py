@@ -0,0 +1,104 @@
+import os
+import re
+import asyncio
+import itertools
+from typing import AsyncIterator, Awaitable, Callable, Iterable, List, Set, TypeVar
+
+# Priority scheduling for batch analysis.
+# A cheap pre-score orders the queue so escalations get LLM capacity before newsletters.
+BATCH_LLM_CONCURRENCY = int(os.environ.get("BATCH_LLM_CONCURRENCY", "8"))
+# Comma separated addresses or domains, e.g. "ceo@acme.com,bigclient.com"
+PRIORITY_SENDERS = [s.strip().lower() for s in os.environ.get("PRIORITY_SENDERS", "").split(",") if s.strip()]
+URGENT_THRESHOLD = 8 # Analyses at or above this urgency count as "urgent" for metrics
+
+URGENT_SUBJECT_RE = re.compile(
+    r'\b(urgent|asap|immediately|escalat\w*|critical|outage|down|emergency|deadline|overdue|final notice|complaint|refund)\b',
+    re.IGNORECASE,
+)
+_KEYWORD_RE = re.compile(r"[a-z0-9][a-z0-9\-]{3,}")
+_STOP_WORDS = {"with", "from", "that", "this", "your", "have", "will", "about", "what", "when", "info"}
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def knowledge_keywords(topics: Iterable[str]) -> Set[str]:
+    """Keywords from knowledge base topics; mail touching them is likely to need a real reply."""
+    keywords = set()
+    for topic in topics:
+        keywords.update(w for w in _KEYWORD_RE.findall(topic.lower()) if w not in _STOP_WORDS)
+    return keywords
+
+
+def priority_score(email_data, keywords: Set[str]) -> int:
+    """Cheap 0-100 pre-score. Higher is analyzed first."""
+    score = 0
+    sender = email_data.sender.lower()
+    if any(s in sender for s in PRIORITY_SENDERS):
+        score += 40
+
+    subject = email_data.subject or ""
+    if URGENT_SUBJECT_RE.search(subject):
+        score += 30
+    if "!" in subject or subject.isupper():
+        score += 5
+    if subject.lower().startswith(("re:", "fwd:", "fw:")):
+        score += 5 # Ongoing conversation
+
+    if keywords:
+        text = f"{subject} {email_data.body[:2000]}".lower()
+        hits = sum(1 for k in keywords if k in text)
+        score += min(hits * 5, 20)
+
+    # Bulk mail goes to the back of the queue
+    if email_data.headers.get("List-Unsubscribe") or "CATEGORY_PROMOTIONS" in email_data.label_ids:
+        score -= 20
+    return max(0, min(score, 100))
+
+
+async def run_prioritized(
+    items: List[T],
+    score: Callable[[T], int],
+    worker: Callable[[T], Awaitable[R]],
+    concurrency: int = BATCH_LLM_CONCURRENCY,
+) -> AsyncIterator[R]:
+    """
+    Runs worker over items with bounded concurrency, highest score first
+    (ties keep arrival order), and yields results as they complete.
+    """
+    queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+    order = itertools.count()
+    for item in items:
+        queue.put_nowait((-score(item), next(order), item))
+
+    results: asyncio.Queue = asyncio.Queue()
+    done = object()
+
+    async def run_worker():
+        try:
+            while True:
+                try:
+                    _, _, item = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    await results.put(await worker(item))
+                except Exception as e:
+                    await results.put(e)
+        finally:
+            await results.put(done)
+
+    workers = [asyncio.create_task(run_worker()) for _ in range(max(1, min(concurrency, len(items))))]
+    remaining = len(workers)
+    try:
+        while remaining:
+            result = await results.get()
+            if result is done:
+                remaining -= 1
+                continue
+            if isinstance(result, Exception):
+                raise result
+            yield result
+    finally:
+        for task in workers:
+            task.cancel()
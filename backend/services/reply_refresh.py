@@ -0,0 +1,175 @@
+import os
+import asyncio
+from datetime import datetime
+from typing import Optional
+
+from sqlmodel import Session, select
+from sqlalchemy import or_, func
+
+from database import engine, write_engine
+from db_models import LoggedEmail, AISettings
+from services.ai_agent import generate_reply
+from services.batch_analysis import get_current_settings
+from services.deadlines import Deadline, ROUTE_BUDGET_SECONDS
+from services.executors import llm_executor
+from services.fair_scheduler import llm_fair_share
+from services.knowledge import load_knowledge, matching_knowledge, relevant_knowledge, knowledge_context, knowledge_ids, reply_versions
+from services.threads import get_thread, strip_quoted_history
+from services import leases
+from services.log_pipeline import get_logger
+
+logger = get_logger("reply_refresh")
+
+# Keeps suggested replies current after a settings or knowledge base change.
+# Unreplied emails whose reply was drafted with an older settings or knowledge
+# version are picked up a few at a time, highest urgency first:
+#   - tone/signature changed: the reply is redrafted
+#   - knowledge base changed: the reply is redrafted only if the set of matching
+#     entries for that email changed; otherwise its knowledge version is just bumped.
+#     An email that still matches no entry keeps its fallback-context reply
+# Classification is never redone. Emails without a reply are drafted on open anyway.
+REPLY_REFRESH_ENABLED = os.environ.get("REPLY_REFRESH_ENABLED", "true").lower() == "true"
+REPLY_REFRESH_BATCH = int(os.environ.get("REPLY_REFRESH_BATCH", "10")) # Redrafts per interval, all accounts
+REPLY_REFRESH_INTERVAL_SECONDS = int(os.environ.get("REPLY_REFRESH_INTERVAL_SECONDS", "60"))
+REPLY_REFRESH_LEASE = "reply-refresh"
+lease_holder = leases.new_holder() # Renews the lease across intervals
+# A run can take up to REPLY_REFRESH_BATCH route budgets; the lease is renewed
+# before each redraft for one budget plus slack
+REDRAFT_LEASE_SECONDS = ROUTE_BUDGET_SECONDS["reply-refresh"] + REPLY_REFRESH_INTERVAL_SECONDS
+
+stats = {"redrafted": 0, "unchanged": 0, "failed": 0, "runs": 0, "last_run_at": None, "last_error": None}
+
+
+def outdated_replies(account_id: int, settings_version: int, knowledge_version: int):
+    return (
+        select(LoggedEmail)
+        .where(LoggedEmail.account_id == account_id)
+        .where(LoggedEmail.is_replied == False)
+        .where(LoggedEmail.suggested_reply.is_not(None))
+        .where(or_(
+            LoggedEmail.reply_settings_version < settings_version,
+            LoggedEmail.reply_knowledge_version < knowledge_version,
+        ))
+    )
+
+
+def save_reply(email_id: int, reply: Optional[str], inputs: tuple):
+    """Stores a redrafted reply (or, with reply=None, only the new inputs) unless the email was replied to meanwhile."""
+    with Session(write_engine) as session:
+        row = session.get(LoggedEmail, email_id)
+        if row is None or row.is_replied:
+            return
+        if reply is not None:
+            row.suggested_reply = reply
+        row.reply_settings_version, row.reply_knowledge_version, row.reply_knowledge_ids = inputs
+        session.add(row)
+        session.commit()
+
+
+async def redraft_reply(session: Session, email: LoggedEmail, account_id: int, route: str = "draft-reply") -> Optional[str]:
+    """
+    Drafts the email's reply with the current settings and relevant knowledge, and stores
+    it with those inputs. Returns None when no model produced one within the route's budget.
+    """
+    knowledge = load_knowledge(session, account_id)
+    relevant = relevant_knowledge(knowledge, email.subject, email.body)
+    tone, signature = get_current_settings(session, account_id)
+    inputs = (*reply_versions(session, account_id), knowledge_ids(matching_knowledge(knowledge, email.subject, email.body)))
+    # A reply in a tracked thread is drafted from the thread summary, not the quoted history
+    thread = get_thread(session, account_id, email.thread_id)
+    body = strip_quoted_history(email.body) if thread and thread.summary else email.body
+
+    deadline = Deadline.for_route(route) # Starts before the wait for an LLM slot
+    try:
+        # Holds the reply to its budget even while a model call is still running
+        reply = await llm_fair_share.run(
+            account_id, llm_executor, deadline,
+            generate_reply,
+            sender=email.sender,
+            subject=email.subject,
+            body=body,
+            summary=email.summary,
+            context=knowledge_context(relevant),
+            tone=tone,
+            signature=signature,
+            deadline=deadline,
+            thread_summary=thread.summary if thread else None
+        )
+    except asyncio.TimeoutError:
+        reply = None
+    if reply is not None:
+        await asyncio.to_thread(save_reply, email.id, reply, inputs)
+    return reply
+
+
+async def refresh_outdated(limit: int = REPLY_REFRESH_BATCH) -> int:
+    """Brings up to `limit` outdated replies up to date. Returns the number of LLM redrafts."""
+    redrafted = 0
+    with Session(engine) as session:
+        accounts = session.exec(
+            select(AISettings.account_id).where(or_(AISettings.reply_version > 1, AISettings.knowledge_version > 1))
+        ).all()
+        for account_id in accounts:
+            settings_version, knowledge_version = reply_versions(session, account_id)
+            knowledge = None
+            # Knowledge-only changes that do not touch an email cost no LLM call, so they do not count against the limit
+            while redrafted < limit:
+                rows = session.exec(
+                    outdated_replies(account_id, settings_version, knowledge_version)
+                    .order_by(LoggedEmail.urgency.desc(), LoggedEmail.id.desc())
+                    .limit(limit)
+                ).all()
+                if not rows:
+                    break
+                knowledge = knowledge if knowledge is not None else load_knowledge(session, account_id)
+                for email in rows:
+                    if redrafted >= limit:
+                        break
+                    ids = knowledge_ids(matching_knowledge(knowledge, email.subject, email.body))
+                    if email.reply_settings_version == settings_version and email.reply_knowledge_ids == ids:
+                        await asyncio.to_thread(save_reply, email.id, None, (settings_version, knowledge_version, ids))
+                        stats["unchanged"] += 1
+                        continue
+                    if not await asyncio.to_thread(leases.try_acquire, REPLY_REFRESH_LEASE, REDRAFT_LEASE_SECONDS, lease_holder):
+                        return redrafted # Lapsed and taken by another process; it carries on from here
+                    redrafted += 1
+                    if await redraft_reply(session, email, account_id, route="reply-refresh") is None:
+                        stats["failed"] += 1
+                        return redrafted # Models are struggling; try again next interval
+                    stats["redrafted"] += 1
+                session.expire_all()
+    return redrafted
+
+
+async def reply_refresh_worker():
+    """Refreshes outdated replies periodically. Only the process holding the lease does the work."""
+    if not REPLY_REFRESH_ENABLED:
+        return
+    while True:
+        try:
+            if await asyncio.to_thread(leases.try_acquire, REPLY_REFRESH_LEASE, REPLY_REFRESH_INTERVAL_SECONDS, lease_holder):
+                redrafted = await refresh_outdated()
+                stats["runs"] += 1
+                stats["last_run_at"] = datetime.utcnow().isoformat()
+                stats["last_error"] = None
+                if redrafted:
+                    logger.info("✍️ Refreshed %d suggested replies after a settings/knowledge change", redrafted)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            stats["last_error"] = str(e)
+            logger.exception("Reply refresh worker error: %s", e)
+        await asyncio.sleep(REPLY_REFRESH_INTERVAL_SECONDS)
+
+
+def get_stats(session: Session, account_id: int) -> dict:
+    settings_version, knowledge_version = reply_versions(session, account_id)
+    pending = session.exec(
+        outdated_replies(account_id, settings_version, knowledge_version).with_only_columns(func.count())
+    ).one()
+    return {
+        "settings_version": settings_version,
+        "knowledge_version": knowledge_version,
+        "outdated_replies": pending,
+        **stats,
+    }
@@ -0,0 +1,156 @@
+import os
+import gzip
+import hashlib
+from typing import Iterable, List
+
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+from starlette.datastructures import Headers, MutableHeaders
+
+# Optional: orjson is several times faster than the stdlib encoder
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Optional: brotli is only offered to clients when the package is installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_MIN_BYTES = int(os.environ.get("COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4 # Fast enough for per-request compression, still smaller than gzip
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript")
+
+
+def render_json(content) -> bytes:
+    if orjson is None:
+        # The stdlib encoder knows no datetimes or models (rows_to_dicts keeps datetimes)
+        return JSONResponse(jsonable_encoder(content)).body
+    # default= handles anything that is not a plain type (e.g. a pydantic model)
+    return orjson.dumps(content, default=jsonable_encoder, option=orjson.OPT_NON_STR_KEYS)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson when available."""
+
+    def render(self, content) -> bytes:
+        return render_json(content)
+
+
+def rows_to_dicts(rows: Iterable) -> List[dict]:
+    """
+    Plain dicts for trusted SQLModel rows, read straight from the table columns.
+    Skips the per-row pydantic validation a response_model would do.
+    """
+    rows = list(rows)
+    if not rows:
+        return []
+    columns = [column.name for column in type(rows[0]).__table__.columns]
+    return [{name: getattr(row, name) for name in columns} for row in rows]
+
+
+def cached_json(request: Request, content) -> Response:
+    """
+    Renders content once and tags it with a weak ETag (weak because the
+    compression middleware may change the bytes on the wire). A request whose
+    If-None-Match matches gets an empty 304 instead of the body.
+    """
+    body = render_json(content)
+    etag = 'W/"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+    # no-cache: clients may keep the body but must revalidate every time
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison: W/"x" and "x" are the same
+    wanted = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == wanted for tag in if_none_match.split(","))
+
+
+def choose_encoding(accept_encoding: str):
+    offered = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            offered[name.strip().lower()] = quality
+    if brotli is not None and offered.get("br", 0) > 0:
+        return "br"
+    if offered.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+class CompressionMiddleware:
+    """
+    Brotli/gzip for complete responses of at least COMPRESSION_MIN_BYTES.
+    Streaming responses (e.g. the NDJSON batch stream) pass through untouched
+    so their lines still reach the client as soon as they are written.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if not encoding:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+
+        async def send_compressed(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message # Hold until we have seen the body
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            start, start_message = start_message, None
+            body = message.get("body", b"")
+            headers = MutableHeaders(raw=start["headers"])
+            content_type = headers.get("content-type", "")
+            if (
+                message.get("more_body", False)
+                or len(body) < self.minimum_size
+                or "content-encoding" in headers
+                or not content_type.startswith(COMPRESSIBLE_TYPES)
+            ):
+                await send(start)
+                await send(message)
+                return
+
+            if encoding == "br":
+                body = brotli.compress(body, quality=BROTLI_QUALITY)
+            else:
+                body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,146 @@
+import os
+import asyncio
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlmodel import Session, select
+from sqlalchemy import insert, delete, func, case, literal
+
+from database import write_engine
+from db_models import LoggedEmail, ArchivedEmail, ArchiveRollup
+from services import leases
+from services.log_pipeline import get_logger
+
+logger = get_logger("retention")
+
+# Tiered retention: LoggedEmail rows older than RETENTION_DAYS move to the
+# ArchivedEmail table in small batches, so the hot table (and its indexes) only
+# holds recent mail. Per-category counts go to ArchiveRollup first, so analytics
+# totals do not change when rows are archived. History and the email detail
+# endpoint can still read archived rows when asked for them.
+RETENTION_DAYS = int(os.environ.get("RETENTION_DAYS", "0")) # 0 disables archiving
+RETENTION_BATCH_SIZE = int(os.environ.get("RETENTION_BATCH_SIZE", "500"))
+RETENTION_INTERVAL_SECONDS = int(os.environ.get("RETENTION_INTERVAL_SECONDS", "3600"))
+RETENTION_LEASE = "retention"
+lease_holder = leases.new_holder() # Renews the lease across intervals
+
+stats = {"moved": 0, "runs": 0, "last_run_at": None, "last_error": None}
+
+
+def archive_batch(cutoff: datetime, batch_size: int = RETENTION_BATCH_SIZE) -> int:
+    """Moves up to batch_size rows created before cutoff into the archive, in one transaction."""
+    with Session(write_engine) as session:
+        # The newest row always stays hot: SQLite reuses the highest rowid once it is
+        # deleted, and archived rows keep their ids
+        newest_id = session.exec(select(func.max(LoggedEmail.id))).one()
+        ids = session.exec(
+            select(LoggedEmail.id)
+            .where(LoggedEmail.created_at < cutoff)
+            .where(LoggedEmail.id < newest_id)
+            .order_by(LoggedEmail.id)
+            .limit(batch_size)
+        ).all()
+        if not ids:
+            return 0
+
+        # A message re-analyzed after it was archived: the new row replaces the archived one
+        superseded = session.exec(
+            select(ArchivedEmail)
+            .join(LoggedEmail, (LoggedEmail.account_id == ArchivedEmail.account_id) & (LoggedEmail.gmail_message_id == ArchivedEmail.gmail_message_id))
+            .where(LoggedEmail.id.in_(ids))
+        ).all()
+        for old in superseded:
+            add_to_rollup(session, old.account_id, old.category, -1, -int(old.is_replied))
+            session.delete(old)
+        session.flush()
+
+        columns = [column.name for column in LoggedEmail.__table__.columns]
+        session.execute(
+            insert(ArchivedEmail).from_select(
+                columns + ["archived_at"],
+                select(*[LoggedEmail.__table__.c[name] for name in columns], literal(datetime.utcnow()))
+                .where(LoggedEmail.id.in_(ids)),
+            )
+        )
+
+        totals = session.exec(
+            select(LoggedEmail.account_id, LoggedEmail.category, func.count(), func.sum(case((LoggedEmail.is_replied, 1), else_=0)))
+            .where(LoggedEmail.id.in_(ids))
+            .group_by(LoggedEmail.account_id, LoggedEmail.category)
+        ).all()
+        for account_id, category, emails, replied in totals:
+            add_to_rollup(session, account_id, category, emails, replied or 0)
+
+        session.execute(delete(LoggedEmail).where(LoggedEmail.id.in_(ids)))
+        session.commit()
+        return len(ids)
+
+
+def add_to_rollup(session: Session, account_id: int, category: str, emails: int, replied: int):
+    rollup = session.get(ArchiveRollup, (account_id, category)) or ArchiveRollup(account_id=account_id, category=category)
+    rollup.emails += emails
+    rollup.replied += replied
+    session.add(rollup)
+
+
+def archive_expired(retention_days: int = RETENTION_DAYS) -> int:
+    """Archives everything past the retention age, batch by batch. Returns rows moved."""
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    total = 0
+    while True:
+        moved = archive_batch(cutoff)
+        total += moved
+        if moved < RETENTION_BATCH_SIZE:
+            return total
+
+
+async def retention_worker():
+    """Archives old rows periodically. Only the process holding the lease does the work."""
+    if RETENTION_DAYS <= 0:
+        return
+    while True:
+        try:
+            if await asyncio.to_thread(leases.try_acquire, RETENTION_LEASE, RETENTION_INTERVAL_SECONDS, lease_holder):
+                moved = await asyncio.to_thread(archive_expired)
+                stats["moved"] += moved
+                stats["runs"] += 1
+                stats["last_run_at"] = datetime.utcnow().isoformat()
+                stats["last_error"] = None
+                if moved:
+                    logger.info("🗄️ Archived %d emails older than %d days", moved, RETENTION_DAYS)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            stats["last_error"] = str(e)
+            logger.exception("Retention worker error: %s", e)
+        await asyncio.sleep(RETENTION_INTERVAL_SECONDS)
+
+
+def archived_count(session: Session, account_id: int) -> int:
+    total = session.exec(select(func.sum(ArchiveRollup.emails)).where(ArchiveRollup.account_id == account_id)).one()
+    return int(total or 0)
+
+
+def archived_message_ids(session: Session, account_id: int, gmail_ids: List[str]) -> set:
+    if not gmail_ids:
+        return set()
+    return set(session.exec(
+        select(ArchivedEmail.gmail_message_id)
+        .where(ArchivedEmail.account_id == account_id)
+        .where(ArchivedEmail.gmail_message_id.in_(gmail_ids))
+    ).all())
+
+
+def get_archived_email(session: Session, account_id: int, email_id: int) -> Optional[ArchivedEmail]:
+    email = session.get(ArchivedEmail, email_id)
+    return email if email and email.account_id == account_id else None
+
+
+def get_stats(session: Session, account_id: int) -> dict:
+    hot = session.exec(select(func.count()).select_from(LoggedEmail).where(LoggedEmail.account_id == account_id)).one()
+    return {
+        "retention_days": RETENTION_DAYS,
+        "hot_emails": hot,
+        "archived_emails": archived_count(session, account_id),
+        **stats,
+    }
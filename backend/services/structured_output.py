@@ -0,0 +1,255 @@
+import re
+import json
+import threading
+from collections import defaultdict
+from typing import Any, List, Tuple
+
+from models import EmailAnalysis
+
+# Turns an LLM reply into an EmailAnalysis without throwing away near-misses.
+# The reply is cut out of any markdown fence and surrounding prose, repaired
+# (single quotes, trailing commas, Python literals, truncated output) and then
+# coerced field by field ("8/10" -> 8, "lead" -> "Lead", string action items...).
+# Only replies with no usable JSON object left fail and cost another model call.
+# Reply drafts (the second analysis tier) are plain text; parse_reply only unwraps them.
+
+CATEGORIES = ["Work", "Lead", "Invoice", "Support", "Spam", "Personal", "Other"]
+SENTIMENTS = ["Positive", "Neutral", "Negative"]
+PRIORITIES = ["High", "Medium", "Low"]
+URGENCY_WORDS = {"critical": 10, "urgent": 9, "high": 8, "medium": 5, "moderate": 5, "normal": 5, "low": 2, "none": 1}
+PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+FENCE_RE = re.compile(r"```(?:json|JSON)?\s*\n?([\s\S]*?)(?:```|$)")
+NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?")
+BARE_WORD_RE = re.compile(r"\w+") # Unquoted words, non-ASCII letters included
+
+
+def extract_json_text(text: str) -> str:
+    """The reply without markdown fences or prose before the first '{'."""
+    fence = FENCE_RE.search(text)
+    if fence and "{" in fence.group(1):
+        text = fence.group(1)
+    start = text.find("{")
+    if start < 0:
+        raise ValueError("No JSON object in response")
+    return text[start:]
+
+
+def repair_json(text: str) -> str:
+    """
+    Rewrites almost-JSON into JSON: single-quoted strings, trailing commas and
+    True/False/None are fixed, text after the closing brace is dropped, and output
+    cut off mid-way is closed (open string, dangling key, open arrays/objects).
+    """
+    out: List[str] = []
+    stack: List[str] = [] # Open '{' / '['
+    quote = None # Quote char of the string being copied
+    key_start = None # Where an object key whose value has not started yet begins in out
+    expect_key = False
+    awaiting_value = False
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if quote:
+            if ch == "\\" and i + 1 < len(text):
+                nxt = text[i + 1]
+                out.append(nxt if (quote == "'" and nxt == "'") else ch + nxt)
+                i += 2
+                continue
+            if ch == quote:
+                out.append('"')
+                quote = None
+            elif ch == '"':
+                out.append('\\"') # Double quote inside a single-quoted string
+            elif ch == "\n":
+                out.append("\\n")
+            else:
+                out.append(ch)
+            i += 1
+            continue
+
+        if awaiting_value and not ch.isspace() and ch != ":":
+            key_start = None # The value has started; keep the pair even if it is cut off
+            awaiting_value = False
+
+        if ch in "\"'":
+            if stack and stack[-1] == "{" and expect_key:
+                key_start = len(out)
+                expect_key = False
+            quote = ch
+            out.append('"')
+        elif ch in "{[":
+            stack.append(ch)
+            expect_key = ch == "{"
+            out.append(ch)
+        elif ch in "}]":
+            _strip_trailing_comma(out)
+            if stack:
+                stack.pop()
+            out.append(ch)
+            key_start = None
+            expect_key = False
+            if not stack:
+                break # End of the top-level object; ignore whatever follows
+        elif ch == ":":
+            out.append(ch)
+            awaiting_value = key_start is not None
+        elif ch == ",":
+            out.append(ch)
+            key_start = None
+            expect_key = bool(stack) and stack[-1] == "{"
+        elif ch.isalpha() or ch == "_":
+            word = BARE_WORD_RE.match(text, i).group(0)
+            out.append(PYTHON_LITERALS.get(word, word))
+            i += len(word)
+            continue
+        else:
+            out.append(ch)
+        i += 1
+
+    if stack: # Truncated reply: close what is open
+        if quote:
+            out.append('"')
+        if key_start is not None: # Key without (complete) value
+            del out[key_start:]
+        _strip_trailing_comma(out)
+        while out and out[-1].strip() in (":", ""):
+            out.pop()
+        _strip_trailing_comma(out)
+        for opener in reversed(stack):
+            out.append("}" if opener == "{" else "]")
+    return "".join(out)
+
+
+def _strip_trailing_comma(out: List[str]):
+    end = len(out)
+    while end and out[end - 1].isspace():
+        end -= 1
+    if end and out[end - 1] == ",":
+        del out[end - 1:]
+
+
+def parse_json_object(text: str) -> Tuple[dict, bool]:
+    """Returns (object, repaired)."""
+    candidate = extract_json_text(text)
+    try:
+        data = json.loads(candidate)
+        repaired = False
+    except json.JSONDecodeError:
+        try:
+            data = json.loads(repair_json(candidate))
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Unrepairable JSON: {e}")
+        repaired = True
+    if not isinstance(data, dict):
+        raise ValueError("Response JSON is not an object")
+    return data, repaired
+
+
+def pick(value: Any, choices: List[str], default: str) -> str:
+    text = str(value or "").strip().lower()
+    for choice in choices:
+        if text == choice.lower() or text.startswith(choice.lower()):
+            return choice
+    return default
+
+
+def coerce_urgency(value: Any) -> int:
+    if isinstance(value, bool):
+        value = None
+    if isinstance(value, (int, float)):
+        number = value
+    else:
+        text = str(value or "").strip().lower()
+        match = NUMBER_RE.search(text)
+        number = float(match.group(0)) if match else URGENCY_WORDS.get(text.split(" ")[0] if text else "", 5)
+    return max(1, min(10, int(round(number))))
+
+
+def coerce_action_items(value: Any) -> List[dict]:
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        value = [value]
+    items = []
+    for item in value:
+        if isinstance(item, dict):
+            description = item.get("description") or item.get("task") or item.get("title") or item.get("action") or ""
+            priority = pick(item.get("priority"), PRIORITIES, "Medium")
+        else:
+            description, priority = item, "Medium"
+        if str(description).strip():
+            items.append({"description": str(description).strip(), "priority": priority})
+    return items
+
+
+def coerce_analysis(data: dict) -> EmailAnalysis:
+    reply = data.get("suggested_reply")
+    thread_summary = data.get("thread_summary")
+    return EmailAnalysis(
+        category=pick(data.get("category"), CATEGORIES, "Other"),
+        summary=str(data.get("summary") or ""),
+        sentiment=pick(data.get("sentiment"), SENTIMENTS, "Neutral"),
+        urgency=coerce_urgency(data.get("urgency")),
+        action_items=coerce_action_items(data.get("action_items")),
+        suggested_reply=str(reply) if reply is not None else None,
+        thread_summary=str(thread_summary) if thread_summary else None,
+    )
+
+
+def parse_analysis(text: str) -> Tuple[EmailAnalysis, bool]:
+    """Returns (analysis, repaired). Raises ValueError when there is no usable JSON object."""
+    data, repaired = parse_json_object(text)
+    if not data.get("summary") and not data.get("category"):
+        raise ValueError("JSON object has none of the analysis fields")
+    return coerce_analysis(data), repaired
+
+
+def parse_reply(text: str) -> Tuple[str, bool]:
+    """
+    Returns (reply, repaired) for a plain-text reply draft. A fence or a JSON wrapper
+    ({"suggested_reply": ...}) around the text is removed. Raises ValueError when empty.
+    """
+    reply, repaired = (text or "").strip(), False
+    fence = FENCE_RE.search(reply)
+    if fence:
+        reply, repaired = fence.group(1).strip(), True
+    if reply.startswith("{"):
+        try:
+            data, _ = parse_json_object(reply)
+            wrapped = data.get("suggested_reply") or data.get("reply")
+            if wrapped:
+                reply, repaired = str(wrapped).strip(), True
+        except ValueError:
+            pass
+    if not reply:
+        raise ValueError("Empty reply")
+    return reply, repaired
+
+
+class OutputStats:
+    """Per-model counts of clean, repaired and failed replies."""
+
+    def __init__(self):
+        self.counts = defaultdict(lambda: {"clean": 0, "repaired": 0, "failed": 0, "json_mode_rejected": 0})
+        self._lock = threading.Lock()
+
+    def record(self, model: str, outcome: str):
+        with self._lock:
+            self.counts[model][outcome] += 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = {}
+            for model, counts in self.counts.items():
+                replies = counts["clean"] + counts["repaired"] + counts["failed"]
+                stats[model] = {
+                    **counts,
+                    "replies": replies,
+                    "repair_rate": round(counts["repaired"] / replies, 3) if replies else 0.0,
+                    "parse_failure_rate": round(counts["failed"] / replies, 3) if replies else 0.0,
+                }
+            return stats
+
+
+output_stats = OutputStats()
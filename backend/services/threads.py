@@ -0,0 +1,152 @@
+import os
+import re
+import threading
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from sqlmodel import Session
+from sqlalchemy.exc import IntegrityError
+
+from database import write_engine
+from db_models import EmailThread
+
+# Thread-aware analysis, keyed on the Gmail threadId.
+# A new message in a thread we have analyzed before is sent to the LLM as the thread's
+# rolling summary plus the message without its quoted history, and the model returns
+# an updated summary. The prompt stays about the same size however long the thread gets.
+# Within one batch only the newest message of a thread is analyzed; the older ones
+# are saved with its analysis.
+THREADS_ENABLED = os.environ.get("THREADS_ENABLED", "true").lower() == "true"
+THREAD_SUMMARY_MAX_CHARS = int(os.environ.get("THREAD_SUMMARY_MAX_CHARS", "800"))
+
+# Where the quoted history of a reply starts
+QUOTE_HEADER_RES = [
+    re.compile(r"^On\b[^\n]{0,200}(?:\n[^\n]{0,200})?\bwrote:\s*$", re.MULTILINE), # Gmail, Apple Mail
+    re.compile(r"^-{2,}\s*Original Message\s*-{2,}", re.MULTILINE | re.IGNORECASE), # Outlook
+    re.compile(r"^_{10,}\s*\nFrom:", re.MULTILINE), # Outlook (web)
+    re.compile(r"^From:[^\n]*\n(?:[^\n]*\n)?Sent:", re.MULTILINE),
+]
+
+
+def strip_quoted_history(body: str) -> str:
+    """
+    The new part of a reply: everything from the first quote header ("On ... wrote:",
+    "-----Original Message-----"...) on is dropped, as are remaining "> " lines.
+    Returns the body unchanged if nothing would be left.
+    """
+    cut = len(body)
+    for pattern in QUOTE_HEADER_RES:
+        match = pattern.search(body)
+        if match:
+            cut = min(cut, match.start())
+    lines = [line for line in body[:cut].splitlines() if not line.lstrip().startswith(">")]
+    stripped = "\n".join(lines).strip()
+    return stripped or body
+
+
+def latest_per_thread(messages: list) -> Tuple[list, Dict[str, list]]:
+    """
+    Splits a batch into the messages to analyze (newest of each thread, plus messages
+    without a thread) and {newest message id: [older messages of its thread]}.
+    """
+    if not THREADS_ENABLED:
+        return list(messages), {}
+    newest = {}
+    for message in messages:
+        if not message.thread_id:
+            continue
+        current = newest.get(message.thread_id)
+        if current is None or message.internal_date >= current.internal_date:
+            newest[message.thread_id] = message
+
+    latest, superseded = [], {}
+    for message in messages:
+        if not message.thread_id or newest[message.thread_id] is message:
+            latest.append(message)
+        else:
+            superseded.setdefault(newest[message.thread_id].id, []).append(message)
+    return latest, superseded
+
+
+def get_thread(session: Session, account_id: int, thread_id: Optional[str]) -> Optional[EmailThread]:
+    if not THREADS_ENABLED or not thread_id:
+        return None
+    return session.get(EmailThread, (account_id, thread_id))
+
+
+def thread_context(session: Session, account_id: int, email_data) -> Optional[EmailThread]:
+    """The thread to analyze this message against, if it continues one we have summarized."""
+    thread = get_thread(session, account_id, email_data.thread_id)
+    if not thread or not thread.summary or thread.last_message_id == email_data.id:
+        return None
+    if email_data.internal_date < thread.last_internal_date:
+        return None # Older than what the summary covers; analyze on its own
+    return thread
+
+
+def rolling_summary(previous: Optional[str], analysis) -> str:
+    if analysis.thread_summary:
+        summary = analysis.thread_summary
+    elif previous:
+        summary = f"{previous} Then: {analysis.summary}"
+    else:
+        summary = analysis.summary
+    if len(summary) > THREAD_SUMMARY_MAX_CHARS:
+        summary = "..." + summary[-(THREAD_SUMMARY_MAX_CHARS - 3):] # Keep the most recent part
+    return summary
+
+
+def update_thread(account_id: int, email_data, analysis, superseded: int = 0):
+    """
+    Folds an analyzed message into its thread's rolling summary. Messages older than
+    the newest one already summarized only add to the count.
+    """
+    if not THREADS_ENABLED or not email_data.thread_id:
+        return
+    with Session(write_engine) as session:
+        def apply(thread: EmailThread):
+            thread.message_count += 1 + superseded
+            if email_data.internal_date >= thread.last_internal_date:
+                thread.summary = rolling_summary(thread.summary, analysis)
+                thread.last_message_id = email_data.id
+                thread.last_internal_date = email_data.internal_date
+            thread.updated_at = datetime.utcnow()
+            session.add(thread)
+
+        thread = session.get(EmailThread, (account_id, email_data.thread_id))
+        apply(thread or EmailThread(account_id=account_id, thread_id=email_data.thread_id))
+        try:
+            session.commit()
+        except IntegrityError:
+            # Another process started the thread first; fold into its row
+            session.rollback()
+            apply(session.get(EmailThread, (account_id, email_data.thread_id)))
+            session.commit()
+
+
+class ThreadStats:
+    """How thread messages were analyzed, and how much quoted history never reached the LLM."""
+
+    def __init__(self):
+        self.incremental = 0 # Against a rolling summary
+        self.superseded = 0 # Saved with the analysis of a newer message in the same batch
+        self.quoted_chars_skipped = 0
+        self._lock = threading.Lock()
+
+    def record(self, incremental: int = 0, superseded: int = 0, quoted_chars_skipped: int = 0):
+        with self._lock:
+            self.incremental += incremental
+            self.superseded += superseded
+            self.quoted_chars_skipped += quoted_chars_skipped
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": THREADS_ENABLED,
+                "incremental_analyses": self.incremental,
+                "superseded_messages": self.superseded,
+                "quoted_chars_skipped": self.quoted_chars_skipped,
+            }
+
+
+thread_stats = ThreadStats()
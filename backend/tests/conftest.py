@@ -0,0 +1,18 @@
+import os
+import tempfile
+
+import pytest
+
+# Tests get their own SQLite file; database.py reads DATABASE_URL when first imported
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="backend_tests_"), "test.db")
+
+
+@pytest.fixture
+def empty_db():
+    """The test database with every table dropped."""
+    from sqlmodel import SQLModel
+    from database import engine
+    import db_models
+
+    SQLModel.metadata.drop_all(engine)
+    return engine
@@ -0,0 +1,23 @@
+import asyncio
+
+from sqlmodel import Session, select
+
+import migrations
+from db_models import LoggedEmail
+from models import GmailMessage
+from services.batch_analysis import run_batch_analysis
+
+
+def test_prefilter_confidence_is_reported_and_stored(empty_db):
+    migrations.run_migrations()
+    newsletter = GmailMessage(
+        id="n1", sender="News <noreply@shop.example.com>", subject="This week's deals", body="Deals inside.",
+        label_ids=["INBOX", "CATEGORY_PROMOTIONS"], headers={"List-Unsubscribe": "<mailto:unsubscribe@shop.example.com>"},
+    )
+    with Session(empty_db) as session:
+        summary = asyncio.run(run_batch_analysis([newsletter], session))
+        row = session.exec(select(LoggedEmail)).one()
+
+    assert summary["prefiltered"] == 1
+    assert 0 < summary["prefilter_mean_confidence"] <= 1
+    assert (row.analysis_source, row.analysis_confidence) == ("prefilter", summary["prefilter_mean_confidence"])
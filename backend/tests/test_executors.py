@@ -0,0 +1,35 @@
+import asyncio
+import time
+
+import pytest
+
+from services.deadlines import Deadline
+from services.executors import BoundedExecutor, ExecutorSaturated
+from services.fair_scheduler import FairShareScheduler
+
+
+def test_timed_out_work_counts_until_its_thread_finishes():
+    executor = BoundedExecutor("test", max_workers=2, max_queue=1)
+    scheduler = FairShareScheduler(slots=2)
+
+    async def scenario():
+        deadline = Deadline(0.05)
+        for _ in range(2):
+            with pytest.raises(asyncio.TimeoutError):
+                await scheduler.run(1, executor, deadline, time.sleep, 0.4)
+        # The model calls are still running in their threads
+        assert executor.get_stats()["active"] == 2
+        assert scheduler.in_use == 2
+        queued = executor.submit(time.sleep, 0)
+        assert executor.get_stats()["queued"] == 1
+        with pytest.raises(ExecutorSaturated):
+            executor.admit()
+
+        await asyncio.sleep(0.6)
+        assert executor.get_stats()["active"] == 0
+        assert queued.done() and executor.completed == 3
+        assert scheduler.in_use == 0
+        executor.admit()
+        assert await scheduler.run(1, executor, Deadline(1), sum, [1, 2]) == 3
+
+    asyncio.run(scenario())
@@ -0,0 +1,56 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import update
+
+from database import write_engine
+from db_models import Lease
+from services import leases
+
+
+@pytest.fixture(autouse=True)
+def lease_table(empty_db):
+    Lease.__table__.create(empty_db)
+
+
+def test_only_the_holder_renews_and_releases():
+    holder = leases.try_acquire("job", 60)
+    assert holder
+    assert leases.try_acquire("job", 60) is None # Another request in this process
+    assert leases.try_acquire("job", 60, holder) == holder
+
+    leases.release("job", "someone-else")
+    assert leases.try_acquire("job", 60) is None
+    leases.release("job", holder)
+    assert leases.try_acquire("job", 60)
+
+
+def test_expired_lease_can_be_taken():
+    holder = leases.try_acquire("job", 60)
+    with write_engine.begin() as conn:
+        conn.execute(update(Lease).values(expires_at=datetime.utcnow() - timedelta(seconds=1)))
+
+    taker = leases.try_acquire("job", 60)
+    assert taker and taker != holder
+    assert leases.try_acquire("job", 60, holder) is None # The old holder lost it
+    assert leases.purge_expired() == 0
+
+
+def test_concurrent_acquire_has_one_winner():
+    threads = 8
+    barrier = threading.Barrier(threads)
+    results = []
+
+    def acquire():
+        barrier.wait()
+        results.append(leases.try_acquire("job", 60))
+
+    workers = [threading.Thread(target=acquire) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert len(results) == threads
+    assert len([holder for holder in results if holder]) == 1
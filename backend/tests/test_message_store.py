@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+import migrations
+from database import write_engine
+from db_models import CachedMessage
+from services.message_store import MessageStore
+
+
+def email(message_id: str) -> dict:
+    return {"id": message_id, "sender": "a@example.com", "subject": "Hi", "body": "Hello " + message_id}
+
+
+def test_workers_share_messages(empty_db):
+    migrations.run_migrations()
+    inbox_worker, batch_worker = MessageStore(max_items=1), MessageStore()
+
+    inbox_worker.put_many([email("m1"), email("m2")], account_id=1)
+    assert len(inbox_worker) == 1 # m1 left memory but not the shared table
+    assert inbox_worker.get("m1", account_id=1) == email("m1")
+    assert batch_worker.get_many(["m1", "m2", "m3"], account_id=1) == {"m1": email("m1"), "m2": email("m2")}
+    assert batch_worker.get("m1", account_id=2) is None # IDs are per mailbox
+
+    # Storing again (another inbox load) replaces the row
+    batch_worker.put(email("m1"), account_id=1)
+    batch_worker.discard("m1", account_id=1)
+    assert MessageStore().get("m1", account_id=1) is None
+    assert MessageStore().get("m2", account_id=1) == email("m2")
+
+
+def test_expired_messages_are_not_returned_and_pruned(empty_db):
+    migrations.run_migrations()
+    store = MessageStore(ttl_seconds=60)
+    store.put_many([email("old"), email("new")])
+    with write_engine.begin() as conn:
+        conn.execute(
+            update(CachedMessage).where(CachedMessage.message_id == "old")
+            .values(stored_at=datetime.utcnow() - timedelta(seconds=120))
+        )
+
+    assert MessageStore(ttl_seconds=60).get_many(["old", "new"]) == {"new": email("new")}
+    assert store.prune_expired() == 1
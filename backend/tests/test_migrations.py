@@ -0,0 +1,60 @@
+from sqlalchemy import inspect, text
+from sqlmodel import Session, select
+
+import migrations
+from db_models import LoggedEmail, SchemaMigration
+
+
+def columns(engine, table: str) -> set:
+    return {column["name"] for column in inspect(engine).get_columns(table)}
+
+
+def add_email(session: Session, message_id: str, summary: str):
+    session.add(LoggedEmail(
+        gmail_message_id=message_id, sender="a@example.com", subject="Hi", body="...",
+        category="Newsletter", summary=summary, sentiment="Neutral", urgency=2,
+    ))
+
+
+def test_fresh_database_has_nothing_pending(empty_db):
+    assert migrations.pending_migrations() == [
+        migrations.migration_label(version, name) for version, name, _ in migrations.MIGRATIONS
+    ]
+    migrations.run_migrations()
+    assert migrations.pending_migrations() == []
+    assert "key_hash" in columns(empty_db, "account")
+
+
+def test_old_database_gets_the_missing_columns(empty_db):
+    migrations.run_migrations()
+    with Session(empty_db) as session:
+        add_email(session, "m1", "Automated message: weekly digest")
+        add_email(session, "m2", "Customer asks for a refund")
+        session.commit()
+    # The schema as it was before versions 7 and 8
+    with empty_db.begin() as conn:
+        for table in ("loggedemail", "archivedemail"):
+            conn.execute(text(f'ALTER TABLE "{table}" DROP COLUMN "analysis_source"'))
+        conn.execute(text('ALTER TABLE "account" DROP COLUMN "key_hash"'))
+        conn.execute(text("DELETE FROM schemamigration WHERE version >= 7"))
+    assert migrations.pending_migrations()[:2] == ["0007_analysis_source", "0008_account_keys"]
+
+    migrations.run_migrations()
+
+    assert migrations.pending_migrations() == []
+    assert "analysis_source" in columns(empty_db, "archivedemail")
+    assert "key_hash" in columns(empty_db, "account")
+    with Session(empty_db) as session:
+        sources = dict(session.exec(select(LoggedEmail.gmail_message_id, LoggedEmail.analysis_source)).all())
+    assert sources == {"m1": "prefilter", "m2": None}
+
+
+def test_rerunning_is_a_no_op(empty_db):
+    migrations.run_migrations()
+    migrations.run_migrations()
+    # A migration applied but not recorded (process died in between) runs again safely
+    for _, _, apply in migrations.MIGRATIONS:
+        apply()
+    with Session(empty_db) as session:
+        versions = session.exec(select(SchemaMigration.version)).all()
+    assert sorted(versions) == [version for version, _, _ in migrations.MIGRATIONS]
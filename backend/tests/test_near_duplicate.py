@@ -0,0 +1,47 @@
+from sqlmodel import Session, select
+
+import migrations
+from db_models import EmailFingerprint
+from services.near_duplicate import NearDuplicateIndex
+
+BODY = "Your invoice {} for {} is ready. Log in to your billing portal to view and pay it before the due date."
+
+
+def test_processes_see_each_others_fingerprints(empty_db):
+    migrations.run_migrations()
+    worker_a, worker_b = NearDuplicateIndex(), NearDuplicateIndex()
+    worker_b.refresh()
+
+    worker_a.add(1, "billing@vendor.com", "Invoice 1001", BODY.format(1001, "$20.00"))
+    worker_a.add(2, "billing@vendor.com", "Invoice 1002", BODY.format(1002, "$35.50"), account_id=2)
+    assert worker_b.find("billing@vendor.com", "Invoice 1003", BODY.format(1003, "$9.99")) == []
+
+    assert worker_b.refresh() == 2
+    assert [row_id for row_id, _ in worker_b.find("billing@vendor.com", "Invoice 1003", BODY.format(1003, "$9.99"))] == [1]
+    assert worker_b.refresh() == 0 # Nothing new
+
+    worker_b.remove(1)
+    with Session(empty_db) as session:
+        assert session.exec(select(EmailFingerprint.email_id)).all() == [2]
+    assert len(NearDuplicateIndex()) == 0
+    fresh = NearDuplicateIndex()
+    fresh.refresh()
+    assert list(fresh.entries) == [2]
+
+
+def test_migration_fingerprints_llm_analyses_once(empty_db):
+    from db_models import LoggedEmail
+
+    migrations.run_migrations()
+    with Session(empty_db) as session:
+        for message_id, source in (("m1", "llm"), ("m2", "prefilter"), ("m3", None)):
+            session.add(LoggedEmail(
+                gmail_message_id=message_id, sender="billing@vendor.com", subject="Invoice", body=BODY.format(message_id, "$1"),
+                category="Other", summary="...", sentiment="Neutral", urgency=2, analysis_source=source,
+            ))
+        session.commit()
+
+    migrations.email_fingerprints()
+    migrations.email_fingerprints()
+    with Session(empty_db) as session:
+        assert sorted(session.exec(select(EmailFingerprint.email_id)).all()) == [1, 3]
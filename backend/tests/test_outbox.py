@@ -0,0 +1,14 @@
+import asyncio
+
+import migrations
+from services import outbox
+
+
+def test_idle_poll_does_not_take_the_write_lock(empty_db, monkeypatch):
+    migrations.run_migrations()
+
+    def begin():
+        raise AssertionError("write transaction opened with nothing due")
+
+    monkeypatch.setattr(outbox.write_engine, "begin", begin)
+    assert asyncio.run(outbox.deliver_once()) == 0
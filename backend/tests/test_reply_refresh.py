@@ -0,0 +1,54 @@
+import asyncio
+
+from sqlmodel import Session
+
+import migrations
+from db_models import AISettings, KnowledgeBase, LoggedEmail
+from services import reply_refresh
+from services.knowledge import bump_version, knowledge_ids, load_knowledge, matching_knowledge
+
+
+def add_email(session: Session, message_id: str, subject: str) -> LoggedEmail:
+    knowledge = load_knowledge(session)
+    email = LoggedEmail(
+        gmail_message_id=message_id, sender="a@example.com", subject=subject, body="Hello",
+        category="Support", summary="...", sentiment="Neutral", urgency=5, suggested_reply="Thanks!",
+        reply_settings_version=1, reply_knowledge_version=1,
+        reply_knowledge_ids=knowledge_ids(matching_knowledge(knowledge, subject, "Hello")),
+    )
+    session.add(email)
+    session.commit()
+    return email
+
+
+def test_unrelated_knowledge_change_keeps_fallback_replies(empty_db, monkeypatch):
+    migrations.run_migrations()
+    with Session(empty_db) as session:
+        session.add(AISettings())
+        session.add(KnowledgeBase(topic="Pricing", content="$10 a month"))
+        session.add(KnowledgeBase(topic="Refund policy", content="30 days"))
+        session.commit()
+        meeting = add_email(session, "m1", "Meeting next week")
+        warranty = add_email(session, "m2", "Is my warranty still valid?")
+        assert meeting.reply_knowledge_ids == warranty.reply_knowledge_ids == "" # Fallback context
+        meeting_id = meeting.id
+
+        session.add(KnowledgeBase(topic="Warranty", content="Two years"))
+        bump_version(session, 1, knowledge=True)
+        session.commit()
+
+    redrafted = []
+
+    async def fake_redraft(session, email, account_id, route="draft-reply"):
+        redrafted.append(email.gmail_message_id)
+        reply_refresh.save_reply(email.id, "Redrafted", (1, 2, "3"))
+        return "Redrafted"
+
+    monkeypatch.setattr(reply_refresh, "redraft_reply", fake_redraft)
+    monkeypatch.setattr(reply_refresh.leases, "try_acquire", lambda *args: "holder")
+    asyncio.run(reply_refresh.refresh_outdated())
+
+    assert redrafted == ["m2"] # Only the email the new entry matches
+    with Session(empty_db) as session:
+        meeting = session.get(LoggedEmail, meeting_id)
+        assert (meeting.reply_knowledge_version, meeting.reply_knowledge_ids, meeting.suggested_reply) == (2, "", "Thanks!")
@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+from sqlmodel import Session, select
+
+import migrations
+from db_models import ArchiveRollup, ArchivedEmail, LoggedEmail
+from services import retention
+
+OLD = datetime.utcnow() - timedelta(days=30)
+
+
+def add_email(session: Session, message_id: str, category: str, is_replied: bool = False, created_at: datetime = OLD):
+    session.add(LoggedEmail(
+        gmail_message_id=message_id, sender="a@example.com", subject=message_id, body="...",
+        category=category, summary="...", sentiment="Neutral", urgency=3, is_replied=is_replied, created_at=created_at,
+    ))
+    session.commit()
+
+
+def rollups(session: Session) -> dict:
+    return {row.category: (row.emails, row.replied) for row in session.exec(select(ArchiveRollup)).all()}
+
+
+def test_archiving_keeps_totals(empty_db):
+    migrations.run_migrations()
+    cutoff = datetime.utcnow() - timedelta(days=1)
+    with Session(empty_db) as session:
+        add_email(session, "m1", "Support", is_replied=True)
+        add_email(session, "m2", "Lead")
+        add_email(session, "m3", "Lead")
+
+        # The newest row stays hot even though it is old enough: its id would be reused
+        assert retention.archive_batch(cutoff) == 2
+        assert session.exec(select(LoggedEmail.gmail_message_id)).all() == ["m3"]
+        assert rollups(session) == {"Support": (1, 1), "Lead": (1, 0)}
+
+        # m1 is analyzed again after it was archived; archiving the new row replaces the old copy
+        add_email(session, "m1", "Work")
+        add_email(session, "m4", "Lead", created_at=datetime.utcnow())
+        assert retention.archive_batch(cutoff) == 2
+        assert sorted(session.exec(select(ArchivedEmail.gmail_message_id)).all()) == ["m1", "m2", "m3"]
+        assert rollups(session) == {"Support": (0, 0), "Lead": (2, 0), "Work": (1, 0)}
+        assert retention.archived_count(session, 1) == 3
+
+    from main import app
+
+    client = TestClient(app)
+    assert client.get("/api/analytics").json()["tasks_automated"] == 4
+    assert [email["gmail_message_id"] for email in client.get("/api/history").json()] == ["m4"]
+    history = client.get("/api/history", params={"include_archived": "true"}).json()
+    assert sorted(email["gmail_message_id"] for email in history) == ["m1", "m2", "m3", "m4"]
+    assert next(email["category"] for email in history if email["gmail_message_id"] == "m1") == "Work"
@@ -0,0 +1,58 @@
+import pytest
+
+from services.structured_output import parse_analysis, parse_reply
+
+
+def test_clean_json_is_not_repaired():
+    analysis, repaired = parse_analysis(
+        '{"category": "Lead", "summary": "Wants a demo", "sentiment": "Positive", "urgency": 7, "action_items": []}'
+    )
+    assert not repaired
+    assert (analysis.category, analysis.summary, analysis.sentiment, analysis.urgency) == ("Lead", "Wants a demo", "Positive", 7)
+
+
+def test_fenced_json_with_prose_single_quotes_and_trailing_commas():
+    raw = (
+        "Sure! Here it is:\n```json\n"
+        "{'category': 'lead', 'summary': 'Asks for a quote', 'urgency': '8/10', 'action_items': ['Send quote',],}\n"
+        "```"
+    )
+    analysis, repaired = parse_analysis(raw)
+    assert repaired
+    assert analysis.category == "Lead"
+    assert analysis.urgency == 8
+    assert analysis.sentiment == "Neutral" # Missing fields get their defaults
+    assert [(item.description, item.priority) for item in analysis.action_items] == [("Send quote", "Medium")]
+
+
+def test_python_literals():
+    analysis, repaired = parse_analysis('{"category": "Spam", "summary": "Prize", "urgency": None, "flag": True}')
+    assert repaired
+    assert analysis.category == "Spam"
+    assert analysis.urgency == 5
+
+
+def test_truncated_output_is_closed():
+    raw = '{"category": "Support", "summary": "Order is late", "urgency": "high", "action_items": [{"task": "Check shipment", "priority": "high"'
+    analysis, repaired = parse_analysis(raw)
+    assert repaired
+    assert analysis.category == "Support"
+    assert analysis.urgency == 8
+    assert [(item.description, item.priority) for item in analysis.action_items] == [("Check shipment", "High")]
+
+
+@pytest.mark.parametrize("raw", ["I cannot help with that.", "[1, 2]", '{"foo": 1}', '{"category": "Lead", "summary": "x", "urgency": é}'])
+def test_unusable_output_raises(raw):
+    with pytest.raises(ValueError):
+        parse_analysis(raw)
+
+
+def test_parse_reply():
+    assert parse_reply("```\nHi Dana,\nThanks.\n```") == ("Hi Dana,\nThanks.", True)
+    assert parse_reply('{"suggested_reply": "Hi there"}') == ("Hi there", True)
+    assert parse_reply("Plain reply") == ("Plain reply", False)
+
+
+def test_empty_reply_raises():
+    with pytest.raises(ValueError):
+        parse_reply("```\n\n```")
@@ -21,7 +21,7 @@ import {
     Menu,
     ChevronDown
 } from "lucide-react";
-import { LoggedEmail, getHistory, fetchGmailInbox, analyzeBatch, sendReply, createDraft, GmailMessage, getKnowledge, addKnowledge, deleteKnowledge, KnowledgeItem } from "@/lib/api";
+import { LoggedEmail, getHistory, fetchGmailInbox, analyzeBatch, sendReply, createDraft, draftReply, GmailMessage, getKnowledge, addKnowledge, deleteKnowledge, KnowledgeItem } from "@/lib/api";
 import Link from "next/link";
 import { useSearchParams } from "next/navigation";
 import { cn } from "@/lib/utils";
@@ -56,6 +56,20 @@ function HistoryPageContent() {
     const [isMobileMenuOpen, setIsMobileMenuOpen] = useState(false);
 
 
+    // Replies are drafted on demand: the first time a row without one is opened
+    const toggleRow = async (item: LoggedEmail) => {
+        if (expandedRow === item.id) {
+            setExpandedRow(null);
+            return;
+        }
+        setExpandedRow(item.id);
+        if (item.suggested_reply || item.is_replied) return;
+        const reply = await draftReply(item.id);
+        if (reply) {
+            setHistory(prev => prev.map(h => h.id === item.id ? { ...h, suggested_reply: reply } : h));
+        }
+    };
+
     const loadHistory = async () => {
         const data = await getHistory();
         setHistory(data);
@@ -481,7 +495,7 @@ function HistoryPageContent() {
                                                 <Fragment key={item.id}>
                                                     <tr
                                                         className="hover:bg-muted/30 transition-colors group cursor-pointer"
-                                                        onClick={() => setExpandedRow(expandedRow === item.id ? null : item.id)}
+                                                        onClick={() => toggleRow(item)}
                                                     >
                                                         <td className="px-6 py-4">
                                                             <div className="flex gap-2">
@@ -22,7 +22,7 @@ import {
   X
 } from "lucide-react";
 import { cn } from "@/lib/utils";
-import { analyzeEmail, type EmailAnalysis, getHistory, type LoggedEmail, getAnalytics, type AnalyticsData, checkGmailStatus, sendReply, createDraft, logoutUser } from "@/lib/api";
+import { analyzeEmail, type EmailAnalysis, getHistory, type LoggedEmail, getAnalytics, type AnalyticsData, checkGmailStatus, sendReply, createDraft, logoutUser, draftReply } from "@/lib/api";
 import Link from "next/link";
 import { useRouter } from "next/navigation";
 
@@ -78,6 +78,20 @@ export default function Dashboard() {
     }
   };
 
+  // Only urgent emails get a reply during analysis; draft the others when opened
+  const toggleEmail = async (email: LoggedEmail) => {
+    if (expandedEmailId === email.id) {
+      setExpandedEmailId(null);
+      return;
+    }
+    setExpandedEmailId(email.id);
+    if (email.suggested_reply || email.is_replied) return;
+    const reply = await draftReply(email.id);
+    if (reply) {
+      setHistory(prev => prev.map(h => h.id === email.id ? { ...h, suggested_reply: reply } : h));
+    }
+  };
+
   const formatTime = (dateStr: string) => {
     try {
       const date = new Date(dateStr + "Z");
@@ -402,7 +416,7 @@ export default function Dashboard() {
                   })().map((email) => (
                     <div key={email.id}>
                       <div
-                        onClick={() => setExpandedEmailId(expandedEmailId === email.id ? null : email.id)}
+                        onClick={() => toggleEmail(email)}
                         className="p-4 bg-muted/30 hover:bg-muted/50 rounded-xl border border-border/30 cursor-pointer transition-all group"
                       >
                         <div className="flex items-start justify-between mb-2">
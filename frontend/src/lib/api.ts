@@ -105,12 +105,13 @@ export async function fetchGmailInbox(limit: number, nextPageToken?: string | nu
 
 export async function analyzeBatch(messages: GmailMessage[]): Promise<{ status: string; message: string }> {
     try {
-        const response = await fetch(`${API_BASE_URL}/api/analyze-batch`, {
+        // Bodies are already cached server-side by /api/gmail-inbox, so only send the IDs
+        const response = await fetch(`${API_BASE_URL}/api/analyze-batch-ids`, {
             method: "POST",
             headers: {
                 "Content-Type": "application/json",
             },
-            body: JSON.stringify(messages),
+            body: JSON.stringify({ ids: messages.map((m) => m.id) }),
         });
         return await response.json();
     } catch (error) {
@@ -136,6 +137,18 @@ export async function sendReply(to: string, subject: string, body: string, email
     }
 }
 
+export async function draftReply(emailId: number): Promise<string | null> {
+    try {
+        const response = await fetch(`${API_BASE_URL}/api/emails/${emailId}/reply`, { method: "POST" });
+        if (!response.ok) return null;
+        const data = await response.json();
+        return data.suggested_reply;
+    } catch (error) {
+        console.error("Draft Reply API Error:", error);
+        return null;
+    }
+}
+
 export async function createDraft(to: string, subject: string, body: string, emailId?: number): Promise<{ status: string; message: string }> {
     try {
         const response = await fetch(`${API_BASE_URL}/api/create-draft`, {